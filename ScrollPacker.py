@@ -5,23 +5,64 @@
 # It creates one output font set containing only these characters that are really used in scroll text.
 # It is possible to work with fonts with a width and height from 1 to 8.
 # The script can be incorporated with existing workflow of compilation of a demo.
+# It can be imported as a module as well, then pack() or pack_file() return packed data without exiting.
 #
 # by tr1x / Agenda
 # version: 0.1
 # date: 2020-05-16
 
+import array
+import argparse
+import base64
+import concurrent.futures
+import hashlib
 import json
+import marshal
+import mmap
 import sys
 import ntpath
 import io
+import os
+import shutil
+import socket
+import tempfile
 import datetime
 import time
+import tracemalloc
+import zlib
 
-sys.stdout = io.TextIOWrapper(sys.stdout.detach(), encoding = 'utf-8')
-sys.stderr = io.TextIOWrapper(sys.stderr.detach(), encoding = 'utf-8')
+try:
+    # optional, fonts data is gathered with NumPy when it is available
+    import numpy
+except ImportError:
+    numpy = None
 
 debug = False
 version = "0.1"
+source_hash = None
+
+
+class ScrollPackerError(Exception):
+    pass
+
+
+class ConfigError(ScrollPackerError):
+    # JSON file with scroll data cannot be loaded or has wrong content. Errors found by validate_config() are all
+    # listed in the message, and given in errors as pairs of JSON path of wrong value and message.
+    def __init__(self, message, errors = None):
+        super().__init__(message)
+        self.errors = errors if errors != None else [('', message)]
+
+
+class ScrollTextError(ScrollPackerError):
+    # Scroll text cannot be packed with given fonts and lookups.
+    pass
+
+
+class FontFileError(ScrollPackerError):
+    # File containing fonts definitions cannot be read or is too short.
+    pass
+
 
 def eprint(msg, filename = ''):
     if len(filename) != 0:
@@ -37,12 +78,12 @@ def load_json(filename):
         json_file = open(filename, encoding = 'utf-8', mode = 'r')
         scroll_data = json.load(json_file)
     except FileNotFoundError:
-        eprint('JSON file not found!', sys.argv[1])
+        raise ConfigError('JSON file not found!')
     except json.JSONDecodeError as err:
-        eprint('Error while parsing JSON file at line ' + str(err.lineno) +
-               ' because "' + str(err.msg) + '"!', sys.argv[1])
+        raise ConfigError('Error while parsing JSON file at line ' + str(err.lineno) +
+                          ' because "' + str(err.msg) + '"!')
     except:
-        eprint('Error while opening or loading JSON file!', sys.argv[1])
+        raise ConfigError('Error while opening or loading JSON file!')
     finally:
         if json_file != None:
             json_file.close()
@@ -50,424 +91,768 @@ def load_json(filename):
     return scroll_data
 
 
-def parse_scroll_text(scroll_data):
-    if not 'scroll' in scroll_data:
-        eprint('No "scroll" name detected!', sys.argv[1])
+def tool_signature():
+    # Name and version of the tool with hash of its source, so cached outputs, libraries and fonts are not reused
+    # after any change of packing, even without a new version.
+    global source_hash
+    if source_hash == None:
+        with open(__file__, 'rb') as source_file:
+            source_hash = hashlib.sha256(source_file.read()).hexdigest()
+    return '"Scroll Packer" v' + version + ' ' + source_hash
 
-    if type(scroll_data['scroll']) != list:
-        eprint('"scroll" is not a list!', sys.argv[1])
 
-    index = 0
-    for p in scroll_data['scroll']:
-        if type(p) != str:
-            eprint('Entry at index #' + str(index) + ' in "scroll" is not a string!', sys.argv[1])
-        index += 1
+def add_config_error(errors, path, message):
+    errors.append((path, message))
 
-    input_scroll_text = ''
-    for p in scroll_data['scroll']:
-        input_scroll_text += str(p)
 
-    if len(str(input_scroll_text)) == 0:
-        eprint('Empty text of scroll!', sys.argv[1])
+def type_name(value_type):
+    return {int: 'an integer', str: 'a string', bool: 'a boolean', list: 'a list', dict: 'an object'}[value_type]
 
-    if debug == True:
-        print('* Input scroll text: "' + input_scroll_text + '"')
-        print('* Input scroll text length: ' + str(len(input_scroll_text)))
-        sys.stdout.flush()
 
-    return input_scroll_text
+def check_value(container, name, path, value_type, errors, required = True, empty = False, minimum = None,
+                maximum = None, allowed = None):
+    # Checks value of name in container (an object at path), and returns True when it is present and correct.
+    # Strings and lists have to be nonempty, unless empty is True.
+    if not name in container:
+        if required == True:
+            add_config_error(errors, path, 'No "' + name + '" name detected!')
+        return False
 
+    value = container[name]
+    path = path + '.' + name if len(path) != 0 else name
+    if type(value) != value_type:
+        add_config_error(errors, path, 'Value of "' + name + '" is not ' + type_name(value_type) + '!')
+        return False
 
-def parse_parameters(scroll_data):
-    if not 'parameters' in scroll_data:
-        eprint('No "parameters" name detected!', sys.argv[1])
+    if minimum != None and (value < minimum or value > maximum):
+        add_config_error(errors, path, 'Value of "' + name + '" has to be between ' + str(minimum) + ' and ' +
+                         str(maximum) + '!')
+        return False
 
-    if type(scroll_data['parameters']) != dict:
-        eprint('"parameters" is not an object!', sys.argv[1])
+    if allowed != None and not value in allowed:
+        add_config_error(errors, path, 'Value of "' + name + '" should be "' + '" or "'.join(allowed) + '"!')
+        return False
 
-    if not 'width' in scroll_data['parameters']:
-        eprint('No "width" name detected in "parameters"!', sys.argv[1])
+    if value_type in (str, list) and empty == False and len(value) == 0:
+        add_config_error(errors, path, 'Empty "' + name + '"!')
+        return False
 
-    if type(scroll_data['parameters']['width']) != int:
-        eprint('Value of "width" in "parameters" is not an integer"!', sys.argv[1])
+    return True
 
-    if scroll_data['parameters']['width'] < 1 or scroll_data['parameters']['width'] > 8:
-        eprint('Value of "width" in "parameters" has to be between 1 and 8!', sys.argv[1])
 
-    if not 'height' in scroll_data['parameters']:
-        eprint('No "height" name detected in "parameters"!', sys.argv[1])
+def check_scroll_text(scroll_data, errors):
+    # Scroll text is given either directly in "scroll", or in UTF-8 text files given in "scroll_file".
+    if 'scroll_file' in scroll_data:
+        if 'scroll' in scroll_data:
+            add_config_error(errors, '', 'Both "scroll" and "scroll_file" names detected!')
 
-    if type(scroll_data['parameters']['height']) != int:
-        eprint('Value of "height" in "parameters" is not an integer"!', sys.argv[1])
+        if type(scroll_data['scroll_file']) == list:
+            if check_value(scroll_data, 'scroll_file', '', list, errors):
+                for index, p in enumerate(scroll_data['scroll_file']):
+                    if type(p) != str or len(p) == 0:
+                        add_config_error(errors, 'scroll_file[' + str(index) + ']', 'Entry is not a filename!')
+        elif type(scroll_data['scroll_file']) != str:
+            add_config_error(errors, 'scroll_file', 'Value of "scroll_file" is neither a string nor a list!')
+        else:
+            check_value(scroll_data, 'scroll_file', '', str, errors)
+        return
 
-    if scroll_data['parameters']['height'] < 1 or scroll_data['parameters']['height'] > 8:
-        eprint('Value of "height" in "parameters" has to be between 1 and 8!', sys.argv[1])
+    if check_value(scroll_data, 'scroll', '', list, errors, empty = True):
+        for index, p in enumerate(scroll_data['scroll']):
+            if type(p) != str:
+                add_config_error(errors, 'scroll[' + str(index) + ']', 'Entry is not a string!')
 
-    if not 'begin' in scroll_data['parameters']:
-        eprint('No "begin" name detected in "parameters"!', sys.argv[1])
 
-    if type(scroll_data['parameters']['begin']) != int:
-        eprint('Value of "begin" in "parameters" is not an integer!', sys.argv[1])
+def get_scroll_files(scroll_data, base_dir = None):
+    files = scroll_data['scroll_file'] if type(scroll_data['scroll_file']) == list else [scroll_data['scroll_file']]
+    return [p if base_dir == None else os.path.join(base_dir, p) for p in files]
 
-    if scroll_data['parameters']['begin'] < 0 or scroll_data['parameters']['begin'] > 255:
-        eprint('Value of "begin" in "parameters" has to be between 0 and 255!', sys.argv[1])
 
-    if 'zero' in scroll_data['parameters']:
-        if type(scroll_data['parameters']['zero']) != bool:
-            eprint('Value of "zero" in "parameters" is not a boolean!', sys.argv[1])
+def iterate_scroll_text_chunks(scroll_data, base_dir = None, chunk_size = 65536):
+    # Yields entries of "scroll", or chunks of text read from files of "scroll_file" one by one.
+    validate_config(scroll_data, (check_scroll_text,))
+    if not 'scroll_file' in scroll_data:
+        yield from scroll_data['scroll']
+        return
 
-    if not 'language' in scroll_data['parameters']:
-        eprint('No "language" name detected in "parameters"!', sys.argv[1])
+    for filename in get_scroll_files(scroll_data, base_dir):
+        try:
+            with open(filename, encoding = 'utf-8', mode = 'r', newline = '') as scroll_file:
+                while True:
+                    chunk = scroll_file.read(chunk_size)
+                    if len(chunk) == 0:
+                        break
+                    yield chunk
+        except FileNotFoundError:
+            raise ConfigError('File "' + filename + '" of "scroll_file" not found!')
+        except (OSError, UnicodeDecodeError):
+            raise ConfigError('File "' + filename + '" of "scroll_file" cannot be read as UTF-8 text!')
 
-    if type(scroll_data['parameters']['language']) != str:
-        eprint('Value of "language" in "parameters" is not a string"!', sys.argv[1])
 
-    if scroll_data['parameters']['language'] != 'C' and scroll_data['parameters']['language'] != 'Assembler':
-        eprint('Value of "language" in "parameters" should be "C" or "Assembler"!', sys.argv[1])
+def load_scroll_entries(scroll_data, base_dir = None):
+    # Entries of "scroll", or whole content of each file of "scroll_file".
+    validate_config(scroll_data, (check_scroll_text,))
+    if not 'scroll_file' in scroll_data:
+        return scroll_data['scroll']
 
-    if not 'format' in scroll_data['parameters']:
-        eprint('No "format" name detected in "parameters"!', sys.argv[1])
+    return [''.join(iterate_scroll_text_chunks({'scroll_file': p})) for p in get_scroll_files(scroll_data, base_dir)]
 
-    if type(scroll_data['parameters']['format']) != str:
-        eprint('Value of "format" in "parameters" is not a string!', sys.argv[1])
 
-    if scroll_data['parameters']['format'] != 'dec' and scroll_data['parameters']['format'] != 'hex':
-        eprint('Value of "format" in "parameters" should be "dec" or "hex"!', sys.argv[1])
+def parse_scroll_text(scroll_data, base_dir = None, entries = None):
+    input_scroll_text = ''.join(load_scroll_entries(scroll_data, base_dir) if entries == None else entries)
 
-    if scroll_data['parameters']['height'] > 1:
-        if not 'consolidation' in scroll_data['parameters']:
-            eprint('No "consolidation" name detected in "parameters!', sys.argv[1])
+    if len(str(input_scroll_text)) == 0:
+        raise ConfigError('Empty text of scroll!')
 
-        if type(scroll_data['parameters']['consolidation']) != bool:
-            eprint('Value of "consolidation" in "parameters" is not a boolean!', sys.argv[1])
+    if debug == True:
+        print('* Input scroll text: "' + input_scroll_text + '"')
+        print('* Input scroll text length: ' + str(len(input_scroll_text)))
+        sys.stdout.flush()
 
-    if 'text_org' in scroll_data['parameters']:
-        if type(scroll_data['parameters']['text_org']) != str:
-            eprint('Value of "text_org" in "parameters" is not a string!', sys.argv[1])
+    return input_scroll_text
 
-    if 'fonts_org' in scroll_data['parameters']:
-        if type(scroll_data['parameters']['fonts_org']) != list:
-            eprint('"fonts_org" in "parameters" is not a list!', sys.argv[1])
 
-        for p in scroll_data['parameters']['fonts_org']:
+def check_parameters(scroll_data, errors):
+    if not check_value(scroll_data, 'parameters', '', dict, errors):
+        return
+    parameters = scroll_data['parameters']
+
+    check_value(parameters, 'width', 'parameters', int, errors, minimum = 1, maximum = 8)
+    check_value(parameters, 'height', 'parameters', int, errors, minimum = 1, maximum = 8)
+    check_value(parameters, 'begin', 'parameters', int, errors, minimum = 0, maximum = 255)
+    check_value(parameters, 'zero', 'parameters', bool, errors, required = False)
+    check_value(parameters, 'language', 'parameters', str, errors, allowed = ('C', 'Assembler'))
+    check_value(parameters, 'format', 'parameters', str, errors, allowed = ('dec', 'hex'))
+    if parameters.get('consolidation') != 'auto':
+        check_value(parameters, 'consolidation', 'parameters', bool, errors,
+                    required = type(parameters.get('height')) == int and parameters['height'] > 1)
+    check_value(parameters, 'dedup', 'parameters', bool, errors, required = False)
+    check_value(parameters, 'compression', 'parameters', str, errors, required = False,
+                allowed = ('none', 'rle', 'lz', 'auto'))
+    if check_value(parameters, 'window', 'parameters', int, errors, required = False) and\
+            not parameters['window'] in compression_windows:
+        add_config_error(errors, 'parameters.window', 'Value of "window" should be 16, 32, 64, 128 or 256!')
+    check_value(parameters, 'depacker_zp', 'parameters', str, errors, required = False)
+    check_value(parameters, 'segmented', 'parameters', bool, errors, required = False)
+    valid = check_value(parameters, 'bank_marker', 'parameters', int, errors, required = False, minimum = 0,
+                        maximum = 255) or not 'bank_marker' in parameters
+    valid = (check_value(parameters, 'bank_size', 'parameters', int, errors, required = False, minimum = 1,
+                         maximum = 256) or not 'bank_size' in parameters) and valid
+    if valid and parameters.get('segmented') == True and parameters.get('begin') in range(0, 256) and\
+            type(parameters['begin']) == int:
+        marker, size = bank_parameters(scroll_data)
+        if parameters['begin'] + size > 256:
+            add_config_error(errors, 'parameters.bank_size', 'Values of bytes of characters in a bank (from "begin" ' +
+                             'on) exceed 255!')
+        elif marker >= parameters['begin'] and marker < parameters['begin'] + size:
+            add_config_error(errors, 'parameters.bank_marker', 'Value of "bank_marker" is one of values of bytes ' +
+                             'of characters in a bank!')
+    check_value(parameters, 'text_org', 'parameters', str, errors, required = False, empty = True)
+    if check_value(parameters, 'fonts_org', 'parameters', list, errors, required = False, empty = True):
+        for index, p in enumerate(parameters['fonts_org']):
             if type(p) != str:
-                eprint('One of values of "fonts_org" in "parameters" is not a string!', sys.argv[1])
-
-
-def parse_fonts(scroll_data):
-    if not 'fonts' in scroll_data:
-        eprint('No "fonts" name detected!', sys.argv[1])
-
-    if type(scroll_data['fonts']) != list:
-        eprint('"fonts" is not a list!', sys.argv[1])
-
-    if len(scroll_data['fonts']) == 0:
-        eprint('No definition(s) of fonts detected!', sys.argv[1])
-
-    index = 0
-    for p in scroll_data['fonts']:
+                add_config_error(errors, 'parameters.fonts_org[' + str(index) + ']', 'Value is not a string!')
+    check_value(parameters, 'fonts_align', 'parameters', int, errors, required = False, minimum = 1, maximum = 65536)
+    if check_value(parameters, 'page_aligned', 'parameters', bool, errors, required = False) and\
+            parameters['page_aligned'] == True:
+        if parameters.get('language') != 'Assembler':
+            add_config_error(errors, 'parameters.page_aligned', 'Value of "page_aligned" can be used with ' +
+                             'Assembler only!')
+        for r in ('dedup', 'segmented'):
+            if parameters.get(r) == True:
+                add_config_error(errors, 'parameters.page_aligned', 'Value of "page_aligned" cannot be used with "' +
+                                 r + '"!')
+        if 'fonts_memory' in parameters:
+            add_config_error(errors, 'parameters.page_aligned', 'Value of "page_aligned" cannot be used with ' +
+                             '"fonts_memory"!')
+    if check_value(parameters, 'streams', 'parameters', bool, errors, required = False) and\
+            parameters['streams'] == True:
+        for r in ('segmented', 'page_aligned'):
+            if parameters.get(r) == True:
+                add_config_error(errors, 'parameters.streams', 'Value of "streams" cannot be used with "' + r + '"!')
+    if check_value(parameters, 'fonts_memory', 'parameters', list, errors, required = False):
+        for index, p in enumerate(parameters['fonts_memory']):
+            if type(p) != list or len(p) != 2 or parse_address(p[0]) == None or parse_address(p[1]) == None or\
+                    parse_address(p[0]) >= parse_address(p[1]):
+                add_config_error(errors, 'parameters.fonts_memory[' + str(index) + ']', 'Entry is not a range ' +
+                                 '[start, end) of addresses from $0000 to $10000!')
+        if len(parameters.get('fonts_org', [])) > 0:
+            add_config_error(errors, 'parameters.fonts_memory', 'Both "fonts_org" and "fonts_memory" names detected!')
+        if parameters.get('segmented') == True:
+            add_config_error(errors, 'parameters.fonts_memory', 'Value of "fonts_memory" cannot be used with ' +
+                             '"segmented"!')
+
+
+def check_fonts(scroll_data, errors):
+    library = get_library(scroll_data)
+    if 'library' in scroll_data and type(scroll_data['library']) != str and library == None:
+        add_config_error(errors, 'library', 'Value of "library" is not a string!')
+    elif type(scroll_data.get('library')) == str:
+        add_config_error(errors, 'library', 'Library "' + scroll_data['library'] + '" is not loaded!')
+
+    if not check_value(scroll_data, 'fonts', '', list, errors):
+        return
+
+    sets = {}
+    files = {}
+    for index, p in enumerate(own_entries(scroll_data, 'fonts')):
+        path = 'fonts[' + str(index) + ']'
         if type(p) != dict:
-            eprint('Entry at index #' + str(index) + ' in "fonts" is not an object!', sys.argv[1])
-
-        if not 'set' in p:
-            eprint('No "set" name detected in "fonts" at index #' + str(index) + '!', sys.argv[1])
-
-        if type(p['set']) != str:
-            eprint('Value of "set" in "fonts" at index #' + str(index) + ' is not a string!', sys.argv[1])
-
-        if len(p['set']) == 0:
-            eprint('Empty "set" in "fonts" at index #' + str(index) + '!', sys.argv[1])
-
-        if 'set_default' in p:
-            if type(p['set_default']) != str:
-                eprint('Value of "set_default" in "fonts" at index #' + str(index) + ' is not a string!', sys.argv[1])
+            add_config_error(errors, path, 'Entry is not an object!')
+            continue
+
+        if check_value(p, 'set', path, str, errors):
+            if p['set'] in sets:
+                add_config_error(errors, path + '.set', 'Set "' + p['set'] + '" is duplicated in "fonts" (first at ' +
+                                 'index #' + str(sets[p['set']]) + ')!')
+            elif library != None and p['set'] in library['sets']:
+                add_config_error(errors, path + '.set', 'Set "' + p['set'] + '" is duplicated in "fonts" of ' +
+                                 'library "' + library['file'] + '"!')
+            else:
+                sets[p['set']] = index
+
+        if check_value(p, 'set_default', path, str, errors, required = False, empty = True) and\
+                len(p['set_default']) > 0 and p.get('set') == p['set_default']:
+            add_config_error(errors, path + '.set_default', 'Values of "set" and "set_default" are the same!')
+
+        if check_value(p, 'set_or', path, str, errors, required = False, empty = True) and len(p['set_or']) > 0:
+            if p.get('set') == p['set_or']:
+                add_config_error(errors, path + '.set_or', 'Values of "set" and "set_or" are the same!')
+
+            if p.get('set_default') == p['set_or']:
+                add_config_error(errors, path + '.set_or', 'Values of "set_default" and "set_or" are the same!')
+
+        if check_value(p, 'file', path, str, errors):
+            if p['file'] in files and p.get('image') != files[p['file']][1]:
+                add_config_error(errors, path + '.image', 'File "' + p['file'] + '" is used with other "image" (at ' +
+                                 'index #' + str(files[p['file']][0]) + ')!')
+            elif not p['file'] in files:
+                files[p['file']] = (index, p.get('image'))
+        if check_value(p, 'image', path, dict, errors, required = False):
+            check_font_image(p['image'], path + '.image', errors)
+        check_value(p, 'lookup', path, str, errors)
+
+
+def check_font_image(image, path, errors):
+    # Font file given as PNG image: cells are cell_width x cell_height pixels, pixels of font have "bits" bits
+    # (8 / bits of them in a byte) and "palette" maps colors to values of bits. Rows of cells of "interleave" fonts
+    # alternate on the image.
+    bits = 1
+    if check_value(image, 'bits', path, int, errors, required = False, minimum = 1, maximum = 2):
+        bits = image['bits']
+    for name, multiple in (('cell_width', 8 // bits), ('cell_height', 8)):
+        if check_value(image, name, path, int, errors, required = False, minimum = 1, maximum = 1024) and\
+                image[name] % multiple != 0:
+            add_config_error(errors, path + '.' + name, 'Value of "' + name + '" is not a multiple of ' +
+                             str(multiple) + '!')
+    check_value(image, 'interleave', path, int, errors, required = False, minimum = 1, maximum = 256)
+    # with one bit, the color of the top left pixel is 0 and all other colors are 1 by default
+    if check_value(image, 'palette', path, dict, errors, required = bits != 1):
+        for color, value in image['palette'].items():
+            if len(color) != 7 or color[0] != '#' or len(color[1:].strip('0123456789abcdefABCDEF')) != 0:
+                add_config_error(errors, path + '.palette', 'Color "' + color + '" is not given as "#rrggbb"!')
+            elif type(value) != int or value < 0 or value >= 1 << bits:
+                add_config_error(errors, path + '.palette', 'Value of color "' + color + '" has to be between 0 ' +
+                                 'and ' + str((1 << bits) - 1) + '!')
+
+
+def check_lookups(scroll_data, errors):
+    if not check_value(scroll_data, 'lookups', '', list, errors, empty = True):
+        return
+
+    # number of offsets of each tag, if parameters are correct
+    cells = None
+    parameters = scroll_data.get('parameters')
+    if type(parameters) == dict and type(parameters.get('width')) == int and type(parameters.get('height')) == int:
+        if 1 <= parameters['width'] <= 8 and 1 <= parameters['height'] <= 8:
+            cells = parameters['width'] * parameters['height']
+
+    library = get_library(scroll_data)
+    if library != None and cells != None and len([p for p in library['cells'] if p != cells]) != 0:
+        add_config_error(errors, 'library', 'Wrong number of elements of "offsets" in library "' + library['file'] +
+                         '" (' + ', '.join(str(p) for p in library['cells']) + ' instead of ' + str(cells) + ')!')
+
+    lookups = {}
+    tags = {}
+    for index, p in enumerate(own_entries(scroll_data, 'lookups')):
+        path = 'lookups[' + str(index) + ']'
+        if type(p) != dict:
+            add_config_error(errors, path, 'Entry is not an object!')
+            continue
+
+        name = None
+        if check_value(p, 'lookup', path, str, errors):
+            name = p['lookup']
+            if name in lookups:
+                add_config_error(errors, path + '.lookup', 'Lookup "' + name + '" is duplicated in "lookups" ' +
+                                 '(first at index #' + str(lookups[name]) + ')!')
+            elif library != None and name in library['lookups_indexes']:
+                add_config_error(errors, path + '.lookup', 'Lookup "' + name + '" is duplicated in "lookups" of ' +
+                                 'library "' + library['file'] + '"!')
+            else:
+                lookups[name] = index
 
-            if len(p['set_default']) > 0 and p['set'] == p['set_default']:
-                eprint('Values of "set" and "set_default" are the same!', sys.argv[1])
+        if not check_value(p, 'mapping', path, list, errors):
+            continue
 
-        if 'set_or' in p:
-            if type(p['set_or']) != str:
-                eprint('Value of "set_or" in "fonts" at index #' + str(index) + ' is not a string!', sys.argv[1])
+        tags_of_lookup = set()
+        for index2, r in enumerate(p['mapping']):
+            path2 = path + '.mapping[' + str(index2) + ']'
+            if type(r) != dict:
+                add_config_error(errors, path2, 'Entry is not an object!')
+                continue
+
+            if check_value(r, 'tag', path2, str, errors, empty = True):
+                if r['tag'] in tags_of_lookup and len(r['tag']) > 0:
+                    add_config_error(errors, path2 + '.tag', 'Tag "' + r['tag'] + '" is duplicated in "mapping"!')
+                tags_of_lookup.add(r['tag'])
+                if name != None and not r['tag'] in tags:
+                    tags[r['tag']] = name
+
+            if check_value(r, 'offsets', path2, list, errors, empty = True):
+                if cells != None and len(r['offsets']) != cells:
+                    add_config_error(errors, path2 + '.offsets', 'Wrong number of elements of "offsets" (' +
+                                     str(len(r['offsets'])) + ' instead of ' + str(cells) + ')!')
+
+                for index3, w in enumerate(r['offsets']):
+                    if type(w) != int:
+                        add_config_error(errors, path2 + '.offsets[' + str(index3) + ']', 'Value is not an integer!')
+                    elif w < 0:
+                        add_config_error(errors, path2 + '.offsets[' + str(index3) + ']', 'Value is less than zero!')
+
+            check_value(r, 'or', path2, int, errors, required = False, minimum = 0, maximum = 255)
+
+    # references between "fonts" and "lookups", checked against indexes of names of tags and lookups (and the same
+    # indexes of library, whose own references were checked when it was compiled)
+    if type(scroll_data.get('fonts')) != list:
+        return
+    for index, p in enumerate(own_entries(scroll_data, 'fonts')):
+        if type(p) != dict:
+            continue
+        path = 'fonts[' + str(index) + ']'
+
+        for r, kind in (('set', 'Set'), ('set_default', '"Default" set'), ('set_or', '"Or" set')):
+            if type(p.get(r)) == str and p[r] in tags:
+                add_config_error(errors, path + '.' + r, kind + ' "' + p[r] + '" has the same name as tag of ' +
+                                 '"lookups" in lookup "' + tags[p[r]] + '"!')
+            elif library != None and type(p.get(r)) == str and p[r] in library['tags']:
+                add_config_error(errors, path + '.' + r, kind + ' "' + p[r] + '" has the same name as tag of ' +
+                                 '"lookups" in lookup "' + library['tags'][p[r]] + '" of library "' +
+                                 library['file'] + '"!')
+
+        if type(p.get('lookup')) == str and len(p['lookup']) > 0 and not p['lookup'] in lookups and\
+                (library == None or not p['lookup'] in library['lookups_indexes']):
+            add_config_error(errors, path + '.lookup', 'Lookup "' + p['lookup'] + '" refers to nonexistent entry ' +
+                             'of "lookups"!')
+
+    if library != None:
+        for name, kind in library['names']:
+            if name in tags:
+                add_config_error(errors, 'library', kind + ' "' + name + '" of library "' + library['file'] +
+                                 '" has the same name as tag of "lookups" in lookup "' + tags[name] + '"!')
+
+
+def format_config_error(error):
+    return error[0] + ': ' + error[1] if len(error[0]) != 0 else error[1]
+
+
+def validate_config(scroll_data, checks = (check_scroll_text, check_parameters, check_fonts, check_lookups)):
+    # Runs all checks, collecting errors with JSON paths of wrong values, so all of them are reported at once.
+    if type(scroll_data) != dict:
+        raise ConfigError('JSON file does not contain an object!')
+
+    errors = []
+    for check in checks:
+        check(scroll_data, errors)
+
+    if len(errors) == 1:
+        raise ConfigError(format_config_error(errors[0]), errors)
+    elif len(errors) > 1:
+        raise ConfigError(str(len(errors)) + ' errors found:\n' +
+                          '\n'.join('\t' + format_config_error(p) for p in errors), errors)
+
+
+# Fonts and lookups shared by many JSON files can be given in a library, a JSON file with "fonts" and/or
+# "lookups" named in "library". Library is compiled once into a cache file: a header, marshalled index (fonts,
+# lookups, indexes of names used by validation, and font files with their sizes, times of modification and hashes)
+# and a blob of all font files, which is memory-mapped when the cache file is read. Cache file is named after hash
+# of library, and it is compiled again when content of any of its font files changes.
+library_magic = b'SPLIB'
+library_format = 2
+library_cache_dir = None
+libraries = {}
+
+
+def get_library(scroll_data):
+    # Loaded library of scroll data (see resolve_library()), or None.
+    library = scroll_data.get('library') if type(scroll_data) == dict else None
+    return library if type(library) == dict else None
+
+
+def own_entries(scroll_data, name):
+    # Entries of "fonts" or "lookups" without the ones of library at their end, which were validated when library
+    # was compiled.
+    library = get_library(scroll_data)
+    if library == None:
+        return scroll_data[name]
+    return scroll_data[name][:len(scroll_data[name]) - len(library[name])]
+
+
+def check_library_data(library_data, errors):
+    # Library has "fonts" and/or "lookups", and its fonts refer to its own lookups.
+    if 'library' in library_data:
+        add_config_error(errors, 'library', 'Library cannot use other library!')
+    if not 'fonts' in library_data and not 'lookups' in library_data:
+        add_config_error(errors, '', 'Neither "fonts" nor "lookups" names detected!')
+    if 'fonts' in library_data:
+        check_fonts(library_data, errors)
+    check_lookups(dict(library_data, lookups = library_data.get('lookups', [])), errors)
+
+
+def get_file_signature(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def compile_library(filename, content, base_dir, cache_filename):
+    # Validates library and writes its cache file.
+    try:
+        library_data = json.loads(content.decode('utf-8'))
+    except json.JSONDecodeError as err:
+        raise ConfigError('Error while parsing library "' + filename + '" at line ' + str(err.lineno) +
+                          ' because "' + str(err.msg) + '"!')
+    except ValueError:
+        raise ConfigError('Error while loading library "' + filename + '"!')
+    try:
+        validate_config(library_data, (check_library_data,))
+    except ConfigError as err:
+        raise ConfigError('Library "' + filename + '": ' + str(err), err.errors)
+
+    fonts = library_data.get('fonts', [])
+    lookups = library_data.get('lookups', [])
+    index = {'file': filename, 'fonts': fonts, 'lookups': lookups,
+             'sets': {p['set']: i for i, p in enumerate(fonts)},
+             'names': [(p[r], kind) for p in fonts for r, kind in (('set', 'Set'), ('set_default', '"Default" set'),
+                                                                   ('set_or', '"Or" set')) if len(p.get(r, '')) > 0],
+             'lookups_indexes': {p['lookup']: i for i, p in enumerate(lookups)},
+             'tags': {r['tag']: p['lookup'] for p in reversed(lookups) for r in p['mapping']},
+             'cells': sorted(set(len(r['offsets']) for p in lookups for r in p['mapping'])),
+             'files': {}}
+
+    blob = []
+    start = 0
+    for p in fonts:
+        if p['file'] in index['files']:
+            continue
+        path = p['file'] if base_dir == None else os.path.join(base_dir, p['file'])
+        try:
+            with open(path, 'rb') as font_file:
+                content = font_file.read()
+            signature = get_file_signature(path)
+        except FileNotFoundError:
+            raise FontFileError('File "' + p['file'] + '" of library "' + filename + '" not found!')
+        except OSError:
+            raise FontFileError('File "' + p['file'] + '" of library "' + filename + '" cannot be opened!')
+        data = convert_font_image(content, p['file'], p['image']) if 'image' in p else content
+        index['files'][p['file']] = {'start': start, 'size': len(data), 'signature': signature,
+                                     'hash': hashlib.sha256(content).digest()}
+        blob.append(data)
+        start += len(data)
+
+    index_data = marshal.dumps(index)
+    # written under a temporary name first, so parallel jobs never see a partial cache file
+    try:
+        os.makedirs(os.path.dirname(cache_filename), exist_ok = True)
+        temporary = cache_filename + '.' + str(os.getpid()) + '.tmp'
+        with open(temporary, 'wb') as cache_file:
+            cache_file.write(library_magic + bytes([library_format]))
+            cache_file.write(len(index_data).to_bytes(4, byteorder = 'little') + index_data)
+            for data in blob:
+                cache_file.write(data)
+        os.replace(temporary, cache_filename)
+    except OSError:
+        raise ScrollPackerError('Library cache "' + cache_filename + '" cannot be written!')
+
+
+def open_library_cache(cache_filename):
+    # Returns index of library with memory-mapped cache file in 'blob', or None when cache file does not exist or
+    # was written in other format.
+    try:
+        with open(cache_filename, 'rb') as cache_file:
+            blob = mmap.mmap(cache_file.fileno(), 0, access = mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    header = len(library_magic) + 5
+    if blob[:len(library_magic) + 1] != library_magic + bytes([library_format]):
+        blob.close()
+        return None
+    length = int.from_bytes(blob[len(library_magic) + 1:header], byteorder = 'little')
+    try:
+        library = marshal.loads(blob[header:header + length])
+    except (EOFError, ValueError, TypeError):
+        blob.close()
+        return None
 
-            if len(p['set_or']) > 0 and p['set'] == p['set_or']:
-                eprint('Values of "set" and "set_or" are the same!', sys.argv[1])
+    library['blob'] = blob
+    library['blob_start'] = header + length
+    return library
 
-            if 'set_default' in p and len(p['set_default']) > 0 and len(p['set_or']) > 0 and\
-                    p['set_or'] == p['set_default']:
-                eprint('Values of "set_default" and "set_or" are the same!', sys.argv[1])
 
-        if not 'file' in p:
-            eprint('No "file" name detected in "fonts" at index #' + str(index) + '!', sys.argv[1])
+def is_library_current(library, base_dir = None):
+    # Font files are hashed again only when their size or time of modification differ from these in cache file.
+    for filename, p in library['files'].items():
+        path = filename if base_dir == None else os.path.join(base_dir, filename)
+        try:
+            if get_file_signature(path) == p['signature']:
+                continue
+            with open(path, 'rb') as font_file:
+                if hashlib.sha256(font_file.read()).digest() != p['hash']:
+                    return False
+        except OSError:
+            return False
+    return True
+
+
+def load_library(filename, base_dir = None, cache_dir = None):
+    """Loads library of fonts and lookups shared by JSON files, compiling it into cache file in cache_dir (by
+    default in directory ".scrollpacker" next to library) when needed. Paths of font files of library are relative
+    to base_dir, like these of JSON file. Libraries are kept in memory as well, so each one is loaded only once."""
+    path = filename if base_dir == None else os.path.join(base_dir, filename)
+    try:
+        with open(path, 'rb') as library_file:
+            content = library_file.read()
+    except FileNotFoundError:
+        raise ConfigError('Library "' + filename + '" not found!')
+    except OSError:
+        raise ConfigError('Library "' + filename + '" cannot be opened!')
+
+    key = hashlib.sha256((tool_signature() + '\0' + str(library_format) + '\0' + str(marshal.version) +
+                          '\0').encode('utf-8') + content).hexdigest()
+    loaded = libraries.get(os.path.abspath(path))
+    if loaded != None and loaded['key'] == key and is_library_current(loaded, base_dir):
+        return loaded
+
+    if cache_dir == None:
+        cache_dir = library_cache_dir if library_cache_dir != None else os.path.join(os.path.dirname(path),
+                                                                                      '.scrollpacker')
+    cache_filename = os.path.join(cache_dir, key + '.splib')
+    library = open_library_cache(cache_filename)
+    if library == None or not is_library_current(library, base_dir):
+        # memory-mapped cache file cannot be replaced on some systems
+        if library != None:
+            library['blob'].close()
+        if loaded != None and loaded['key'] == key:
+            loaded['blob'].close()
+        compile_library(filename, content, base_dir, cache_filename)
+        library = open_library_cache(cache_filename)
+        if library == None:
+            raise ScrollPackerError('Library cache "' + cache_filename + '" cannot be read!')
+
+    library['key'] = key
+    library['path'] = path
+    libraries[os.path.abspath(path)] = library
+    return library
+
+
+def resolve_library(scroll_data, base_dir = None):
+    # Returns a copy of scroll data with library named in "library" loaded and put in its place (or scroll data
+    # itself, when there is no library to load). Fonts and lookups of library are added after own ones of scroll
+    # data, so the first font set is still the own one, if any.
+    if type(scroll_data) != dict or type(scroll_data.get('library')) != str or len(scroll_data['library']) == 0:
+        return scroll_data
+
+    library = load_library(scroll_data['library'], base_dir)
+    scroll_data = dict(scroll_data)
+    for name in ('fonts', 'lookups'):
+        entries = scroll_data.get(name, [])
+        if type(entries) == list:
+            scroll_data[name] = entries + library[name]
+    scroll_data['library'] = library
+    return scroll_data
 
-        if type(p['file']) != str:
-            eprint('Value of "file" in "fonts" at index #' + str(index) + ' is not a string!', sys.argv[1])
 
-        if len(p['file']) == 0:
-            eprint('Empty "file" in "fonts" at index #' + str(index) + '!', sys.argv[1])
+def library_glyphs(scroll_data, used_tags):
+    # Font files of library used in scroll text, read from memory-mapped cache file, see load_glyphs().
+    glyphs = {}
+    library = get_library(scroll_data)
+    if library == None:
+        return glyphs
 
-        if not 'lookup' in p:
-            eprint('No "lookup" name detected in "fonts" at index #' + str(index) + '!', sys.argv[1])
+    for p in used_tags:
+        if p['file'] in library['files'] and not p['file'] in glyphs:
+            start = library['blob_start'] + library['files'][p['file']]['start']
+            glyphs[p['file']] = library['blob'][start:start + library['files'][p['file']]['size']]
+    return glyphs
 
-        if type(p['lookup']) != str:
-            eprint('Value of "lookup" in "fonts" at index #' + str(index) + ' is not a string!', sys.argv[1])
 
-        if len(str(p['lookup'])) == 0:
-            eprint('Empty "lookup" in "fonts" at index #' + str(index) + '!', sys.argv[1])
+def build_tokenizer_automaton(scroll_data, active_index, default_index):
+    # Builds a trie of all font sets identifiers and tags that can be found in scroll text when given font sets
+    # are active and default. Candidates are inserted in order of priority (sets, sets with "or", default sets,
+    # tags of active font set, tags of default font set, tags of other font sets), so when the same string is
+    # defined more than once, the first inserted candidate is kept.
+    active_set = scroll_data['fonts'][active_index]
+    default_set = scroll_data['fonts'][default_index]
+    candidates = []
 
+    index = 0
+    for p in scroll_data['fonts']:
+        candidates.append((p['set'], {'origin': 'fonts', 'set': p['set'], 'index': index, 'file': p['file']}))
         index += 1
 
+    index = 0
     for p in scroll_data['fonts']:
-        for r in scroll_data['fonts']:
-            if p['set'] == r['set'] and not p is r:
-                eprint('Set "' + p['set'] + '" is duplicated in "fonts"!', sys.argv[1])
-
-
-def parse_lookups(scroll_data):
-    if not 'lookups' in scroll_data:
-        eprint('No "lookups" name detected!', sys.argv[1])
-
-    if type(scroll_data['lookups']) != list:
-        eprint('"lookups" is not a list!', sys.argv[1])
+        if 'set_or' in p and len(str(p['set_or'])) > 0:
+            candidates.append((p['set_or'], {'origin': 'fonts_or', 'set': p['set'], 'index': index,
+                                             'file': p['file']}))
+        index += 1
 
     index = 0
-    for p in scroll_data['lookups']:
-        if type(p) != dict:
-            eprint('Entry at index #' + str(index) + ' in "lookups" is not an object!', sys.argv[1])
-
-        if not 'lookup' in p:
-            eprint('No "lookup" name detected in "lookups" at index #' + str(index) + '!', sys.argv[1])
-
-        if type(p['lookup']) != str:
-            eprint('Value of "lookup" in "lookups" at index #' + str(index) + ' is not a string!', sys.argv[1])
-
-        if len(str(p['lookup'])) == 0:
-            eprint('Empty "lookup" in "lookups" at index #' + str(index) + '!', sys.argv[1])
-
-        if not 'mapping' in p:
-            eprint('No "mapping" name detected in "lookups" in lookup "' + p['lookup'] + '"!', sys.argv[1])
-
-        if type(p['mapping']) != list:
-            eprint('"mapping" in "lookups" in lookup "' + p['lookup'] + '" is not a list!', sys.argv[1])
-
-        if len(p['mapping']) == 0:
-            eprint('No definition(s) of "mapping" detected in "lookups" in lookup "' + p['lookup'] + '"!', sys.argv[1])
-
-        index2 = 0
-        for r in p['mapping']:
-            if type(r) != dict:
-                eprint('Entry at index #' + str(index2) + ' in "mapping" of "lookups" in lookup "' +
-                       p['lookup'] + '" is not an object!', sys.argv[1])
-
-            if not 'tag' in r:
-                eprint('No "tag" name detected in "mapping" of "lookups" in lookup "' + p['lookup'] +
-                       '" at index #' + str(index2) + '!', sys.argv[1])
-
-            if type(r['tag']) != str:
-                eprint('Value of "tag" in "mapping" of "lookups" in lookup "' + p['lookup'] +
-                       '" at index #' + str(index2) + ' is not a string!', sys.argv[1])
-
-            if not 'offsets' in r:
-                eprint('No "offsets" name detected for tag "' + r['tag'] + '" ' +
-                       'in "mapping" of "lookups" in lookup "' + p['lookup'] +
-                       '" at index #' + str(index2) + '!', sys.argv[1])
-
-            if type(r['offsets']) != list:
-                eprint('"offsets" for tag "' + r['tag'] + '" in "mapping" of "lookups" in lookup "' + p['lookup'] +
-                       '" at index #' + str(index2) + ' is not a list!', sys.argv[1])
-
-            if len(r['offsets']) != scroll_data['parameters']['width'] * scroll_data['parameters']['height']:
-                eprint('Wrong number of elements of "offsets" for tag "' + r['tag'] + '" in "mapping" of "lookups" ' +
-                       'in "lookup "' + p['lookup'] + '" at index #' + str(index2) + '!', sys.argv[1])
-
-            for w in r['offsets']:
-                if type(w) != int:
-                    eprint('One of values of "offsets" for tag "' + r['tag'] + '" in "mapping" of "lookups" in ' +
-                           'lookup "' + p['lookup'] + '" at index #' + str(index2) + ' is not an integer!', sys.argv[1])
-
-                if w < 0:
-                    eprint('One of values of "offsets" for tag "' + r['tag'] +
-                           '" in "mapping" of "lookups" in lookup "' +
-                           p['lookup'] + '" at index #' + str(index2) + ' is less than zero!', sys.argv[1])
-
-            if 'or' in r:
-                if type(r['or']) != int:
-                    eprint('Value of "or" for tag "' + r['tag'] + '" in "mapping" of "lookups" in lookup "' +
-                           p['lookup'] + '" at index #' + str(index2) + ' is not an integer!', sys.argv[1])
-
-                if r['or'] < 0 or r['or'] > 255:
-                    eprint('Value of "or" for tag "' + r['tag'] + '" in "mapping" of "lookups" in lookup "' +
-                           p['lookup'] + '" at index #' + str(index2) + ' has to be between 0 and 255!', sys.argv[1])
-
-            index2 += 1
+    for p in scroll_data['fonts']:
+        if 'set_default' in p and len(str(p['set_default'])) > 0:
+            candidates.append((p['set_default'], {'origin': 'fonts_default', 'set': p['set'], 'index': index,
+                                                  'file': p['file']}))
         index += 1
 
     for p in scroll_data['lookups']:
-        for r in scroll_data['lookups']:
-                if p['lookup'] == r['lookup'] and not p is r:
-                    eprint('Lookup "' + p['lookup'] + '" is duplicated in "lookups"!', sys.argv[1])
-
-    for p in scroll_data['fonts']:
-        for r in scroll_data['lookups']:
-            for s in r['mapping']:
-                if s['tag'] == p['set']:
-                    eprint('Set "' + p['set'] + '" in "fonts" has the same name as tag of "lookups" in ' +
-                           'lookup "' + r['lookup'] + '"!', sys.argv[1])
-
-    for p in scroll_data['fonts']:
-        if 'set_default' in p:
-            for r in scroll_data['lookups']:
-                for s in r['mapping']:
-                    if s['tag'] == p['set_default']:
-                        eprint('"Default" set "' + p['set_default'] + '" in "fonts" has the same name as tag ' +
-                               'of "lookups" in lookup "' + r['lookup'] + '"!', sys.argv[1])
-        if 'set_or' in p:
-            for r in scroll_data['lookups']:
-                for s in r['mapping']:
-                    if s['tag'] == p['set_or']:
-                        eprint('"Or" set "' + p['set_or'] + '" in "fonts" has the same name as tag of "lookups" in ' +
-                               'lookup "' + r['lookup'] + '"!', sys.argv[1])
+        if p['lookup'] == active_set['lookup']:
+            for r in p['mapping']:
+                if len(str(r['tag'])) != 0:
+                    candidates.append((r['tag'], {'tag': r['tag'], 'offsets': r['offsets'], 'origin': 'lookups',
+                                                  'set': active_set['set'], 'file': active_set['file'],
+                                                  'active': True, 'mapping': r}))
+            break
 
     for p in scroll_data['lookups']:
-        for r in p['mapping']:
-            for s in p['mapping']:
-                if r['tag'] == s['tag'] and not r is s and len(r['tag']) > 0:
-                    eprint('Tag "' + r['tag'] + '" is duplicated in "mapping" of "lookups" in lookup "' + p['lookup'] +
-                           '!', sys.argv[1])
-
-    for p in scroll_data['fonts']:
-        for r in scroll_data['lookups']:
-            if p['lookup'] == r['lookup']:
-                break
-        else:
-            eprint('Lookup "' + p['lookup'] + '" in "fonts" refers to nonexistent entry of "lookups"!', sys.argv[1])
-
-
-def find_sets_or_tags_in_scroll_text(scroll_data, input_scroll_text):
-    active_set = scroll_data['fonts'][0]
-    isActiveSetWithOr = False
-    default_set = scroll_data['fonts'][0]
-    start_position = 0
-    used_tags = []
-    output_scroll_data = []
-
-    if debug == True:
-        print('* Default font set: ' + default_set['set'])
-        print('* Active font set: ' + active_set['set'])
-        sys.stdout.flush()
-
-    while start_position < len(input_scroll_text):
-        found_tag = {}
-
-        # 1st step: try to find font sets to be marked as active
-        index = 0
-        for p in scroll_data['fonts']:
-            position = input_scroll_text.find(p['set'], start_position)
-            if (position != -1 and len(found_tag) == 0) or\
-                    (position != -1 and len(found_tag) != 0 and position < found_tag['position']):
-                found_tag = {'position': position, 'length': len(p['set']), 'set': p['set'], 'origin': 'fonts',
-                             'index': index, 'file': p['file']}
-            index += 1
-
-        # 2nd step: try to find font sets to be marked as active with "or"
-        index = 0
-        for p in scroll_data['fonts']:
-            if 'set_or' in p and len(str(p['set_or'])) > 0:
-                position = input_scroll_text.find(p['set_or'], start_position)
-                if (position != -1 and len(found_tag) == 0) or\
-                        (position != -1 and len(found_tag) != 0 and position < found_tag['position']):
-                    found_tag = {'position': position, 'length': len(p['set_or']), 'set': p['set'],
-                                 'origin': 'fonts_or', 'index': index, 'file': p['file']}
-            index += 1
+        if p['lookup'] == default_set['lookup']:
+            for r in p['mapping']:
+                if len(str(r['tag'])) != 0:
+                    candidates.append((r['tag'], {'tag': r['tag'], 'offsets': r['offsets'], 'origin': 'lookups',
+                                                  'set': default_set['set'], 'file': default_set['file']}))
+            break
 
-        # 3rd step: try to find font sets to be marked as default
-        index = 0
-        for p in scroll_data['fonts']:
-            if 'set_default' in p and len(str(p['set_default'])) > 0:
-                position = input_scroll_text.find(p['set_default'], start_position)
-                if (position != -1 and len(found_tag) == 0) or\
-                        (position != -1 and len(found_tag) != 0 and position < found_tag['position']):
-                    found_tag = {'position': position, 'length': len(p['set_default']), 'set': p['set'],
-                                 'origin': 'fonts_default', 'index': index, 'file': p['file']}
-            index += 1
-
-        # 4th: try to find tags in currently active font set
-        for p in scroll_data['lookups']:
-            if p['lookup'] == active_set['lookup']:
-                for r in p['mapping']:
-                    if len(str(r['tag'])) != 0:
-                        position = input_scroll_text.find(r['tag'], start_position)
-                        if (position != -1 and len(found_tag) == 0) or\
-                                (position != -1 and len(found_tag) != 0 and position < found_tag['position']):
-                            found_tag = {'position': position, 'length': len(r['tag']), 'tag': r['tag'],
-                                         'offsets': r['offsets'], 'origin': 'lookups',
-                                         'set': active_set['set'], 'file': active_set['file']}
-                            if isActiveSetWithOr == True and 'or' in r:
-                                found_tag['or'] = r['or']
-                break
-
-        # 5th: try to find tags in default font set
-        for p in scroll_data['lookups']:
-            if p['lookup'] == default_set['lookup']:
-                for r in p['mapping']:
-                    if len(str(r['tag'])) != 0:
-                        position = input_scroll_text.find(r['tag'], start_position)
-                        if (position != -1 and len(found_tag) == 0) or\
-                                (position != -1 and len(found_tag) != 0 and position < found_tag['position']):
-                            found_tag = {'position': position, 'length': len(r['tag']), 'tag': r['tag'],
-                                         'offsets': r['offsets'], 'origin': 'lookups',
-                                         'set': default_set['set'], 'file': default_set['file']}
-                break
-
-        # 6th: try to find tags in any font sets
-        for p in scroll_data['lookups']:
-            if p['lookup'] != active_set['lookup'] and p['lookup'] != default_set['lookup']:
-                for r in p['mapping']:
-                    if len(str(r['tag'])) != 0:
-                        position = input_scroll_text.find(r['tag'], start_position)
-                        if (position != -1 and len(found_tag) == 0) or\
-                                (position != -1 and len(found_tag) != 0 and position < found_tag['position']):
-                            for s in scroll_data['fonts']:
-                                if s['lookup'] == p['lookup']:
-                                    break
-                            found_tag = {'position': position, 'length': len(r['tag']), 'tag': r['tag'],
-                                         'offsets': r['offsets'], 'origin': 'lookups',
-                                         'set': s['set'], 'file': s['file']}
+    for p in scroll_data['lookups']:
+        if p['lookup'] != active_set['lookup'] and p['lookup'] != default_set['lookup']:
+            for s in scroll_data['fonts']:
+                if s['lookup'] == p['lookup']:
+                    break
+            for r in p['mapping']:
+                if len(str(r['tag'])) != 0:
+                    candidates.append((r['tag'], {'tag': r['tag'], 'offsets': r['offsets'], 'origin': 'lookups',
+                                                  'set': s['set'], 'file': s['file']}))
+
+    automaton = {}
+    rank = 0
+    for text, found_tag in candidates:
+        node = automaton
+        for c in text:
+            node = node.setdefault(c, {})
+        if not None in node:
+            node[None] = (rank, found_tag)
+        rank += 1
+
+    return automaton
+
+
+def match_tokenizer_automaton(automaton, input_scroll_text, start_position):
+    # Walks the trie from given position and returns the candidate of the highest priority (the lowest rank)
+    # among all candidates that begin at this position.
+    best = None
+    node = automaton
+    position = start_position
+    while position < len(input_scroll_text):
+        node = node.get(input_scroll_text[position])
+        if node == None:
+            break
+        position += 1
+        if None in node and (best == None or node[None][0] < best[0]):
+            best = (node[None][0], node[None][1], position - start_position)
+
+    if best == None:
+        return {}
+
+    found_tag = best[1].copy()
+    found_tag['position'] = start_position
+    found_tag['length'] = best[2]
+    return found_tag
+
+
+def new_tokenizer_state():
+    return {'position': 0, 'active_index': 0, 'isActiveSetWithOr': False, 'default_index': 0, 'used_tags': [],
+            'tags_indexes': {}, 'output_scroll_data': {'bytes': array.array('H'), 'or': array.array('B'),
+                                                       'zero': False, 'segments': None},
+            'automatons': {}}
+
+
+def tokenize_scroll_text(scroll_data, input_scroll_text, state, boundaries = None, checkpoints = None, end = None,
+                         offset = 0):
+    # Tokenizes scroll text from the position stored in state until the end of text (or until a character beginning
+    # at or after end), and stores the state back. When boundaries (positions of the beginning of entries of
+    # "scroll") are given, a checkpoint with the state at the first character (or set) beginning at or after each
+    # boundary is appended to checkpoints. Offset is only added to positions reported in errors.
+    active_index = state['active_index']
+    isActiveSetWithOr = state['isActiveSetWithOr']
+    default_index = state['default_index']
+    start_position = state['position']
+    used_tags = state['used_tags']
+    tags_indexes = state['tags_indexes']
+    output_scroll_data = state['output_scroll_data']
+    automatons = state['automatons']
+    if end == None:
+        end = len(input_scroll_text)
+
+    while start_position < end:
+        while boundaries != None and len(checkpoints) < len(boundaries) and\
+                start_position >= boundaries[len(checkpoints)]:
+            checkpoints.append({'position': start_position, 'active_index': active_index,
+                                'isActiveSetWithOr': isActiveSetWithOr, 'default_index': default_index,
+                                'bytes': len(output_scroll_data['bytes']), 'used_tags': len(used_tags)})
+
+        # one automaton per pair of active and default font sets, built on first use
+        if not (active_index, default_index) in automatons:
+            automatons[(active_index, default_index)] = build_tokenizer_automaton(scroll_data, active_index,
+                                                                                  default_index)
+        found_tag = match_tokenizer_automaton(automatons[(active_index, default_index)], input_scroll_text,
+                                              start_position)
+        if 'active' in found_tag:
+            if isActiveSetWithOr == True and 'or' in found_tag['mapping']:
+                found_tag['or'] = found_tag['mapping']['or']
+            del found_tag['active']
+            del found_tag['mapping']
 
         if (len(found_tag) == 0 or found_tag['position'] != start_position):
             min = start_position - 5 if start_position - 5 >= 0 else 0
             max = start_position + 6 if start_position + 5 <= len(input_scroll_text) else len(input_scroll_text)
 
-            eprint('Character "' + input_scroll_text[start_position] + '" «' + input_scroll_text[min:max] +
-                   '» at position ' + str(start_position) +
-                   ' in scroll text is not defined in any "tag" of "lookups" nor any "set" of "fonts"!', sys.argv[1])
+            raise ScrollTextError('Character "' + input_scroll_text[start_position] + '" «' +
+                                  input_scroll_text[min:max] + '» at position ' + str(start_position + offset) +
+                                  ' in scroll text is not defined in any "tag" of "lookups" nor any "set" of "fonts"!')
 
         if found_tag['origin'] == 'fonts':
             if debug == True:
                 print('* Active font set changed to: ' + found_tag['set'])
                 sys.stdout.flush()
-            active_set = scroll_data['fonts'][found_tag['index']]
+            active_index = found_tag['index']
             isActiveSetWithOr = False
             start_position += found_tag['length']
         elif found_tag['origin'] == 'fonts_or':
             if debug == True:
                 print('* Active font set changed to: ' + found_tag['set'] + ' with "or"')
                 sys.stdout.flush()
-            active_set = scroll_data['fonts'][found_tag['index']]
+            active_index = found_tag['index']
             isActiveSetWithOr = True
             start_position += found_tag['length']
         elif found_tag['origin'] == 'fonts_default':
             if debug == True:
                 print('* Default font set changed to: ' + found_tag['set'])
                 sys.stdout.flush()
-            default_set = scroll_data['fonts'][found_tag['index']]
+            default_index = found_tag['index']
             start_position += found_tag['length']
         else:
-            r = {}
-            for p in used_tags:
-                if p['tag'] == found_tag['tag'] and p['set'] == found_tag['set']:
-                    r = p
-            if len(r) == 0:
+            key = (found_tag['tag'], found_tag['set'])
+            if not key in tags_indexes:
                 byte = len(used_tags)
+                tags_indexes[key] = byte
                 if 'or' in found_tag:
                     used_tags.append({'byte': byte, 'tag': found_tag['tag'], 'offsets': found_tag['offsets'],
                                       'set': found_tag['set'], 'file': found_tag['file'], 'or': found_tag['or']})
@@ -480,260 +865,2795 @@ def find_sets_or_tags_in_scroll_text(scroll_data, input_scroll_text):
                     else:
                         print('* New tag found: "' + found_tag['tag'] + '", set: ' + found_tag['set'])
                     sys.stdout.flush()
-                if 'or' in found_tag:
-                    output_scroll_data.append({'index': len(output_scroll_data), 'byte': byte, 'tag': found_tag['tag'],
-                                               'offsets': found_tag['offsets'], 'set': found_tag['set'],
-                                               'file': found_tag['file'], 'or': found_tag['or']})
-                else:
-                    output_scroll_data.append({'index': len(output_scroll_data), 'byte': byte, 'tag': found_tag['tag'],
-                                               'offsets': found_tag['offsets'], 'set': found_tag['set'],
-                                               'file': found_tag['file']})
             else:
-                output_scroll_data.append(r.copy())
+                byte = tags_indexes[key]
                 if debug == True:
                     if 'or' in found_tag:
-                        print('* Existing tag found: "' + p['tag'] + '", set: ' + p['set'] + ' with "or"')
+                        print('* Existing tag found: "' + found_tag['tag'] + '", set: ' + found_tag['set'] +
+                              ' with "or"')
                     else:
-                        print('* Existing tag found: "' + p['tag'] + '", set: ' + p['set'])
+                        print('* Existing tag found: "' + found_tag['tag'] + '", set: ' + found_tag['set'])
                     sys.stdout.flush()
-                if 'or' in found_tag:
-                    output_scroll_data[len(output_scroll_data) - 1]['or'] = found_tag['or']
-                else:
-                    if 'or' in output_scroll_data[len(output_scroll_data) - 1]:
-                        del output_scroll_data[len(output_scroll_data) - 1]['or']
+
+            output_scroll_data['bytes'].append(byte)
+            output_scroll_data['or'].append(found_tag['or'] if 'or' in found_tag else 0)
 
             start_position += found_tag['length']
 
+    state['position'] = start_position
+    state['active_index'] = active_index
+    state['isActiveSetWithOr'] = isActiveSetWithOr
+    state['default_index'] = default_index
+
+
+def tokenize_scroll_text_chunks(scroll_data, chunks, state):
+    # Generator of pairs of byte and value of "or" of characters of scroll text given in chunks. Only characters
+    # not tokenized yet (plus a few for reporting errors) are kept between chunks, and a character is tokenized
+    # only when all characters its matching (or error message) can look at are known, so sets and tags spanning
+    # chunks are found.
+    look_ahead = max(max_candidate_length(scroll_data), 6)
+    output_scroll_data = state['output_scroll_data']
+    text = ''
+    offset = 0
+    final = False
+    chunks = iter(chunks)
+    while not final:
+        chunk = next(chunks, None)
+        if chunk == None:
+            final = True
+            if len(text) == 0:
+                raise ConfigError('Empty text of scroll!')
+        else:
+            text = text[state['position'] - 5:] if state['position'] > 5 else text
+            if state['position'] > 5:
+                offset += state['position'] - 5
+                state['position'] = 5
+            text += chunk
+
+        tokenize_scroll_text(scroll_data, text, state, end = len(text) if final else len(text) - look_ahead + 1,
+                             offset = offset)
+        if len(state['used_tags']) + scroll_data['parameters']['begin'] > 256:
+            raise ScrollTextError('Max. value of bytes in scroll text exeedes 256!')
+
+        yield from zip(output_scroll_data['bytes'], output_scroll_data['or'])
+        del output_scroll_data['bytes'][:]
+        del output_scroll_data['or'][:]
+
+
+def rewind_tokenizer_state(state, checkpoint):
+    # Brings state back to given checkpoint, so tokenizing can be continued from there.
+    state['position'] = checkpoint['position']
+    state['active_index'] = checkpoint['active_index']
+    state['isActiveSetWithOr'] = checkpoint['isActiveSetWithOr']
+    state['default_index'] = checkpoint['default_index']
+    del state['output_scroll_data']['bytes'][checkpoint['bytes']:]
+    del state['output_scroll_data']['or'][checkpoint['bytes']:]
+    for p in state['used_tags'][checkpoint['used_tags']:]:
+        del state['tags_indexes'][(p['tag'], p['set'])]
+    del state['used_tags'][checkpoint['used_tags']:]
+
+
+def bank_parameters(scroll_data):
+    # Value of byte marking the switch of bank, and max. number of unique characters in one bank.
+    marker = scroll_data['parameters'].get('bank_marker', 255)
+    begin = scroll_data['parameters']['begin']
+    return marker, scroll_data['parameters'].get('bank_size', (marker if marker >= begin else 256) - begin)
+
+
+def plan_segments(characters, capacity):
+    # Splits characters (indexes of used tags) into segments of at most capacity unique characters, with the least
+    # sum of numbers of unique characters of segments, which is the number of characters in fonts data of all banks.
+    # For a segment ending at given position, the best beginning with given number of unique characters is the
+    # earliest one, so only beginnings just after the last occurrence of each character are tried.
+    if len(set(characters)) <= capacity:
+        return [(0, len(characters))]
+
+    costs = [0] * (len(characters) + 1)
+    beginnings = [0] * (len(characters) + 1)
+    last = {}
+    for end in range(1, len(characters) + 1):
+        character = characters[end - 1]
+        last.pop(character, None)
+        last[character] = end - 1
+
+        best = None
+        unique = 0
+        for p in reversed(last):
+            if unique > 0 and (best == None or costs[last[p] + 1] + unique <= best):
+                best = costs[last[p] + 1] + unique
+                beginnings[end] = last[p] + 1
+            unique += 1
+            if unique > capacity:
+                break
+        else:
+            if best == None or unique <= best:
+                best = unique
+                beginnings[end] = 0
+        costs[end] = best
+
+    segments = []
+    end = len(characters)
+    while end > 0:
+        segments.append((beginnings[end], end))
+        end = beginnings[end]
+
+    return segments[::-1]
+
+
+def assign_segments_codes(characters, plan):
+    # Codes of characters in each segment are 0 ... (number of unique characters - 1), given in order of the first
+    # occurrence, but characters which stay from the previous segment keep their codes if possible, so fewer cells
+    # change when banks are switched.
+    segments = []
+    previous = {}
+    for start, end in plan:
+        tags = list(dict.fromkeys(characters[start:end]))
+        codes = {p: previous[p] for p in tags if p in previous and previous[p] < len(tags)}
+        free = iter(sorted(set(range(0, len(tags))) - set(codes.values())))
+        for p in tags:
+            if not p in codes:
+                codes[p] = next(free)
+
+        order = [0] * len(tags)
+        for p in tags:
+            order[codes[p]] = p
+        segments.append({'start': start, 'end': end, 'codes': codes, 'tags': order})
+        previous = codes
+
+    return segments
+
+
+def segment_scroll_text(scroll_data, output_scroll_data):
+    marker, capacity = bank_parameters(scroll_data)
+    segments = assign_segments_codes(output_scroll_data['bytes'], plan_segments(output_scroll_data['bytes'], capacity))
+    if len(segments) > 256:
+        raise ScrollTextError('Number of banks of fonts exceeds 256!')
+
+    if debug == True:
+        print('* Number of banks: ' + str(len(segments)))
+        sys.stdout.flush()
+
+    return segments
+
+
+def finish_tokenizing(scroll_data, state):
+    used_tags = state['used_tags']
+    output_scroll_data = state['output_scroll_data']
+
     if debug == True:
         print('* Number of unique characters: ' + str(len(used_tags)))
         sys.stdout.flush()
 
-    if len(used_tags) + scroll_data['parameters']['begin'] > 256:
-        eprint('Max. value of bytes in scroll text exeedes 256!', sys.argv[1])
+    if scroll_data['parameters'].get('segmented', False) == True:
+        output_scroll_data['segments'] = segment_scroll_text(scroll_data, output_scroll_data)
+    elif len(used_tags) + scroll_data['parameters']['begin'] > 256:
+        raise ScrollTextError('Max. value of bytes in scroll text exeedes 256!')
+    else:
+        output_scroll_data['segments'] = None
 
-    if 'zero' in scroll_data['parameters'] and scroll_data['parameters']['zero'] == True:
-        output_scroll_data.append({'byte': -scroll_data['parameters']['begin'], 'tag': 'ZERO', 'offsets': 0, 'set': ''})
+    output_scroll_data['zero'] = 'zero' in scroll_data['parameters'] and scroll_data['parameters']['zero'] == True
 
     return output_scroll_data, used_tags
 
 
-def print_header():
+def find_sets_or_tags_in_scroll_text(scroll_data, input_scroll_text):
+    if debug == True:
+        print('* Default font set: ' + scroll_data['fonts'][0]['set'])
+        print('* Active font set: ' + scroll_data['fonts'][0]['set'])
+        sys.stdout.flush()
+
+    state = new_tokenizer_state()
+    tokenize_scroll_text(scroll_data, input_scroll_text, state)
+    return finish_tokenizing(scroll_data, state)
+
+
+def build_emitter(language, format_of_bytes):
+    # Returns a backend for given language and format of output data, with precomputed literals of all byte values.
+    if format_of_bytes == 'hex':
+        literals = [('0x' if language == 'C' else '$') + format(i, '02x') for i in range(0, 256)]
+    else:
+        literals = [str(i) for i in range(0, 256)]
+
+    if language == 'C':
+        return {'language': language, 'format': format_of_bytes, 'literals': literals,
+                'line_begin': '\t', 'line_end': ',', 'comment_begin': '\t/* ', 'comment_end': ' */'}
+    else:
+        return {'language': language, 'format': format_of_bytes, 'literals': literals,
+                'line_begin': '\t.byte ', 'line_end': '', 'comment_begin': '\t; ', 'comment_end': ''}
+
+
+emitters = {(language, format_of_bytes): build_emitter(language, format_of_bytes)
+            for language in ('C', 'Assembler') for format_of_bytes in ('hex', 'dec')}
+
+
+def get_emitter(scroll_data):
+    return emitters[(scroll_data['parameters']['language'], scroll_data['parameters']['format'])]
+
+
+def emit_literal(emitter, value):
+    # Values of scroll text data can exceed 255 when "or" and "begin" are used together.
+    if value < 256:
+        return emitter['literals'][value]
+    elif emitter['format'] == 'hex':
+        return ('0x' if emitter['language'] == 'C' else '$') + format(value, '02x')
+    else:
+        return str(value)
+
+
+def emit_line(emitter, literals, comment):
+    return emitter['line_begin'] + ', '.join(literals) + emitter['line_end'] +\
+           emitter['comment_begin'] + comment + emitter['comment_end']
+
+
+def emit_header(scroll_data, filename, deterministic = False):
+    # Deterministic header has no date and time, so the same input always gives the same output.
+    if deterministic == True:
+        stamp = ''
+    else:
+        stamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S') + ', '
+
     if (scroll_data['parameters']['language'] == 'C'):
-        print('/* "Scroll Packer" v' + version + ', ' +
-              datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S') + ', "' +
-              sys.argv[1] + '" */\n')
+        return '/* "Scroll Packer" v' + version + ', ' + stamp + '"' + filename + '" */\n\n'
     elif (scroll_data['parameters']['language'] == 'Assembler'):
-        print('; "Scroll Packer" v' + version + ', ' +
-              datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S') + ', "' +
-              sys.argv[1] + '"\n')
+        return '; "Scroll Packer" v' + version + ', ' + stamp + '"' + filename + '"\n\n'
+
+
+def scroll_text_bytes(scroll_data, output_scroll_data, used_tags):
+    values = []
+    for value, tag in scroll_text_values(scroll_data, output_scroll_data, used_tags):
+        if value > 255:
+            raise ScrollTextError('Value ' + str(value) + ' of byte of tag "' + tag + '" in scroll text data ' +
+                                  'exceeds 255 (value of "or" is combined with "begin")!')
+        values.append(value)
 
+    return bytes(values)
 
-def print_scroll_data(scroll_data, output_scroll_data, used_tags):
+
+def scroll_text_length(output_scroll_data):
+    return len(output_scroll_data['bytes']) + (1 if output_scroll_data['zero'] == True else 0) +\
+           (2 * len(output_scroll_data['segments']) if output_scroll_data['segments'] != None else 0)
+
+
+def scroll_text_values(scroll_data, output_scroll_data, used_tags):
+    # Yields the value of byte and the tag of each character of scroll text data, including the ending zero.
+    # Each segment begins with the marker of switch of bank followed by the number of bank.
+    begin = scroll_data['parameters']['begin']
+    if output_scroll_data['segments'] == None:
+        for byte, bitwise_or in zip(output_scroll_data['bytes'], output_scroll_data['or']):
+            yield (byte | bitwise_or) + begin, used_tags[byte]['tag']
+    else:
+        marker = bank_parameters(scroll_data)[0]
+        for bank, segment in enumerate(output_scroll_data['segments']):
+            yield marker, 'BANK'
+            yield bank, str(bank)
+            codes = segment['codes']
+            for position in range(segment['start'], segment['end']):
+                byte = output_scroll_data['bytes'][position]
+                value = (codes[byte] | output_scroll_data['or'][position]) + begin
+                if value == marker:
+                    raise ScrollTextError('Value ' + str(value) + ' of byte of tag "' + used_tags[byte]['tag'] +
+                                          '" in scroll text data is the marker of switch of bank!')
+                yield value, used_tags[byte]['tag']
+
+    if output_scroll_data['zero'] == True:
+        yield 0, 'ZERO'
+
+
+def segments_comment(segments):
+    return 'banks: ' + str(len(segments)) + ', unique characters in banks: ' +\
+           ', '.join(str(len(p['tags'])) for p in segments) + ' (' + str(sum(len(p['tags']) for p in segments)) +\
+           ' in total)'
+
+
+def emit_scroll_data_head(scroll_data, length, used_tags, compression = None, segments = None, unique = None):
+    # With unique (the number of characters of this scroll), used_tags are characters of fonts data shared with
+    # other scrolls.
+    comments = ['scroll text, length: ' + str(length) + ', unique characters: ' +
+                (str(unique) + ', shared fonts characters: ' + str(len(used_tags)) if unique != None else
+                 str(len(used_tags)))]
+    if segments != None:
+        comments.append(segments_comment(segments))
+    if compression != None:
+        comments += compression_comments(scroll_data, compression)
+
+    output = []
     if (scroll_data['parameters']['language'] == 'C'):
-        print('/* scroll text, length: ' + str(len(output_scroll_data)) +
-              ', unique characters: ' + str(len(used_tags)) + ' */')
-        print('uint8_t text[] = {')
+        output += ['/* ' + p + ' */\n' for p in comments]
+        output.append('uint8_t text[] = {\n')
     elif (scroll_data['parameters']['language'] == 'Assembler'):
         if 'text_org' in scroll_data['parameters'] and len(str(scroll_data['parameters']['text_org'])) > 0:
-            print(scroll_data['parameters']['text_org'])
-        print('; scroll text, length: ' + str(len(output_scroll_data)) +
-              ', unique characters: ' + str(len(used_tags)))
-        print('text', end = '')
+            output.append(scroll_data['parameters']['text_org'] + '\n')
+        output += ['; ' + p + '\n' for p in comments]
+        output.append('text')
+    return ''.join(output)
 
-    comment = ''
-    cntr = 0
-    for p in output_scroll_data:
-        if cntr % 8 == 0:
-            if scroll_data['parameters']['language'] == 'C':
-                print('\t', end = '')
-            elif scroll_data['parameters']['language'] == 'Assembler':
-                print('\t.byte ', end = '')
-
-        comment += p['tag']
-        if scroll_data['parameters']['format'] == 'hex':
-            if scroll_data['parameters']['language'] == 'C':
-                if cntr % 8 == 7 or cntr == len(output_scroll_data) - 1:
-                    print('0x' + format((p['byte'] | (p['or'] if 'or' in p else 0)) +
-                                        scroll_data['parameters']['begin'], '02x') + ',', end = '')
-                else:
-                    print('0x' + format((p['byte'] | (p['or'] if 'or' in p else 0)) +
-                                        scroll_data['parameters']['begin'], '02x') + ', ', end = '')
-            elif scroll_data['parameters']['language'] == 'Assembler':
-                if (cntr % 8 < 7) and (cntr < len(output_scroll_data) - 1):
-                    print('$' + format((p['byte'] | (p['or'] if 'or' in p else 0)) +
-                                       scroll_data['parameters']['begin'], '02x') + ', ', end = '')
-                else:
-                    print('$' + format((p['byte'] | (p['or'] if 'or' in p else 0)) +
-                                       scroll_data['parameters']['begin'], '02x'), end = '')
-        elif scroll_data['parameters']['format'] == 'dec':
-            if scroll_data['parameters']['language'] == 'C':
-                if cntr % 8 == 7 or cntr == len(output_scroll_data) - 1:
-                    print(str((p['byte'] | (p['or'] if 'or' in p else 0)) +
-                              scroll_data['parameters']['begin']) + ',', end = '')
-                else:
-                    print(str((p['byte'] | (p['or'] if 'or' in p else 0)) +
-                              scroll_data['parameters']['begin']) + ', ', end = '')
-            elif scroll_data['parameters']['language'] == 'Assembler':
-                if (cntr % 8 < 7) and (cntr < len(output_scroll_data) - 1):
-                    print(str((p['byte'] | (p['or'] if 'or' in p else 0)) +
-                              scroll_data['parameters']['begin']) + ', ', end = '')
-                else:
-                    print(str((p['byte'] | (p['or'] if 'or' in p else 0)) +
-                              scroll_data['parameters']['begin']), end = '')
 
-        if cntr % 8 == 7:
-            print_scroll_text_as_comment(scroll_data, output_scroll_data, cntr, comment)
+def emit_scroll_data_tail(scroll_data, compression = None):
+    if scroll_data['parameters']['language'] == 'C':
+        return '};\n\n'
+    elif scroll_data['parameters']['language'] == 'Assembler':
+        if compression != None and compression['codec'] != 'none':
+            return 'textend\n\n' + emit_depacker(scroll_data, compression)
+        return 'textend\n\n'
+
+
+def emit_scroll_data(scroll_data, output_scroll_data, used_tags, compression = None, unique = None):
+    emitter = get_emitter(scroll_data)
+    if compression == None and scroll_data['parameters'].get('compression', 'none') != 'none':
+        compression = compress_scroll_text(scroll_data, scroll_text_bytes(scroll_data, output_scroll_data, used_tags))
+    output = [emit_scroll_data_head(scroll_data, scroll_text_length(output_scroll_data), used_tags, compression,
+                                    output_scroll_data['segments'], unique)]
+
+    if compression != None and compression['codec'] != 'none':
+        tags = [tag for value, tag in scroll_text_values(scroll_data, output_scroll_data, used_tags)]
+        output.append(emit_packed_scroll_data(scroll_data, compression, tags))
+        output.append(emit_scroll_data_tail(scroll_data, compression))
+        return ''.join(output)
+
+    # lines of 8 bytes, each followed by a comment with appropriate part of scroll text
+    lines = []
+    literals = []
+    comment = ''
+    for value, tag in scroll_text_values(scroll_data, output_scroll_data, used_tags):
+        literals.append(emit_literal(emitter, value))
+        comment += tag
+        if len(literals) == 8:
+            lines.append(emit_line(emitter, literals, comment))
+            literals = []
             comment = ''
 
-        cntr += 1
+    if len(literals) != 0:
+        lines.append(emit_line(emitter, literals, comment))
 
-    if len(comment) != 0:
-        print_scroll_text_as_comment(scroll_data, output_scroll_data, cntr, comment)
-
-    print()
-    if scroll_data['parameters']['language'] == 'C':
-        print('};')
-    elif scroll_data['parameters']['language'] == 'Assembler':
-        print('textend')
-    print()
+    output.append('\n'.join(lines) + '\n')
+    output.append(emit_scroll_data_tail(scroll_data))
 
+    return ''.join(output)
 
-def print_scroll_text_as_comment(scroll_data, output_scroll_data, cntr, comment):
-    if scroll_data['parameters']['language'] == 'C':
-        print('\t/* ', end = '')
-    elif scroll_data['parameters']['language'] == 'Assembler':
-        print('\t; ', end = '')
 
-    print(comment, end = '')
-    if scroll_data['parameters']['language'] == 'C':
-        if cntr < len(output_scroll_data) - 1:
-            print(' */')
+def emit_scroll_data_stream(scroll_data, values, used_tags, output_file):
+    # Like emit_scroll_data(), but for scroll text data given by a generator of bytes and values of "or". Lines are
+    # spooled to a temporary file (on disk, when they get big), because the head needs the length of scroll text.
+    emitter = get_emitter(scroll_data)
+    begin = scroll_data['parameters']['begin']
+    length = 0
+    literals = []
+    comment = ''
+    separator = ''
+    with tempfile.SpooledTemporaryFile(max_size = 1 << 20, mode = 'w+', encoding = 'utf-8') as spool:
+        for byte, bitwise_or in values:
+            value = (byte | bitwise_or) + begin
+            if value > 255:
+                raise ScrollTextError('Value ' + str(value) + ' of byte of tag "' + used_tags[byte]['tag'] +
+                                      '" in scroll text data exceeds 255 (value of "or" is combined with "begin")!')
+            literals.append(emitter['literals'][value])
+            comment += used_tags[byte]['tag']
+            length += 1
+            if len(literals) == 8:
+                spool.write(separator + emit_line(emitter, literals, comment))
+                separator = '\n'
+                literals = []
+                comment = ''
+
+        if 'zero' in scroll_data['parameters'] and scroll_data['parameters']['zero'] == True:
+            literals.append(emitter['literals'][0])
+            comment += 'ZERO'
+            length += 1
+        if len(literals) != 0:
+            spool.write(separator + emit_line(emitter, literals, comment))
+        spool.write('\n')
+
+        output_file.write(emit_scroll_data_head(scroll_data, length, used_tags))
+        spool.seek(0)
+        while True:
+            chunk = spool.read(65536)
+            if len(chunk) == 0:
+                break
+            output_file.write(chunk)
+        output_file.write(emit_scroll_data_tail(scroll_data))
+
+    return length
+
+
+# Column streams ("streams") are scroll text expanded ahead of time into codes of cells (indexes of cells in
+# tables of fonts data plus "begin", combined with "or"), one stream for each row with a code for each column of
+# each character, so a scroll routine only advances a pointer instead of computing offsets of cells.
+def column_streams_codes(scroll_data, glyphs, used_tags):
+    # For each row, codes of all columns of each used tag, following layout of fonts data (and "dedup").
+    width = scroll_data['parameters']['width']
+    height = scroll_data['parameters']['height']
+    begin = scroll_data['parameters']['begin']
+    tables = fonts_data_cells(scroll_data, used_tags)
+    cells = None
+    if scroll_data['parameters'].get('dedup', False) == True:
+        cells = [t['indexes'] for t in dedup_fonts_data_cells(scroll_data, glyphs, tables)]
+    consolidated = len(tables) == 1
+    cells_per_tag = width * (height if consolidated else 1)
+
+    codes = []
+    for row in range(0, height):
+        table = 0 if consolidated else row
+        first = row * width if consolidated else 0
+        row_codes = []
+        for i in range(0, len(used_tags)):
+            indexes = [i * cells_per_tag + first + column for column in range(0, width)]
+            if cells != None:
+                indexes = [cells[table][p] for p in indexes]
+            row_codes.append([p + begin for p in indexes])
+        codes.append(row_codes)
+    return codes
+
+
+def column_streams(scroll_data, glyphs, output_scroll_data, used_tags):
+    """Returns column streams of scroll text, as bytes for each row. With "zero", each stream ends with zero."""
+    streams = []
+    for row_codes in column_streams_codes(scroll_data, glyphs, used_tags):
+        stream = bytearray()
+        for byte, bitwise_or in zip(output_scroll_data['bytes'], output_scroll_data['or']):
+            for code in row_codes[byte]:
+                if code | bitwise_or > 255:
+                    raise ScrollTextError('Code ' + str(code | bitwise_or) + ' of cell of tag "' +
+                                          used_tags[byte]['tag'] + '" in column streams exceeds 255!')
+                stream.append(code | bitwise_or)
+        if output_scroll_data['zero'] == True:
+            stream.append(0)
+        streams.append(bytes(stream))
+    return streams
+
+
+def column_streams_cycles(scroll_data, consolidated):
+    # Estimated 6502 cycles per column of screen (loads and additions only, storing to screen is the same): text
+    # needs "lda (text),y", multiplication of value by cells of a character (shifts and additions) and addition
+    # of offset of cell for each row, streams need "lda (stream),y" for each row.
+    width = scroll_data['parameters']['width']
+    height = scroll_data['parameters']['height']
+    factor = width * (height if consolidated else 1)
+    multiply = 2 * (factor.bit_length() - 1) + 8 * (bin(factor).count('1') - 1)
+    return {'text': 5 + multiply + 4 * height, 'streams': 5 * height}
+
+
+def column_streams_comments(scroll_data, streams, text_length, consolidated):
+    cycles = column_streams_cycles(scroll_data, consolidated)
+    return ['column streams, one for each row: ' + str(len(streams)) + ' x ' + str(len(streams[0])) + ' bytes (' +
+            str(sum(len(p) for p in streams)) + ' bytes, scroll text data: ' + str(text_length) + ' bytes)',
+            'estimated 6502 cycles per column of screen: scroll text data: ' + str(cycles['text']) +
+            ', column streams: ' + str(cycles['streams'])]
+
+
+def emit_column_streams(scroll_data, streams, output_scroll_data, used_tags, text_length):
+    emitter = get_emitter(scroll_data)
+    width = scroll_data['parameters']['width']
+    consolidated = scroll_data['parameters']['height'] == 1 or scroll_data['parameters']['consolidation'] == True
+    tags = [used_tags[byte]['tag'] for byte in output_scroll_data['bytes']] +\
+           (['ZERO'] if output_scroll_data['zero'] == True else [])
+    characters = max(1, 8 // width)
+
+    output = [emit_comments(scroll_data, column_streams_comments(scroll_data, streams, text_length, consolidated))]
+    for row in range(0, len(streams)):
+        if scroll_data['parameters']['language'] == 'C':
+            output.append('uint8_t stream' + str(row) + '[] = {\n')
         else:
-            print(' */', end = '')
-    elif scroll_data['parameters']['language'] == 'Assembler':
-        if cntr < len(output_scroll_data) - 1:
-            print()
+            output.append('stream' + str(row))
+        lines = []
+        position = 0
+        for i in range(0, len(tags), characters):
+            size = sum(1 if p == 'ZERO' else width for p in tags[i:i + characters])
+            lines.append(emit_line(emitter, [emitter['literals'][b] for b in streams[row][position:position + size]],
+                                   ''.join(tags[i:i + characters])))
+            position += size
+        output.append('\n'.join(lines) + '\n')
+        if scroll_data['parameters']['language'] == 'C':
+            output.append('};\n\n')
         else:
-            print(end = '')
+            output.append('stream' + str(row) + 'end\n\n')
 
+    return ''.join(output)
 
-def print_fonts_data(scroll_data, used_tags):
-    files_handlers = {}
-    for p in scroll_data['fonts']:
+
+# Font files can be PNG images (font sheets) when their entries in "fonts" have "image". Images are converted to
+# the same bytes as font files, and converted fonts are cached in files named after hash of image and "image", in
+# directory ".scrollpacker" next to image (or in library cache directory), and in memory.
+png_signature = b'\x89PNG\r\n\x1a\n'
+font_images_cache = {}
+
+
+def font_images(scroll_data):
+    # "image" of each font file given as PNG image, see load_glyphs().
+    return {p['file']: p['image'] for p in scroll_data['fonts'] if 'image' in p}
+
+
+def unfilter_png_row(kind, line, previous, bpp):
+    # Reverses filter of one scanline in place (bpp is the number of bytes of a pixel, at least one).
+    for x in range(0, len(line)):
+        left = line[x - bpp] if x >= bpp else 0
+        if kind == 1:
+            line[x] = (line[x] + left) & 255
+        elif kind == 2:
+            line[x] = (line[x] + previous[x]) & 255
+        elif kind == 3:
+            line[x] = (line[x] + (left + previous[x]) // 2) & 255
+        else:
+            up_left = previous[x - bpp] if x >= bpp else 0
+            estimate = left + previous[x] - up_left
+            if abs(estimate - left) <= abs(estimate - previous[x]) and abs(estimate - left) <= abs(estimate - up_left):
+                line[x] = (line[x] + left) & 255
+            elif abs(estimate - previous[x]) <= abs(estimate - up_left):
+                line[x] = (line[x] + previous[x]) & 255
+            else:
+                line[x] = (line[x] + up_left) & 255
+    return line
+
+
+def decode_png(data, filename):
+    # Returns width, height, color type, bit depth, palette (colors as 0xrrggbb) and unfiltered rows of PNG image,
+    # decoded with zlib. Filters "Sub" and "Up" are reversed with NumPy, when it is available.
+    if data[:8] != png_signature:
+        raise FontFileError('File "' + filename + '" is not a PNG image!')
+    png = {'palette': []}
+    compressed = []
+    position = 8
+    while position + 8 <= len(data):
+        length = int.from_bytes(data[position:position + 4], byteorder = 'big')
+        kind = data[position + 4:position + 8]
+        chunk = data[position + 8:position + 8 + length]
+        position += 12 + length
+        if kind == b'IHDR' and length >= 13:
+            png['width'] = int.from_bytes(chunk[0:4], byteorder = 'big')
+            png['height'] = int.from_bytes(chunk[4:8], byteorder = 'big')
+            png['depth'], png['type'], interlace = chunk[8], chunk[9], chunk[12]
+        elif kind == b'PLTE':
+            png['palette'] = [int.from_bytes(chunk[i:i + 3], byteorder = 'big') for i in range(0, length - 2, 3)]
+        elif kind == b'IDAT':
+            compressed.append(chunk)
+        elif kind == b'IEND':
+            break
+
+    if not 'width' in png:
+        raise FontFileError('Image "' + filename + '" has no header!')
+    samples = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(png['type'])
+    if samples == None or interlace != 0 or png['depth'] not in ((1, 2, 4, 8) if png['type'] in (0, 3) else (8,)):
+        raise FontFileError('Image "' + filename + '" has unsupported format (color type ' + str(png['type']) +
+                            ', bit depth ' + str(png['depth']) + (', interlaced' if interlace != 0 else '') + ')!')
+    try:
+        raw = zlib.decompress(b''.join(compressed))
+    except zlib.error:
+        raise FontFileError('Image "' + filename + '" has corrupted data!')
+
+    png['samples'] = samples
+    stride = (png['width'] * samples * png['depth'] + 7) // 8
+    bpp = max(1, samples * png['depth'] // 8)
+    previous = bytes(stride)
+    png['rows'] = []
+    for y in range(0, png['height']):
+        position = y * (stride + 1)
+        if position + 1 + stride > len(raw) or raw[position] > 4:
+            raise FontFileError('Image "' + filename + '" has corrupted data!')
+        kind = raw[position]
+        line = raw[position + 1:position + 1 + stride]
+        if kind == 1 and numpy != None:
+            line = numpy.frombuffer(line, dtype = numpy.uint8).reshape(-1, bpp).cumsum(axis = 0,
+                                                                                       dtype = numpy.uint8).tobytes()
+        elif kind == 2 and numpy != None:
+            line = (numpy.frombuffer(line, dtype = numpy.uint8) +
+                    numpy.frombuffer(previous, dtype = numpy.uint8)).tobytes()
+        elif kind != 0:
+            line = bytes(unfilter_png_row(kind, bytearray(line), previous, bpp))
+        png['rows'].append(line)
+        previous = line
+    return png
+
+
+def png_color(png, x, y):
+    # Color of pixel as 0xrrggbb (gray as well), or None outside of image.
+    if x >= png['width'] or y >= png['height']:
+        return None
+    row = png['rows'][y]
+    if png['depth'] < 8:
+        value = row[x * png['depth'] // 8] >> (8 - png['depth'] - x * png['depth'] % 8) & (1 << png['depth']) - 1
+        if png['type'] == 3:
+            return png['palette'][value] if value < len(png['palette']) else 0
+        return value * 255 // ((1 << png['depth']) - 1) * 0x10101
+    position = x * png['samples']
+    if png['type'] == 3:
+        return png['palette'][row[position]] if row[position] < len(png['palette']) else 0
+    if png['type'] in (0, 4):
+        return row[position] * 0x10101
+    return row[position] << 16 | row[position + 1] << 8 | row[position + 2]
+
+
+def png_colors(png, xs, ys):
+    # Colors of pixels at all given columns of all given rows, as a NumPy array (-1 outside of image) when NumPy is
+    # available and bit depth is 8, otherwise as lists.
+    if numpy == None or png['depth'] != 8:
+        return [[png_color(png, x, y) for x in xs] for y in ys]
+
+    pixels = numpy.frombuffer(b''.join(png['rows']), dtype = numpy.uint8).reshape(png['height'], png['width'],
+                                                                                  png['samples'])
+    xs = numpy.array(xs, dtype = numpy.intp)
+    ys = numpy.array(ys, dtype = numpy.intp)
+    inside = (ys < png['height'])[:, None] & (xs < png['width'])[None, :]
+    pixels = pixels[numpy.minimum(ys, png['height'] - 1)][:, numpy.minimum(xs, png['width'] - 1)].astype(numpy.int32)
+    if png['type'] == 3:
+        palette = numpy.array(png['palette'] + [0] * (256 - len(png['palette'])), dtype = numpy.int32)
+        colors = palette[pixels[:, :, 0]]
+    elif png['type'] in (0, 4):
+        colors = pixels[:, :, 0] * 0x10101
+    else:
+        colors = pixels[:, :, 0] << 16 | pixels[:, :, 1] << 8 | pixels[:, :, 2]
+    return numpy.where(inside, colors, -1)
+
+
+def font_image_values(png, colors, image, filename):
+    # Values of bits of colors (no value outside of image), with "palette" or its default.
+    bits = image.get('bits', 1)
+    if 'palette' in image:
+        palette = {int(color[1:], 16): value for color, value in image['palette'].items()}
+    else:
+        background = png_color(png, 0, 0)
+        palette = {background: 0}
+
+    def value(color):
+        if color == None or color == -1:
+            return 0
+        if color in palette:
+            return palette[color]
+        if not 'palette' in image:
+            return (1 << bits) - 1
+        raise FontFileError('Color #' + format(color, '06x') + ' of image "' + filename + '" is not in "palette"!')
+
+    if type(colors) == list:
+        return [[value(p) for p in row] for row in colors]
+    unique, inverse = numpy.unique(colors, return_inverse = True)
+    return numpy.array([value(int(p)) for p in unique], dtype = numpy.uint8)[inverse.reshape(colors.shape)]
+
+
+def convert_font_image(data, filename, image):
+    """Converts PNG image with cells of characters (one after another in rows, and rows of "interleave" fonts one
+    after another) to bytes of font file, 8 bytes for each cell. Each pixel of font is given by the top left pixel
+    of its rectangle in cell. Bits of pixels are packed with NumPy, when it is available."""
+    bits = image.get('bits', 1)
+    pixels = 8 // bits
+    cell_width = image.get('cell_width', pixels)
+    cell_height = image.get('cell_height', 8)
+    interleave = image.get('interleave', 1)
+    png = decode_png(data, filename)
+    columns = (png['width'] + cell_width - 1) // cell_width
+    rows_of_font = ((png['height'] + cell_height - 1) // cell_height + interleave - 1) // interleave
+
+    # rows of cells of the first font, then of the next ones
+    rows = [row * interleave + font for font in range(0, interleave) for row in range(0, rows_of_font)]
+    ys = [row * cell_height + line * (cell_height // 8) for row in rows for line in range(0, 8)]
+    xs = [column * cell_width + pixel * (cell_width // pixels) for column in range(0, columns)
+          for pixel in range(0, pixels)]
+    values = font_image_values(png, png_colors(png, xs, ys), image, filename)
+
+    if type(values) == list:
+        output = bytearray()
+        for row in range(0, len(rows)):
+            for column in range(0, columns):
+                for line in range(0, 8):
+                    value = 0
+                    for pixel in values[row * 8 + line][column * pixels:(column + 1) * pixels]:
+                        value = value << bits | pixel
+                    output.append(value)
+        return bytes(output)
+
+    shifts = numpy.arange(8 - bits, -1, -bits, dtype = numpy.uint8)
+    values = (values.reshape(len(rows), 8, columns, pixels) << shifts).sum(axis = 3, dtype = numpy.uint8)
+    return values.transpose(0, 2, 1).tobytes()
+
+
+def load_font_image(path, filename, image):
+    # Converted font of PNG image, from cache if image and "image" are the same.
+    try:
+        with open(path, 'rb') as image_file:
+            data = image_file.read()
+    except FileNotFoundError:
+        raise FontFileError('File "' + filename + '" not found!')
+    except OSError:
+        raise FontFileError('File "' + filename + '" cannot be opened!')
+
+    key = hashlib.sha256((tool_signature() + '\0' + json.dumps(image, sort_keys = True) +
+                          '\0').encode('utf-8') + data).hexdigest()
+    if key in font_images_cache:
+        return font_images_cache[key]
+
+    cache_dir = library_cache_dir if library_cache_dir != None else os.path.join(os.path.dirname(path),
+                                                                                  '.scrollpacker')
+    cache_filename = os.path.join(cache_dir, key + '.fnt')
+    try:
+        with open(cache_filename, 'rb') as cache_file:
+            font = cache_file.read()
+    except OSError:
+        font = convert_font_image(data, filename, image)
+        # cache is only an optimization, so fonts are packed even when it cannot be written
         try:
-            files_handlers[p['set']] = open(p['file'], 'rb')
-        except FileNotFoundError:
-            eprint('File "' + p['file'] + '" not found!')
-        except:
-            eprint('File "' + p['file'] + '" cannot be opened!')
+            os.makedirs(cache_dir, exist_ok = True)
+            temporary = cache_filename + '.' + str(os.getpid()) + '.tmp'
+            with open(temporary, 'wb') as cache_file:
+                cache_file.write(font)
+            os.replace(temporary, cache_filename)
+        except OSError:
+            pass
+
+    font_images_cache[key] = font
+    return font
+
+
+def load_glyphs(used_tags, base_dir = None, glyphs = None, images = None):
+    # Loads each font file only once and only if any of its characters is used in scroll text. Files already
+    # present in given glyphs are not loaded again, and files in images (see font_images()) are converted from PNG
+    # images. All offsets of used tags are checked here, so no partial fonts data is printed for a wrong offset.
+    if glyphs == None:
+        glyphs = {}
+    for p in used_tags:
+        if images != None and p['file'] in images and not p['file'] in glyphs:
+            glyphs[p['file']] = load_font_image(p['file'] if base_dir == None else os.path.join(base_dir, p['file']),
+                                                p['file'], images[p['file']])
+        if not p['file'] in glyphs:
+            try:
+                with open(p['file'] if base_dir == None else os.path.join(base_dir, p['file']), 'rb') as font_file:
+                    glyphs[p['file']] = font_file.read()
+            except FileNotFoundError:
+                raise FontFileError('File "' + p['file'] + '" not found!')
+            except:
+                raise FontFileError('File "' + p['file'] + '" cannot be opened!')
+
+        for w in p['offsets']:
+            if w * 8 + 8 > len(glyphs[p['file']]):
+                raise FontFileError('Offset ' + str(w) + ' of tag "' + p['tag'] + '" of set "' + p['set'] +
+                                    '" points past the end of file "' + p['file'] + '" (' +
+                                    str(len(glyphs[p['file']])) + ' bytes)!')
+
+    return glyphs
+
+
+def get_glyph_cell(glyphs, p, offset):
+    # Returns the 8 bytes of a character (a part of font) at given offset, in 8-bytes chunks.
+    return glyphs[p['file']][offset * 8:offset * 8 + 8]
+
+
+def gather_fonts_data(scroll_data, glyphs, used_tags):
+    # Returns fonts data as bytes in order of fonts_data_cells(), one table when consolidated or one table for each
+    # row. With NumPy, font files are arrays of characters of 8 bytes, and all cells of used tags are gathered at
+    # once by a matrix of offsets (tags x rows x columns), otherwise cell by cell.
+    width = scroll_data['parameters']['width']
+    height = scroll_data['parameters']['height']
+    if numpy == None or len(used_tags) == 0:
+        return [b''.join(get_glyph_cell(glyphs, p, p['offsets'][row * width + column]) for p, column, row in table)
+                for table in fonts_data_cells(scroll_data, used_tags)]
+
+    # font files one after another, with the index of the first character of each file
+    first = {}
+    fonts = []
+    characters = 0
+    for p in used_tags:
+        if not p['file'] in first:
+            first[p['file']] = characters
+            font = numpy.frombuffer(glyphs[p['file']], dtype = numpy.uint8,
+                                    count = len(glyphs[p['file']]) // 8 * 8).reshape(-1, 8)
+            fonts.append(font)
+            characters += len(font)
+
+    offsets = numpy.array([p['offsets'] for p in used_tags], dtype = numpy.intp).reshape(len(used_tags), height,
+                                                                                          width)
+    offsets += numpy.array([first[p['file']] for p in used_tags], dtype = numpy.intp).reshape(-1, 1, 1)
+    data = numpy.concatenate(fonts)[offsets]
+    if height == 1 or scroll_data['parameters']['consolidation'] == True:
+        return [data.tobytes()]
+    return [data[:, row].tobytes() for row in range(0, height)]
+
+
+# Packed scroll text data is a sequence of blocks, each beginning with a header byte:
+# $01-$7f - the number of literal bytes following the header,
+# $81-$ff - RLE: the byte following the header is repeated (header - $80) times,
+#           LZ: (header - $80) bytes are copied from the distance given by the byte following the header minus one
+#           (the distance is within the window of the last bytes, which the depacker keeps in a ring buffer),
+# $00     - the end of packed data.
+compression_min_length = 3
+compression_max_length = 127
+compression_windows = (16, 32, 64, 128, 256)
+
+# sizes of 6502 depackers emitted by emit_depacker(), the masking of positions in the ring buffer is not needed
+# for window of 256 bytes
+depacker_sizes = {'rle': 73, 'lz': 113}
+depacker_mask_size = 6
+
+
+def add_compression_block(blocks, kind, start, length, distance = 0):
+    # Consecutive literals are joined into blocks of max. length.
+    if kind == 'literals' and len(blocks) != 0 and blocks[-1][0] == 'literals' and\
+            blocks[-1][2] < compression_max_length:
+        blocks[-1] = ('literals', blocks[-1][1], blocks[-1][2] + length, 0)
+    else:
+        blocks.append((kind, start, length, distance))
+
+
+def compress_rle(values):
+    blocks = []
+    position = 0
+    while position < len(values):
+        length = 1
+        while position + length < len(values) and length < compression_max_length and\
+                values[position + length] == values[position]:
+            length += 1
+
+        if length >= compression_min_length:
+            add_compression_block(blocks, 'repeat', position, length)
+            position += length
+        else:
+            add_compression_block(blocks, 'literals', position, 1)
+            position += 1
+
+    return blocks
+
+
+def compress_lz(values, window):
+    # Greedy matching of the longest string within the window, found through positions of its first bytes.
+    blocks = []
+    heads = {}
+    position = 0
+    while position < len(values):
+        best_length = 0
+        best_distance = 0
+        if position + compression_min_length <= len(values):
+            for candidate in reversed(heads.get(values[position:position + compression_min_length], [])):
+                if position - candidate > window:
+                    break
+                length = 0
+                while position + length < len(values) and length < compression_max_length and\
+                        values[candidate + length] == values[position + length]:
+                    length += 1
+                if length > best_length:
+                    best_length = length
+                    best_distance = position - candidate
+                    if length == compression_max_length:
+                        break
+
+        if best_length >= compression_min_length:
+            add_compression_block(blocks, 'match', position, best_length, best_distance)
+            length = best_length
+        else:
+            add_compression_block(blocks, 'literals', position, 1)
+            length = 1
+
+        for p in range(position, position + length):
+            heads.setdefault(values[p:p + compression_min_length], []).append(p)
+        position += length
+
+    return blocks
+
+
+def compression_bytes(values, blocks):
+    output = bytearray()
+    for kind, start, length, distance in blocks:
+        if kind == 'literals':
+            output.append(length)
+            output += values[start:start + length]
+        elif kind == 'repeat':
+            output += bytes((0x80 + length, values[start]))
+        else:
+            output += bytes((0x80 + length, distance - 1))
+    output.append(0)
+
+    return bytes(output)
+
+
+def compress_scroll_text(scroll_data, values):
+    # Packs bytes of scroll text data with every codec (or only with the one given in "compression"), and chooses
+    # the one taking the least memory, including the depacker and its ring buffer. Returns a dict with chosen codec
+    # ('codec'), its window ('window'), blocks ('blocks'), packed data ('data'), and all tried codecs ('tried').
+    compression = scroll_data['parameters'].get('compression', 'none')
+    windows = [scroll_data['parameters']['window']] if 'window' in scroll_data['parameters'] else\
+              compression_windows
+    assembler = scroll_data['parameters']['language'] == 'Assembler'
+
+    tried = []
+    if compression == 'none' or compression == 'auto':
+        tried.append({'codec': 'none', 'window': 0, 'blocks': None, 'data': values, 'cost': len(values)})
+    if compression == 'rle' or compression == 'auto':
+        blocks = compress_rle(values)
+        data = compression_bytes(values, blocks)
+        tried.append({'codec': 'rle', 'window': 0, 'blocks': blocks, 'data': data,
+                      'cost': len(data) + (depacker_sizes['rle'] if assembler else 0)})
+    if compression == 'lz' or compression == 'auto':
+        for window in windows:
+            blocks = compress_lz(values, window)
+            data = compression_bytes(values, blocks)
+            depacker_size = depacker_sizes['lz'] - (depacker_mask_size if window == 256 else 0)
+            tried.append({'codec': 'lz', 'window': window, 'blocks': blocks, 'data': data,
+                          'cost': len(data) + window + (depacker_size if assembler else 0)})
+
+    # the first of the cheapest, so the smaller window wins
+    chosen = min(tried, key = lambda p: p['cost'])
+    return {'codec': chosen['codec'], 'window': chosen['window'], 'blocks': chosen['blocks'],
+            'data': chosen['data'], 'length': len(values), 'tried': tried}
+
+
+def compression_name(codec, window):
+    if codec == 'lz':
+        return 'LZ (window: ' + str(window) + ')'
+    return codec.upper() if codec == 'rle' else codec
+
+
+def compression_ratio(size, length):
+    # Ratio of size of packed data to length of unpacked data, which has none for empty scroll text.
+    return format(size * 100 / length, '.1f') + '%' if length != 0 else 'n/a'
+
+
+def compression_comments(scroll_data, compression):
+    # Chosen codec with the memory it takes, and sizes of packed data of all tried codecs.
+    size = len(compression['data'])
+    if compression['codec'] == 'none':
+        comments = ['not packed']
+    else:
+        comments = ['packed with ' + compression_name(compression['codec'], compression['window']) + ', length: ' +
+                    str(size) + ' (' + compression_ratio(size, compression['length']) + ')']
+    if scroll_data['parameters']['language'] == 'Assembler' and compression['codec'] != 'none':
+        comments[0] += ', depacker: ' + str(depacker_sizes[compression['codec']] -
+                                           (depacker_mask_size if compression['window'] == 256 else 0))
+    if compression['codec'] == 'lz':
+        comments[0] += ', ring buffer: ' + str(compression['window'])
+    if len(compression['tried']) > 1:
+        comments.append('tried codecs:')
+        comments += ['  ' + p for p in compression_report(compression)]
+
+    return comments
+
+
+def compression_report(compression):
+    # Sizes of scroll text data packed with each tried codec, and their ratios to the size of unpacked data.
+    report = []
+    for p in compression['tried']:
+        report.append(compression_name(p['codec'], p['window']) + ': ' + str(len(p['data'])) + ' bytes (' +
+                      compression_ratio(len(p['data']), compression['length']) + ')')
+
+    return report
+
+
+def emit_packed_scroll_data(scroll_data, compression, tags):
+    # Lines of packed scroll text data, each block beginning in a new line, followed by a comment with unpacked part
+    # of scroll text. Lines have max. 8 bytes, so long blocks of literals continue in next lines.
+    emitter = get_emitter(scroll_data)
+    values = compression['data']
+    lines = []
+    position = 0
+    for kind, start, length, distance in compression['blocks']:
+        if kind != 'literals':
+            lines.append(emit_line(emitter, [emitter['literals'][values[position]],
+                                             emitter['literals'][values[position + 1]]],
+                                   ''.join(tags[start:start + length])))
+            position += 2
+            continue
+
+        literals = [emitter['literals'][values[position]]]
+        comment = ''
+        position += 1
+        for p in range(start, start + length):
+            literals.append(emitter['literals'][values[position]])
+            comment += tags[p]
+            position += 1
+            if len(literals) == 8:
+                lines.append(emit_line(emitter, literals, comment))
+                literals = []
+                comment = ''
+        if len(literals) != 0:
+            lines.append(emit_line(emitter, literals, comment))
+    lines.append(emit_line(emitter, [emitter['literals'][0]], 'END'))
+
+    return '\n'.join(lines) + '\n'
+
+
+def emit_depacker(scroll_data, compression):
+    # 6502 routine unpacking scroll text data byte after byte, with variables in zero page.
+    # positions in ring buffer are masked, unless it has 256 bytes
+    masking = ['\tand #$' + format(compression['window'] - 1, '02x')] if compression['codec'] == 'lz' and\
+              compression['window'] < 256 else []
+    zp = scroll_data['parameters'].get('depacker_zp', '$e0')
+    output = ['; depacker of scroll text data packed with ' +
+              compression_name(compression['codec'], compression['window']) + ':',
+              '; call textinit once, then each call of textget returns the next byte of scroll text data in A',
+              '; (after the end of scroll text it begins again), X and Y are preserved',
+              'textsrc\tequ ' + zp + '\t\t; pointer to packed scroll text data',
+              'textcnt\tequ textsrc+2\t; number of bytes left in current block',
+              'textmode\tequ textsrc+3\t; header of current block, bit 7 is set for repeated or copied bytes',
+              'textval\tequ textsrc+4\t; the last byte of scroll text']
+    if compression['codec'] == 'lz':
+        output += ['textpos\tequ textsrc+5\t; position of the next byte in ring buffer',
+                   'textref\tequ textsrc+6\t; position of the next copied byte in ring buffer']
+
+    output += ['',
+               'textinit\tlda #<text',
+               '\tsta textsrc',
+               '\tlda #>text',
+               '\tsta textsrc+1',
+               '\tlda #$00',
+               '\tsta textcnt']
+    # ring buffer is filled from its beginning again whenever scroll text begins again
+    output += ['\tsta textpos'] if compression['codec'] == 'lz' else []
+    output += ['\trts',
+               '',
+               'textget\ttxa' if compression['codec'] == 'lz' else 'textget\ttya']
+    output += ['\tpha', '\ttya'] if compression['codec'] == 'lz' else []
+    output += ['\tpha',
+               '\tldy #$00',
+               '\tlda textcnt',
+               '\tbne textnxt',
+               'texthdr\tjsr textrd',
+               '\tcmp #$00',
+               '\tbne textblk',
+               '\t; the end of packed data',
+               '\tjsr textinit',
+               '\tbeq texthdr',
+               'textblk\tsta textmode',
+               '\tand #$7f',
+               '\tsta textcnt',
+               '\tbit textmode',
+               '\tbpl textnxt',
+               '\tjsr textrd']
+    if compression['codec'] == 'rle':
+        output += ['\tsta textval',
+                   'textnxt\tdec textcnt',
+                   '\tbit textmode',
+                   '\tbmi textrep',
+                   '\tjsr textrd',
+                   '\tsta textval',
+                   'textrep\tpla',
+                   '\ttay',
+                   '\tlda textval',
+                   '\trts']
+    else:
+        output += ['\t; position of copied bytes is position of the next byte minus distance',
+                   '\teor #$ff',
+                   '\tclc',
+                   '\tadc textpos']
+        output += masking
+        output += ['\tsta textref',
+                   'textnxt\tdec textcnt',
+                   '\tbit textmode',
+                   '\tbmi textcpy',
+                   '\tjsr textrd',
+                   '\tjmp textput',
+                   'textcpy\tldx textref',
+                   '\tlda textbuf,x',
+                   '\ttay',
+                   '\tinx',
+                   '\ttxa']
+        output += masking
+        output += ['\tsta textref',
+                   '\ttya',
+                   'textput\tldx textpos',
+                   '\tsta textbuf,x',
+                   '\tsta textval',
+                   '\tinx',
+                   '\ttxa']
+        output += masking
+        output += ['\tsta textpos',
+                   '\tpla',
+                   '\ttay',
+                   '\tpla',
+                   '\ttax',
+                   '\tlda textval',
+                   '\trts']
+
+    output += ['',
+               'textrd\tlda (textsrc),y',
+               '\tinc textsrc',
+               '\tbne textrd1',
+               '\tinc textsrc+1',
+               'textrd1\trts']
+    if compression['codec'] == 'lz':
+        output += ['', '; ring buffer of the last bytes of scroll text',
+                   'textbuf\t.ds ' + str(compression['window'])]
+
+    return '\n'.join(output) + '\n\n'
+
+
+def emit_fonts_data(scroll_data, glyphs, used_tags, segments = None, prefix = ''):
+    # Names of tables of fonts data begin with prefix. With segments, tables are emitted for each bank.
+    if segments != None:
+        return emit_banks_fonts_data(scroll_data, glyphs, used_tags, segments)
+
+    if scroll_data['parameters'].get('page_aligned', False) == True:
+        return emit_page_aligned_fonts_data(scroll_data, glyphs, used_tags)
+
+    if 'dedup' in scroll_data['parameters'] and scroll_data['parameters']['dedup'] == True:
+        return emit_fonts_data_dedup(scroll_data, glyphs, used_tags, prefix)
+
+    output = []
+    tables = gather_fonts_data(scroll_data, glyphs, used_tags)
+    size = scroll_data['parameters']['width'] * 8
 
     if scroll_data['parameters']['height'] == 1 or scroll_data['parameters']['consolidation'] == True:
         if scroll_data['parameters']['language'] == 'C':
-            print('/* fonts data */')
-            print('uint8_t fonts[] = {')
-            for p in used_tags:
+            output.append('/* fonts data */\n')
+            output.append('uint8_t ' + prefix + 'fonts[] = {\n')
+            for i, p in enumerate(used_tags):
                 for row in range(0, scroll_data['parameters']['height']):
-                    print_fonts_data_one_row(scroll_data, files_handlers, p, row)
-            print('};')
+                    start = (i * scroll_data['parameters']['height'] + row) * size
+                    output.append(emit_fonts_data_one_row(scroll_data, tables[0][start:start + size], p, row))
+            output.append('};\n')
 
         elif scroll_data['parameters']['language'] == 'Assembler':
             if 'fonts_org' in scroll_data['parameters'] and len(scroll_data['parameters']['fonts_org']) > 0 and\
                 len(str(scroll_data['parameters']['fonts_org'][0])) > 0:
-                print(scroll_data['parameters']['fonts_org'][0])
-            print('; fonts data')
-            print('fonts', end = '')
-            for p in used_tags:
+                output.append(scroll_data['parameters']['fonts_org'][0] + '\n')
+            output.append('; fonts data\n')
+            output.append(prefix + 'fonts')
+            for i, p in enumerate(used_tags):
                 for row in range(0, scroll_data['parameters']['height']):
-                    print_fonts_data_one_row(scroll_data, files_handlers, p, row)
-            print('fontsen')
+                    start = (i * scroll_data['parameters']['height'] + row) * size
+                    output.append(emit_fonts_data_one_row(scroll_data, tables[0][start:start + size], p, row))
+            output.append(prefix + 'fontsen\n')
 
     else:
         if scroll_data['parameters']['language'] == 'C':
-            print('/* fonts data */')
-            print('uint8_t fonts[] = {')
+            output.append('/* fonts data */\n')
+            output.append('uint8_t ' + prefix + 'fonts[] = {\n')
             for row in range(0, scroll_data['parameters']['height']):
                 if row > 0:
-                    print()
-                print('\t/* row no. ' + str(row) + ' */')
-                for p in used_tags:
-                    print_fonts_data_one_row(scroll_data, files_handlers, p, row)
-            print('};')
+                    output.append('\n')
+                output.append('\t/* row no. ' + str(row) + ' */\n')
+                for i, p in enumerate(used_tags):
+                    output.append(emit_fonts_data_one_row(scroll_data, tables[row][i * size:(i + 1) * size], p, row))
+            output.append('};\n')
 
         elif scroll_data['parameters']['language'] == 'Assembler':
             for row in range(0, scroll_data['parameters']['height']):
                 if row > 0:
-                    print()
+                    output.append('\n')
                 if 'fonts_org' in scroll_data['parameters'] and\
                     len(scroll_data['parameters']['fonts_org']) >= row + 1 and\
                     len(str(scroll_data['parameters']['fonts_org'][row])) > 0:
-                        print(scroll_data['parameters']['fonts_org'][row])
-                print('; fonts data, row no. ' + str(row))
-                print('fonts' + str(row), end = '')
-                for p in used_tags:
-                    print_fonts_data_one_row(scroll_data, files_handlers, p, row)
-                print('fonts' + str(row) + 'e')
-
-    for p in files_handlers.values():
+                        output.append(scroll_data['parameters']['fonts_org'][row] + '\n')
+                output.append('; fonts data, row no. ' + str(row) + '\n')
+                output.append(prefix + 'fonts' + str(row))
+                for i, p in enumerate(used_tags):
+                    output.append(emit_fonts_data_one_row(scroll_data, tables[row][i * size:(i + 1) * size], p, row))
+                output.append(prefix + 'fonts' + str(row) + 'e\n')
+
+    return ''.join(output)
+
+
+# With "page_aligned", fonts data is stored in tables of one byte of each character: a table for each column, row
+# and line of cells, indexed by value of byte of scroll text. Tables are placed in 256-byte pages, several in one
+# page if they fit, at offsets from "begin" on, so "lda table,x" never crosses a page (and takes no extra cycle).
+def page_aligned_tables(scroll_data, used_tags):
+    # Column, row and line of cells of each table, and its page and offset in page. Without any characters, all
+    # tables are empty and in the first page.
+    width = scroll_data['parameters']['width']
+    begin = scroll_data['parameters']['begin']
+    height = scroll_data['parameters']['height']
+    per_page = (256 - begin) // len(used_tags) if len(used_tags) != 0 else 8 * width * height
+    tables = []
+    for row in range(0, height):
+        for column in range(0, width):
+            for line in range(0, 8):
+                index = len(tables)
+                tables.append({'column': column, 'row': row, 'line': line, 'page': index // per_page,
+                               'offset': begin + index % per_page * len(used_tags)})
+    return tables
+
+
+def page_aligned_table_label(table):
+    return 'fonts' + str(table['column']) + '_' + str(table['row']) + '_' + str(table['line'])
+
+
+def page_aligned_table_bytes(scroll_data, glyphs, used_tags, table):
+    offset = table['row'] * scroll_data['parameters']['width'] + table['column']
+    return bytes(glyphs[p['file']][p['offsets'][offset] * 8 + table['line']] for p in used_tags)
+
+
+def page_aligned_fonts_data(scroll_data, glyphs, used_tags):
+    # All pages as one block of bytes, with gaps filled with zeros.
+    data = bytearray()
+    for table in page_aligned_tables(scroll_data, used_tags):
+        start = table['page'] * 256 + table['offset']
+        data += bytes(start - len(data))
+        data += page_aligned_table_bytes(scroll_data, glyphs, used_tags, table)
+    return bytes(data)
+
+
+def page_aligned_comment(scroll_data, used_tags):
+    tables = page_aligned_tables(scroll_data, used_tags)
+    size = (tables[-1]['page'] * 256 + tables[-1]['offset'] + len(used_tags))
+    emitter = get_emitter(scroll_data)
+    values = 'X is value of byte of scroll text from ' + emit_literal(emitter, scroll_data['parameters']['begin']) +\
+             ' to ' + emit_literal(emitter, scroll_data['parameters']['begin'] + len(used_tags) - 1)
+    return 'fonts data, page-aligned tables for "lda table,x" (' +\
+           (values if len(used_tags) != 0 else 'no characters in scroll text') + '), tables: ' +\
+           str(len(tables)) + ', pages: ' + str(tables[-1]['page'] + 1) + ', gaps: ' +\
+           str(size - len(tables) * len(used_tags)) + ' bytes'
+
+
+def emit_page_aligned_fonts_data(scroll_data, glyphs, used_tags):
+    # Labels of tables are "fonts" with column, row and line of cells, and gaps between tables are reserved with
+    # labels "fontsgap" and the number of gap, so other data can be placed there.
+    emitter = get_emitter(scroll_data)
+    begin = scroll_data['parameters']['begin']
+    output = []
+    if 'fonts_org' in scroll_data['parameters'] and len(scroll_data['parameters']['fonts_org']) > 0 and\
+            len(str(scroll_data['parameters']['fonts_org'][0])) > 0:
+        output.append(scroll_data['parameters']['fonts_org'][0] + '\n')
+    output.append('; ' + page_aligned_comment(scroll_data, used_tags) + '\n')
+    output.append('\t.align $100\n')
+    output.append('fonts\n')
+
+    position = 0
+    gaps = 0
+    for table in page_aligned_tables(scroll_data, used_tags):
+        start = table['page'] * 256 + table['offset']
+        if start > position:
+            output.append('fontsgap' + str(gaps) + '\t.ds ' + str(start - position) + '\n')
+            gaps += 1
+        data = page_aligned_table_bytes(scroll_data, glyphs, used_tags, table)
+        if begin == 0:
+            # label is followed by the first line of data, or is alone in its line for an empty table
+            output.append(page_aligned_table_label(table) + ('\n' if len(data) == 0 else ''))
+        else:
+            output.append(page_aligned_table_label(table) + ' = * - ' + emit_literal(emitter, begin) + '\n')
+        for i in range(0, len(data), 8):
+            output.append(emit_line(emitter, [emitter['literals'][b] for b in data[i:i + 8]],
+                                    ' '.join('"' + p['tag'] + '"' for p in used_tags[i:i + 8]) + ' ' +
+                                    str(table['column']) + '_' + str(table['row']) + ' line ' +
+                                    str(table['line'])) + '\n')
+        position = start + len(data)
+    output.append('fontsen\n')
+
+    return ''.join(output)
+
+
+def emit_page_aligned_labels(scroll_data, used_tags):
+    # Labels of tables, when fonts data is included as one binary file beginning at label "fonts".
+    begin = scroll_data['parameters']['begin']
+    return ''.join(page_aligned_table_label(p) + ' = fonts + ' + str(p['page'] * 256 + p['offset'] - begin) + '\n'
+                   for p in page_aligned_tables(scroll_data, used_tags)) + '\n'
+
+
+def emit_fonts_data_one_row(scroll_data, data, p, row):
+    # One line of 8 bytes for each character (a part of font) in a row, data holds cells of all columns.
+    emitter = get_emitter(scroll_data)
+    literals = emitter['literals']
+    width = scroll_data['parameters']['width']
+    lines = []
+    for column in range(0, width):
+        lines.append(emit_line(emitter, [literals[b] for b in data[column * 8:column * 8 + 8]],
+                               '"' + p['tag'] + '" ' + p['set'] + ' ' + str(column) + '_' + str(row)) + '\n')
+
+    return ''.join(lines)
+
+
+def emit_fonts_data_dedup(scroll_data, glyphs, used_tags, prefix = ''):
+    # Each unique cell (a part of font) is stored only once, and a table of indexes of cells follows each table
+    # of fonts data, with one line for each character.
+    emitter = get_emitter(scroll_data)
+    literals = emitter['literals']
+    language = scroll_data['parameters']['language']
+    tables = dedup_fonts_data_cells(scroll_data, glyphs, fonts_data_cells(scroll_data, used_tags))
+    consolidated = len(tables) == 1
+    cells_per_tag = scroll_data['parameters']['width'] * (scroll_data['parameters']['height'] if consolidated else 1)
+    words = max(len(t['cells']) for t in tables) > 256
+    output = []
+
+    unique_cells = sum(len(t['cells']) for t in tables)
+    all_cells = sum(len(t['indexes']) for t in tables)
+    summary = 'unique cells: ' + str(unique_cells) + ' of ' + str(all_cells) + ', saved: ' +\
+              str((all_cells - unique_cells) * 8) + ' bytes, indexes of cells: ' +\
+              str(all_cells * (2 if words else 1)) + ' bytes'
+
+    if language == 'C':
+        output.append('/* fonts data, ' + summary + ' */\n')
+        output.append('uint8_t ' + prefix + 'fonts[] = {\n')
+        for row in range(0, len(tables)):
+            if not consolidated:
+                if row > 0:
+                    output.append('\n')
+                output.append('\t/* row no. ' + str(row) + ' */\n')
+            output.append(emit_fonts_data_dedup_cells(scroll_data, glyphs, tables[row]))
+        output.append('};\n\n')
+        output.append('/* indexes of cells of characters */\n')
+        output.append(('uint16_t' if words else 'uint8_t') + ' ' + prefix + 'cells[] = {\n')
+        for row in range(0, len(tables)):
+            if not consolidated:
+                if row > 0:
+                    output.append('\n')
+                output.append('\t/* row no. ' + str(row) + ' */\n')
+            output.append(emit_fonts_data_dedup_indexes(emitter, words, used_tags, tables[row], cells_per_tag))
+        output.append('};\n')
+
+    elif language == 'Assembler':
+        for row in range(0, len(tables)):
+            label = '' if consolidated else str(row)
+            if row > 0:
+                output.append('\n')
+            if 'fonts_org' in scroll_data['parameters'] and\
+                len(scroll_data['parameters']['fonts_org']) >= row + 1 and\
+                len(str(scroll_data['parameters']['fonts_org'][row])) > 0:
+                    output.append(scroll_data['parameters']['fonts_org'][row] + '\n')
+            if consolidated:
+                output.append('; fonts data, ' + summary + '\n')
+            else:
+                output.append('; fonts data, row no. ' + str(row) + ', unique cells: ' +
+                              str(len(tables[row]['cells'])) + ' of ' + str(len(tables[row]['indexes'])) + '\n')
+            output.append(prefix + 'fonts' + label)
+            output.append(emit_fonts_data_dedup_cells(scroll_data, glyphs, tables[row]))
+            output.append(prefix + 'fonts' + label + ('en' if consolidated else 'e') + '\n')
+            output.append('; indexes of cells of characters\n')
+            output.append(prefix + 'cells' + label)
+            output.append(emit_fonts_data_dedup_indexes(emitter, words, used_tags, tables[row], cells_per_tag))
+            output.append(prefix + 'cells' + label + ('en' if consolidated else 'e') + '\n')
+        if not consolidated:
+            output.append('; ' + summary + '\n')
+
+    return ''.join(output)
+
+
+def emit_banks_fonts_data(scroll_data, glyphs, used_tags, segments):
+    # Tables of fonts data of each bank (only the first one is placed with "fonts_org"), named with prefix "bank"
+    # and the number of bank, followed by a table of addresses of tables of all banks for each row.
+    rows = 1 if scroll_data['parameters']['height'] == 1 or scroll_data['parameters']['consolidation'] == True or\
+        scroll_data['parameters']['language'] == 'C' else scroll_data['parameters']['height']
+    later_banks = dict(scroll_data, parameters = {k: v for k, v in scroll_data['parameters'].items()
+                                                  if k != 'fonts_org'})
+    output = []
+    for bank, segment in enumerate(segments):
+        if bank > 0:
+            output.append('\n')
+        tags = [used_tags[p] for p in segment['tags']]
+        if scroll_data['parameters']['language'] == 'C':
+            output.append('/* bank no. ' + str(bank) + ', unique characters: ' + str(len(tags)) + ' */\n')
+        elif scroll_data['parameters']['language'] == 'Assembler':
+            output.append('; bank no. ' + str(bank) + ', unique characters: ' + str(len(tags)) + '\n')
+        output.append(emit_fonts_data(scroll_data if bank == 0 else later_banks, glyphs, tags, None,
+                                      'bank' + str(bank)))
+
+    output.append('\n')
+    for row in range(0, rows):
+        label = '' if rows == 1 else str(row)
+        names = ['bank' + str(bank) + 'fonts' + label for bank in range(0, len(segments))]
+        if scroll_data['parameters']['language'] == 'C':
+            output.append('/* tables of fonts data of banks */\n')
+            output.append('uint8_t *banks[] = {' + ', '.join(names) + '};\n')
+        elif scroll_data['parameters']['language'] == 'Assembler':
+            output.append('; tables of fonts data of banks' + ('' if rows == 1 else ', row no. ' + str(row)) + '\n')
+            output.append('banks' + label + '\t.word ' + ', '.join(names) + '\n')
+
+    return ''.join(output)
+
+
+def emit_fonts_data_dedup_cells(scroll_data, glyphs, table):
+    emitter = get_emitter(scroll_data)
+    literals = emitter['literals']
+    width = scroll_data['parameters']['width']
+    lines = []
+    for p, column, row in table['cells']:
+        cell = get_glyph_cell(glyphs, p, p['offsets'][row * width + column])
+        lines.append(emit_line(emitter, [literals[b] for b in cell],
+                               '"' + p['tag'] + '" ' + p['set'] + ' ' + str(column) + '_' + str(row)) + '\n')
+    return ''.join(lines)
+
+
+def emit_fonts_data_dedup_indexes(emitter, words, used_tags, table, cells_per_tag):
+    if words:
+        if emitter['format'] == 'hex':
+            literals = [('0x' if emitter['language'] == 'C' else '$') + format(i, '04x') for i in table['indexes']]
+        else:
+            literals = [str(i) for i in table['indexes']]
+        words_emitter = emitter.copy()
+        if emitter['language'] == 'Assembler':
+            words_emitter['line_begin'] = '\t.word '
+    else:
+        literals = [emitter['literals'][i] for i in table['indexes']]
+        words_emitter = emitter
+
+    lines = []
+    for i in range(0, len(used_tags)):
+        lines.append(emit_line(words_emitter, literals[i * cells_per_tag:(i + 1) * cells_per_tag],
+                               '"' + used_tags[i]['tag'] + '" ' + used_tags[i]['set']) + '\n')
+    return ''.join(lines)
+
+
+def write_output(output, filename, keep_unchanged = False):
+    # Writes whole output at once, to given file or to standard output. With keep_unchanged, a file which already
+    # has the same content is not touched at all (so its modification time does not trigger further rebuilds).
+    # Returns True if anything was written.
+    if filename == None:
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        return True
+
+    if keep_unchanged == True and os.path.isfile(filename):
         try:
-            p.close()
-        except:
-            eprint('File "' + p.name + '" cannot be closed!')
+            with open(filename, encoding = 'utf-8', mode = 'r') as output_file:
+                if output_file.read() == output:
+                    return False
+        except (OSError, UnicodeDecodeError):
+            pass
+
+    try:
+        with open(filename, encoding = 'utf-8', mode = 'w') as output_file:
+            output_file.write(output)
+    except:
+        raise ScrollPackerError('File "' + filename + '" cannot be written!')
+
+    return True
+
+
+def cells_bytes(indexes):
+    # Indexes of cells are bytes, or little-endian words when there are more than 256 unique cells.
+    if len(indexes) != 0 and max(indexes) > 255:
+        return b''.join(i.to_bytes(2, byteorder = 'little') for i in indexes)
+    return bytes(indexes)
+
+
+def binary_files(scroll_data, result, base_name):
+    # Returns binary files of scroll text data and fonts data (and indexes of cells with "dedup"), named after
+    # base_name, with labels of their beginning and end, and Assembler's ORG directives. With segments, tables of
+    # each bank are named with prefix "bank" and the number of bank, and only the first bank has ORG directives.
+    banks = len(result['segments']) if result['segments'] != None else 1
+    rows = len(result['fonts']) // banks
+    consolidated = rows == 1
+    compression = result['compression']
+    files = [{'label': 'text', 'end': 'textend', 'name': base_name + '_text.bin', 'data': result['text'],
+              'org': scroll_data['parameters']['text_org'] if 'text_org' in scroll_data['parameters'] else '',
+              'comment': 'scroll text, length: ' + str(scroll_text_length(result['output_scroll_data'])) +
+                         ', unique characters: ' + str(len(result['used_tags'])),
+              'comments': ([segments_comment(result['segments'])] if result['segments'] != None else []) +
+                          (compression_comments(scroll_data, compression) if compression != None else []),
+              'code': emit_depacker(scroll_data, compression) if compression != None and
+                                                                  compression['codec'] != 'none' else ''}]
+
+    for index in range(0, len(result['fonts'])):
+        bank = index // rows
+        row = index % rows
+        prefix = 'bank' + str(bank) if result['segments'] != None else ''
+        label = '' if consolidated else str(row)
+        details = ('' if prefix == '' else ', bank no. ' + str(bank)) +\
+                  ('' if consolidated else ', row no. ' + str(row))
+        org = ''
+        if 'fonts_org' in scroll_data['parameters'] and len(scroll_data['parameters']['fonts_org']) >= row + 1 and\
+                bank == 0:
+            org = scroll_data['parameters']['fonts_org'][row]
+        files.append({'label': prefix + 'fonts' + label,
+                      'end': prefix + 'fonts' + label + ('en' if consolidated else 'e'),
+                      'name': base_name + '_' + prefix + 'fonts' + label + '.bin', 'data': result['fonts'][index],
+                      'org': org, 'comment': 'fonts data' + details, 'comments': [], 'code': ''})
+        if result['cells'] != None:
+            files.append({'label': prefix + 'cells' + label,
+                          'end': prefix + 'cells' + label + ('en' if consolidated else 'e'),
+                          'name': base_name + '_' + prefix + 'cells' + label + '.bin',
+                          'data': cells_bytes(result['cells'][index]), 'org': '',
+                          'comment': 'indexes of cells of characters' + details, 'comments': [], 'code': ''})
+
+    if result['streams'] != None:
+        comments = column_streams_comments(scroll_data, result['streams'], len(result['text']), consolidated)
+        for row in range(0, len(result['streams'])):
+            files.append({'label': 'stream' + str(row), 'end': 'stream' + str(row) + 'end',
+                          'name': base_name + '_stream' + str(row) + '.bin', 'data': result['streams'][row],
+                          'org': '', 'comment': 'column stream, row no. ' + str(row),
+                          'comments': comments if row == 0 else [], 'code': ''})
+
+    if scroll_data['parameters'].get('page_aligned', False) == True:
+        files[1]['org'] = (files[1]['org'].rstrip('\n') + '\n' if len(files[1]['org']) > 0 else '') + '\t.align $100'
+        files[1]['comment'] = page_aligned_comment(scroll_data, result['used_tags'])
+        files[1]['code'] = emit_page_aligned_labels(scroll_data, result['used_tags'])
+
+    return files
+
+
+def emit_binary_include(scroll_data, files, filename, deterministic = False):
+    # Source code including binary files, with labels and sizes of data.
+    output = [emit_header(scroll_data, filename, deterministic)]
+    for p in files:
+        if scroll_data['parameters']['language'] == 'C':
+            output.append('/* ' + p['comment'] + ', binary file "' + p['name'] + '" */\n')
+            output += ['/* ' + r + ' */\n' for r in p['comments']]
+            output.append('#define ' + p['label'].upper() + '_SIZE ' + str(len(p['data'])) + '\n')
+            output.append('extern const uint8_t ' + p['label'] + '[' + p['label'].upper() + '_SIZE];\n\n')
+        elif scroll_data['parameters']['language'] == 'Assembler':
+            if len(p['org']) > 0:
+                output.append(p['org'] + '\n')
+            output.append('; ' + p['comment'] + '\n')
+            output += ['; ' + r + '\n' for r in p['comments']]
+            output.append(p['label'] + "\tins '" + p['name'] + "'\n")
+            output.append(p['end'] + '\n')
+            output.append(p['label'] + 'size = ' + str(len(p['data'])) + '\n\n')
+            output.append(p['code'])
+
+    return ''.join(output)
+
+
+def fonts_data_cells(scroll_data, used_tags):
+    # Returns cells (parts of fonts) of fonts data in order of output, as one table when consolidated or one table
+    # for each row. Each cell is a tuple of used tag, column and row.
+    width = scroll_data['parameters']['width']
+    height = scroll_data['parameters']['height']
+    if height == 1 or scroll_data['parameters']['consolidation'] == True:
+        return [[(p, column, row) for p in used_tags for row in range(0, height) for column in range(0, width)]]
+
+    return [[(p, column, row) for p in used_tags for column in range(0, width)] for row in range(0, height)]
+
+
+def dedup_fonts_data_cells(scroll_data, glyphs, tables):
+    # For each table of cells returns unique cells (the first of identical ones) and, for each cell, the index
+    # of its unique cell.
+    width = scroll_data['parameters']['width']
+    result = []
+    for table in tables:
+        known = {}
+        cells = []
+        indexes = []
+        for p, column, row in table:
+            cell = get_glyph_cell(glyphs, p, p['offsets'][row * width + column])
+            if not cell in known:
+                known[cell] = len(cells)
+                cells.append((p, column, row))
+            indexes.append(known[cell])
+        result.append({'cells': cells, 'indexes': indexes})
+    return result
+
+
+def fonts_data_tables(scroll_data, glyphs, used_tags):
+    # Returns fonts data as bytes, one table when consolidated or one table for each row. With "dedup", tables
+    # contain unique cells only and indexes of cells are returned as well. With "page_aligned", all pages are one
+    # table.
+    if scroll_data['parameters'].get('page_aligned', False) == True:
+        return [page_aligned_fonts_data(scroll_data, glyphs, used_tags)], None
+
+    if not 'dedup' in scroll_data['parameters'] or scroll_data['parameters']['dedup'] != True:
+        return gather_fonts_data(scroll_data, glyphs, used_tags), None
+
+    width = scroll_data['parameters']['width']
+    tables = dedup_fonts_data_cells(scroll_data, glyphs, fonts_data_cells(scroll_data, used_tags))
+    return [b''.join(get_glyph_cell(glyphs, p, p['offsets'][row * width + column]) for p, column, row in t['cells'])
+            for t in tables], [t['indexes'] for t in tables]
+
+
+def new_stats(filename = ''):
+    return {'json': filename, 'version': version, 'cached': False, 'phases': []}
+
+
+def measure_phase(stats, name, function, *args):
+    # Runs function and, when stats are collected, records its wall time and peak memory allocated during it (as
+    # traced by tracemalloc, which is started by the first measured phase).
+    if stats == None:
+        return function(*args)
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    memory = tracemalloc.get_traced_memory()[0]
+    start_time = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        stats['phases'].append({'phase': name, 'time': time.perf_counter() - start_time,
+                                'peak_memory': tracemalloc.get_traced_memory()[1] - memory})
 
 
-def print_fonts_data_one_row(scroll_data, files_handlers, p, row):
+def count_scroll_text_bytes(values, counts):
+    # Passes pairs of byte and value of "or" through, counting occurrences of each byte in counts (a dict).
+    for p in values:
+        counts[p[0]] = counts.get(p[0], 0) + 1
+        yield p
+
+
+def usage_stats(stats, output_scroll_data, used_tags, glyphs, text_length, fonts, cells, counts = None, top = 20):
+    # Adds to stats reads of font files, unique tags and bytes of scroll text data of each set, the most often
+    # used tags and total sizes of scroll text data and fonts data (with indexes of cells). Occurrences of bytes
+    # are given in counts (see count_scroll_text_bytes()) when scroll text data was not kept.
+    if counts != None:
+        counts = [counts.get(i, 0) for i in range(0, len(used_tags))]
+    else:
+        counts = [0] * len(used_tags)
+        for byte in output_scroll_data['bytes']:
+            counts[byte] += 1
+
+    sets = {}
+    for p, count in zip(used_tags, counts):
+        if not p['set'] in sets:
+            sets[p['set']] = {'set': p['set'], 'file': p['file'], 'unique_tags': 0, 'bytes': 0}
+        sets[p['set']]['unique_tags'] += 1
+        sets[p['set']]['bytes'] += count
+
+    order = sorted(range(0, len(used_tags)), key = lambda i: (-counts[i], i))[:top]
+    stats['font_files'] = {'reads': len(glyphs), 'bytes': sum(len(p) for p in glyphs.values())}
+    stats['unique_tags'] = len(used_tags)
+    stats['sets'] = list(sets.values())
+    stats['top_tags'] = [{'tag': used_tags[i]['tag'], 'set': used_tags[i]['set'], 'count': counts[i]} for i in order]
+    stats['banks'] = len(output_scroll_data['segments']) if output_scroll_data['segments'] != None else None
+    stats['text_bytes'] = text_length
+    stats['fonts_bytes'] = sum(len(p) for p in fonts) + (sum(len(cells_bytes(p)) for p in cells) if cells != None
+                                                         else 0)
+
+
+def write_stats(stats, filename):
+    # Writes stats as JSON to file or, when filename is '-', to standard error.
+    report = json.dumps(stats, ensure_ascii = False, indent = 4) + '\n'
+    if filename == '-':
+        sys.stderr.write(report)
+        sys.stderr.flush()
+        return
+    try:
+        with open(filename, encoding = 'utf-8', mode = 'w') as stats_file:
+            stats_file.write(report)
+    except OSError:
+        raise ScrollPackerError('File "' + filename + '" cannot be written!')
+
+
+def parse_address(value):
+    # Address is an integer, or a string with hexadecimal number beginning with "$" or "0x".
+    if type(value) == str:
+        digits = value[1:] if value.startswith('$') else value[2:] if value.lower().startswith('0x') else None
+        try:
+            value = int(digits, 16) if digits != None and len(digits) > 0 else None
+        except ValueError:
+            value = None
+    if type(value) != int or value < 0 or value > 0x10000:
+        return None
+    return value
+
+
+def emit_address(scroll_data, address):
+    return ('0x' if scroll_data['parameters']['language'] == 'C' else '$') + format(address, '04x')
+
+
+def fonts_layout(scroll_data, glyphs, used_tags, segments, consolidation):
+    # Exact bytes of fonts data with given consolidation: blocks (a table of fonts data, followed by its indexes
+    # of cells with "dedup") with padding before each block. With "fonts_align", each block begins at an aligned
+    # address, and (without "dedup", when characters are addressed by values of bytes in scroll text) values below
+    # "begin" take space before it.
+    parameters = scroll_data['parameters']
+    align = parameters.get('fonts_align', 1)
+    layout_data = dict(scroll_data, parameters = dict(parameters, consolidation = consolidation))
+    fonts, cells = segments_fonts_data_tables(layout_data, glyphs, used_tags, segments)
+    rows = len(fonts) // (len(segments) if segments != None else 1)
+    character = parameters['width'] * 8 * (parameters['height'] if rows == 1 else 1)
+
+    blocks = []
+    for index in range(0, len(fonts)):
+        size = len(fonts[index]) + (len(cells_bytes(cells[index])) if cells != None else 0)
+        before = parameters['begin'] * character if align > 1 and cells == None else 0
+        blocks.append({'size': size, 'before': before,
+                       'padding': (before + size + align - 1) // align * align - size if align > 1 else 0})
+
+    data = sum(p['size'] for p in blocks)
+    padding = sum(p['padding'] for p in blocks)
+    return {'consolidation': consolidation, 'name': 'consolidated' if rows == 1 else 'rows', 'blocks': blocks,
+            'data': data, 'padding': padding, 'bytes': data + padding, 'addresses': None}
+
+
+def place_fonts_layout(layout, regions, align):
+    # Places blocks one by one at the first aligned address of free memory where they fit, and returns addresses
+    # of tables of fonts data, or None if any block does not fit.
+    free = [[parse_address(p[0]), parse_address(p[1])] for p in regions]
+    addresses = []
+    for p in layout['blocks']:
+        for r in free:
+            start = (r[0] + align - 1) // align * align
+            if start + p['before'] + p['size'] <= r[1]:
+                addresses.append(start + p['before'])
+                r[0] = start + p['before'] + p['size']
+                break
+        else:
+            return None
+    return addresses
+
+
+def plan_fonts_layout(scroll_data, glyphs, used_tags, segments = None):
+    """Chooses layout of fonts data when "consolidation" is "auto": the smallest of one consolidated table and
+    tables for each row (counting padding of "fonts_align" and "begin"), which fits in "fonts_memory" if it is given.
+    Tables of chosen layout are then placed in "fonts_memory" with Assembler's ORG directives. Returns scroll data
+    with chosen "consolidation" (and "fonts_org") and the plan (None when there is nothing to plan)."""
+    parameters = scroll_data['parameters']
+    if parameters.get('consolidation') != 'auto' and not 'fonts_memory' in parameters or\
+            parameters.get('page_aligned', False) == True:
+        return scroll_data, None
+
+    if parameters.get('consolidation') == 'auto' and parameters['height'] > 1:
+        candidates = [True, False]
+    else:
+        candidates = [parameters.get('consolidation', True) != False]
+    layouts = [fonts_layout(scroll_data, glyphs, used_tags, segments, p) for p in candidates]
+
+    fitting = layouts
+    if 'fonts_memory' in parameters:
+        for p in layouts:
+            p['addresses'] = place_fonts_layout(p, parameters['fonts_memory'], parameters.get('fonts_align', 1))
+        fitting = [p for p in layouts if p['addresses'] != None]
+        if len(fitting) == 0:
+            raise ScrollTextError('Fonts data does not fit in "fonts_memory" (' + ', '.join(
+                p['name'] + ': ' + str(p['bytes']) + ' bytes' for p in layouts) + ')!')
+
+    chosen = min(fitting, key = lambda p: (p['bytes'], len(p['blocks'])))
+    reason = 'the only layout' if len(layouts) == 1 else 'the smallest' if len(fitting) == len(layouts) else\
+        'the only one fitting'
+    plan = {'chosen': chosen, 'layouts': layouts,
+            'reason': reason + (' in "fonts_memory"' if 'fonts_memory' in parameters else '')}
+
+    planned = dict(parameters, consolidation = chosen['consolidation'])
+    if chosen['addresses'] != None and parameters['language'] == 'Assembler':
+        planned['fonts_org'] = ['\torg ' + emit_address(scroll_data, p) for p in chosen['addresses']]
+    return dict(scroll_data, parameters = planned), plan
+
+
+def fonts_layout_comments(scroll_data, plan):
+    if plan == None:
+        return []
+
+    comments = []
+    for p in plan['layouts']:
+        comments.append('fonts layout: ' + p['name'] + ', tables: ' + str(len(p['blocks'])) + ', data: ' +
+                        str(p['data']) + ' bytes, padding: ' + str(p['padding']) + ' bytes, total: ' +
+                        str(p['bytes']) + ' bytes' + ('' if p['addresses'] == None else ', at ' +
+                        ', '.join(emit_address(scroll_data, r) for r in p['addresses'])))
+    comments.append('chosen fonts layout: ' + plan['chosen']['name'] + ', ' + plan['reason'])
+    return comments
+
+
+def emit_comments(scroll_data, comments):
     if scroll_data['parameters']['language'] == 'C':
-        print('\t', end = '')
-        for i in range(0, scroll_data['parameters']['width'] * 8):
-            files_handlers[p['set']].seek(p['offsets'][row * scroll_data['parameters']['width'] + i // 8] * 8 +
-                                          (i % 8), 0)
-            if i % 8 == 7:
-                if scroll_data['parameters']['format'] == 'hex':
-                    print('0x' + format(int.from_bytes(files_handlers[p['set']].read(1), byteorder = 'little'), '02x') +
-                          ',', end = '')
-                elif scroll_data['parameters']['format'] == 'dec':
-                    print(str(int.from_bytes(files_handlers[p['set']].read(1), byteorder = 'little')) + ',', end = '')
-                print('\t/* "' + p['tag'] + '" ' + p['set'] + ' ' + str(i // 8) + '_' + str(row) + ' */')
-                if i < scroll_data['parameters']['width'] * 8 - 1:
-                    print('\t', end = '')
+        return ''.join('/* ' + p + ' */\n' for p in comments)
+    return ''.join('; ' + p + '\n' for p in comments)
+
+
+def segments_fonts_data_tables(scroll_data, glyphs, used_tags, segments):
+    # Like fonts_data_tables(), but with segments tables of all banks are one after another.
+    if segments == None:
+        return fonts_data_tables(scroll_data, glyphs, used_tags)
+
+    fonts = []
+    cells = None
+    for segment in segments:
+        bank_fonts, bank_cells = fonts_data_tables(scroll_data, glyphs, [used_tags[p] for p in segment['tags']])
+        fonts += bank_fonts
+        if bank_cells != None:
+            cells = (cells if cells != None else []) + bank_cells
+    return fonts, cells
+
+
+def scroll_text_data(scroll_data, output_scroll_data, used_tags):
+    # Returns bytes of scroll text data and the result of its compression (None when "compression" is not used).
+    text = scroll_text_bytes(scroll_data, output_scroll_data, used_tags)
+    compression = None
+    if scroll_data['parameters'].get('compression', 'none') != 'none':
+        compression = compress_scroll_text(scroll_data, text)
+    return text, compression
+
+
+def validate(scroll_data, base_dir = None):
+    # Library of scroll data has to be resolved already, see resolve_library().
+    validate_config(scroll_data)
+    input_scroll_text = parse_scroll_text(scroll_data, base_dir)
+    return input_scroll_text
+
+
+def pack(scroll_data, base_dir = None, filename = '', deterministic = False, binary_name = None, stats = None):
+    """Packs scroll described by already loaded JSON data.
+
+    Paths of font files are relative to base_dir (or to the current directory, if it is not given), and filename
+    is only shown in the header of output (without date and time, if deterministic). Returns a dict with bytes of
+    scroll text data ('text', packed when "compression" is used), list of bytes of fonts data tables ('fonts'), list
+    of indexes of cells for each table when "dedup" is used ('cells'), used tags ('used_tags'), scroll text data
+    ('output_scroll_data'), chosen codec with sizes of all tried codecs ('compression', None when not used),
+    segments of scroll text with codes of characters in their banks ('segments', None when not "segmented"; fonts
+    data tables and indexes of cells of all banks are then one after another), column streams for each row
+    ('streams', None when not "streams") and rendered source code ('output').
+
+    When binary_name is given, scroll text data and fonts data are returned as binary files, named after it, in
+    'binary' (a list of dicts with 'name' and 'data'), and 'output' only includes these files.
+    When stats is given (see new_stats()), time and memory of each phase and usage of sets, tags and font files
+    are added to it.
+    Raises ScrollPackerError or one of its subclasses on any error.
+    """
+    scroll_data = measure_phase(stats, 'library', resolve_library, scroll_data, base_dir)
+    input_scroll_text = measure_phase(stats, 'validate', validate, scroll_data, base_dir)
+    output_scroll_data, used_tags = measure_phase(stats, 'tokenize', find_sets_or_tags_in_scroll_text, scroll_data,
+                                                  input_scroll_text)
+    glyphs = measure_phase(stats, 'load_fonts', load_glyphs, used_tags, base_dir,
+                           library_glyphs(scroll_data, used_tags), font_images(scroll_data))
+    segments = output_scroll_data['segments']
+    scroll_data, layout = measure_phase(stats, 'layout', plan_fonts_layout, scroll_data, glyphs, used_tags, segments)
+    fonts, cells = measure_phase(stats, 'fonts_data', segments_fonts_data_tables, scroll_data, glyphs, used_tags,
+                                 segments)
+    text, compression = measure_phase(stats, 'text_data', scroll_text_data, scroll_data, output_scroll_data,
+                                      used_tags)
+    streams = None
+    if scroll_data['parameters'].get('streams', False) == True:
+        streams = measure_phase(stats, 'streams', column_streams, scroll_data, glyphs, output_scroll_data, used_tags)
+
+    result = {'text': compression['data'] if compression != None else text,
+              'fonts': fonts,
+              'cells': cells,
+              'used_tags': used_tags,
+              'output_scroll_data': output_scroll_data,
+              'compression': compression,
+              'segments': segments,
+              'layout': layout,
+              'streams': streams}
+
+    if binary_name != None:
+        files = measure_phase(stats, 'emit_binary', binary_files, scroll_data, result, binary_name)
+        files[1]['comments'] = fonts_layout_comments(scroll_data, layout) + files[1]['comments']
+        result['binary'] = [{'name': p['name'], 'data': p['data']} for p in files]
+        result['output'] = emit_binary_include(scroll_data, files, filename, deterministic)
+    else:
+        result['output'] = emit_header(scroll_data, filename, deterministic) +\
+                           measure_phase(stats, 'emit_text', emit_scroll_data, scroll_data, output_scroll_data,
+                                         used_tags, compression) +\
+                           (emit_column_streams(scroll_data, streams, output_scroll_data, used_tags,
+                                                len(result['text'])) if streams != None else '') +\
+                           emit_comments(scroll_data, fonts_layout_comments(scroll_data, layout)) +\
+                           measure_phase(stats, 'emit_fonts', emit_fonts_data, scroll_data, glyphs, used_tags,
+                                         segments)
+
+    if stats != None:
+        usage_stats(stats, output_scroll_data, used_tags, glyphs, len(result['text']), fonts, cells)
+
+    return result
+
+
+# Preview of scroll is an image of characters of scroll text one after another, in lines of given number of
+# characters. Pixels are numbers of colors: values of bits of fonts (2-bit pixels are two pixels wide), with bit 7
+# of "or" making 1-bit characters inverse and turning value 3 of 2-bit characters into the fifth color (4).
+preview_palettes = {1: (0x000000, 0xffffff),
+                    2: (0x000000, 0xffff00, 0x008000, 0x0000ff, 0xff0000)}
+preview_blocks = {(0, 0): ' ', (1, 0): '\u2580', (0, 1): '\u2584', (1, 1): '\u2588'}
+
+
+def preview_characters(scroll_data, glyphs, used_tags, bits):
+    # Pixels of each used tag, from the same cells as emitted fonts data. With NumPy, as an array of tags x rows x
+    # columns of pixels, otherwise as lists of rows.
+    width = scroll_data['parameters']['width']
+    height = scroll_data['parameters']['height']
+    data = gather_fonts_data(dict(scroll_data, parameters = dict(scroll_data['parameters'], consolidation = True)),
+                             glyphs, used_tags)[0]
+    shifts = range(8 - bits, -1, -bits)
+    if numpy != None:
+        cells = numpy.frombuffer(data, dtype = numpy.uint8).reshape(len(used_tags), height, width, 8, 1)
+        pixels = cells >> numpy.array(shifts, dtype = numpy.uint8) & (1 << bits) - 1
+        pixels = numpy.repeat(pixels, bits, axis = 4)
+        return pixels.transpose(0, 1, 3, 2, 4).reshape(len(used_tags), height * 8, width * 8)
+
+    characters = []
+    for i in range(0, len(used_tags)):
+        rows = []
+        for row in range(0, height):
+            for line in range(0, 8):
+                pixels = []
+                for column in range(0, width):
+                    byte = data[((i * height + row) * width + column) * 8 + line]
+                    for shift in shifts:
+                        pixels += [byte >> shift & (1 << bits) - 1] * bits
+                rows.append(pixels)
+        characters.append(rows)
+    return characters
+
+
+def render_preview(scroll_data, glyphs, output_scroll_data, used_tags, bits = 1, columns = 40):
+    """Renders scroll text data with fonts data as a preview (see preview_palettes), decoding cells of all used tags
+    at once with NumPy when it is available. Returns rows of pixels (a NumPy array or lists)."""
+    characters = preview_characters(scroll_data, glyphs, used_tags, bits)
+    count = max(1, len(output_scroll_data['bytes']))
+    lines = (count + columns - 1) // columns
+    if numpy != None:
+        indexes = numpy.array(output_scroll_data['bytes'], dtype = numpy.intp)
+        special = (numpy.array(output_scroll_data['or'], dtype = numpy.intp) & 0x80 != 0)[:, None, None]
+        pixels = characters[indexes]
+        if bits == 1:
+            pixels = pixels ^ special
+        else:
+            pixels = numpy.where(special & (pixels == 3), 4, pixels)
+        pixels = numpy.concatenate((pixels.astype(numpy.uint8),
+                                    numpy.zeros((lines * columns - len(indexes),) + characters.shape[1:],
+                                                dtype = numpy.uint8)))
+        pixels = pixels.reshape(lines, columns, characters.shape[1], characters.shape[2]).transpose(0, 2, 1, 3)
+        return pixels.reshape(lines * characters.shape[1], columns * characters.shape[2])
+
+    height = scroll_data['parameters']['height'] * 8
+    blank = [0] * (scroll_data['parameters']['width'] * 8)
+    # inverse (or fifth color) variants of characters are made only for characters which need them
+    special = {}
+    rows = []
+    for line in range(0, lines):
+        images = []
+        for position in range(line * columns, (line + 1) * columns):
+            if position >= len(output_scroll_data['bytes']):
+                images.append([blank] * height)
+                continue
+            byte = output_scroll_data['bytes'][position]
+            if output_scroll_data['or'][position] & 0x80 == 0:
+                images.append(characters[byte])
+                continue
+            if not byte in special:
+                special[byte] = [[p ^ 1 if bits == 1 else (4 if p == 3 else p) for p in r] for r in characters[byte]]
+            images.append(special[byte])
+        for y in range(0, height):
+            rows.append([p for image in images for p in image[y]])
+    return rows
+
+
+def encode_png(pixels, palette):
+    # PNG image with palette (colors as 0xrrggbb), pixels are indexes of colors.
+    if numpy != None and type(pixels) != list:
+        height, width = pixels.shape
+        raw = numpy.concatenate((numpy.zeros((height, 1), dtype = numpy.uint8), pixels.astype(numpy.uint8)),
+                                axis = 1).tobytes()
+    else:
+        height, width = len(pixels), len(pixels[0])
+        raw = b''.join(b'\0' + bytes(row) for row in pixels)
+
+    def chunk(kind, data):
+        return len(data).to_bytes(4, byteorder = 'big') + kind + data +\
+               zlib.crc32(kind + data).to_bytes(4, byteorder = 'big')
+
+    return png_signature +\
+           chunk(b'IHDR', width.to_bytes(4, byteorder = 'big') + height.to_bytes(4, byteorder = 'big') +
+                 bytes([8, 3, 0, 0, 0])) +\
+           chunk(b'PLTE', b''.join(p.to_bytes(3, byteorder = 'big') for p in palette)) +\
+           chunk(b'IDAT', zlib.compress(raw)) +\
+           chunk(b'IEND', b'')
+
+
+def preview_text(pixels, bits):
+    # Terminal block characters, each of two pixels one above the other. With 2 bits, colors are given by ANSI
+    # escape codes (foreground for the upper pixel, background for the lower one).
+    rows = pixels.tolist() if type(pixels) != list else pixels
+    palette = preview_palettes[bits]
+    lines = []
+    for y in range(0, len(rows), 2):
+        upper = rows[y]
+        lower = rows[y + 1] if y + 1 < len(rows) else [0] * len(upper)
+        if bits == 1:
+            lines.append(''.join(preview_blocks[pair] for pair in zip(upper, lower)))
+        else:
+            lines.append(''.join('\x1b[38;2;' + ';'.join(str(palette[a] >> r & 255) for r in (16, 8, 0)) +
+                                 'm\x1b[48;2;' + ';'.join(str(palette[b] >> r & 255) for r in (16, 8, 0)) +
+                                 'm\u2580' for a, b in zip(upper, lower)) + '\x1b[0m')
+    return '\n'.join(lines) + '\n'
+
+
+def preview(scroll_data, base_dir = None, bits = 1, columns = None, line_width = 320):
+    """Tokenizes scroll text of already loaded JSON data and renders it with used fonts, without packing, see
+    render_preview(). Bits are bits of pixels of fonts (1 or 2). Lines have given number of characters, or as many
+    as fit in line_width pixels (320, the width of screen, by default)."""
+    scroll_data = resolve_library(scroll_data, base_dir)
+    input_scroll_text = validate(scroll_data, base_dir)
+    output_scroll_data, used_tags = find_sets_or_tags_in_scroll_text(scroll_data, input_scroll_text)
+    glyphs = load_glyphs(used_tags, base_dir, library_glyphs(scroll_data, used_tags), font_images(scroll_data))
+    if columns == None:
+        columns = max(1, line_width // (scroll_data['parameters']['width'] * 8))
+    return render_preview(scroll_data, glyphs, output_scroll_data, used_tags, bits, columns)
+
+
+def write_preview(pixels, bits, filename):
+    # Writes preview as PNG image, or as block characters to standard output when filename is '-'.
+    if filename == '-':
+        sys.stdout.write(preview_text(pixels, bits))
+        sys.stdout.flush()
+        return
+
+    try:
+        with open(filename, 'wb') as preview_file:
+            preview_file.write(encode_png(pixels, preview_palettes[bits]))
+    except OSError:
+        raise ScrollPackerError('File "' + filename + '" cannot be written!')
+
+
+# Several scrolls can share one fonts data: characters with the same cells (font file and offsets) get the same
+# code in all scroll texts, so parameters describing fonts data have to be the same in all JSON files.
+shared_parameters = ('width', 'height', 'begin', 'language', 'format', 'consolidation', 'dedup', 'page_aligned',
+                     'fonts_org', 'fonts_align', 'fonts_memory')
+
+
+def check_shared_parameters(scroll_data, first_scroll_data, first_filename, errors):
+    for name in ('segmented', 'streams'):
+        if scroll_data['parameters'].get(name, False) == True:
+            add_config_error(errors, 'parameters.' + name, 'Value of "' + name + '" cannot be used with shared ' +
+                             'fonts data!')
+    for name in shared_parameters:
+        if scroll_data['parameters'].get(name) != first_scroll_data['parameters'].get(name):
+            add_config_error(errors, 'parameters.' + name, 'Value of "' + name + '" differs from "' +
+                             first_filename + '", so fonts data cannot be shared!')
+
+
+def tokenize_shared_scroll(scroll_data, base_dir, first_scroll_data, first_filename):
+    # Tokenizes scroll text and loads its fonts, checking that fonts data can be shared with the first scroll.
+    scroll_data = resolve_library(scroll_data, base_dir)
+    input_scroll_text = validate(scroll_data, base_dir)
+    validate_config(scroll_data, (lambda scroll_data, errors: check_shared_parameters(scroll_data, first_scroll_data,
+                                                                                      first_filename, errors),))
+
+    output_scroll_data, used_tags = find_sets_or_tags_in_scroll_text(scroll_data, input_scroll_text)
+    glyphs = load_glyphs(used_tags, base_dir, library_glyphs(scroll_data, used_tags), font_images(scroll_data))
+    return output_scroll_data, used_tags, glyphs
+
+
+def pack_shared(scroll_datas, base_dirs = None, filenames = None, deterministic = False):
+    """Packs several scrolls described by already loaded JSON data with one shared fonts data, see pack().
+
+    Paths of font files of each scroll are relative to its base dir in base_dirs. Returns a dict with rendered
+    source code of scroll text data of each scroll ('texts'), rendered source code of shared fonts data
+    ('output'), used tags of all scrolls ('used_tags') and scroll text data of each scroll, with bytes being
+    indexes of used tags of all scrolls ('output_scroll_data').
+    Raises ScrollTextError when characters of all scrolls do not fit in codes from "begin" to 255.
+    """
+    base_dirs = base_dirs if base_dirs != None else [None] * len(scroll_datas)
+    filenames = filenames if filenames != None else [''] * len(scroll_datas)
+    used_tags = []
+    glyphs = {}
+    indexes = {}
+    scrolls = []
+    for scroll_data, base_dir, filename in zip(scroll_datas, base_dirs, filenames):
+        try:
+            output_scroll_data, scroll_used_tags, scroll_glyphs = tokenize_shared_scroll(scroll_data, base_dir,
+                                                                                         scroll_datas[0], filenames[0])
+        except ConfigError as err:
+            raise ConfigError('"' + filename + '": ' + str(err), err.errors)
+        except ScrollPackerError as err:
+            raise type(err)('"' + filename + '": ' + str(err))
+
+        codes = []
+        for p in scroll_used_tags:
+            path = os.path.normpath(p['file'] if base_dir == None else os.path.join(base_dir, p['file']))
+            key = (path, tuple(p['offsets']))
+            if not key in indexes:
+                indexes[key] = len(used_tags)
+                used_tags.append(dict(p, byte = len(used_tags), file = path))
+                glyphs[path] = scroll_glyphs[p['file']]
+            codes.append(indexes[key])
+        output_scroll_data['bytes'] = array.array('H', (codes[p] for p in output_scroll_data['bytes']))
+        scrolls.append((scroll_data, output_scroll_data, filename, len(scroll_used_tags)))
+
+    begin = scroll_datas[0]['parameters']['begin']
+    if len(used_tags) + begin > 256:
+        raise ScrollTextError('Shared fonts data of ' + str(len(scroll_datas)) + ' scrolls has ' +
+                              str(len(used_tags)) + ' unique characters, but only ' + str(256 - begin) + ' codes ' +
+                              'are available from "begin" on!')
+    # codes shared with other scrolls can reach bits of "or", which would change them into other characters
+    for scroll_data, output_scroll_data, filename, unique in scrolls:
+        for byte, bitwise_or in zip(output_scroll_data['bytes'], output_scroll_data['or']):
+            if byte & bitwise_or != 0:
+                raise ScrollTextError('Shared code ' + str(byte) + ' of tag "' + used_tags[byte]['tag'] + '" of "' +
+                                      filename + '" overlaps value of "or" (' + str(bitwise_or) + ')!')
+
+    scroll_data, layout = plan_fonts_layout(scroll_datas[0], glyphs, used_tags)
+    texts = [emit_header(p, filename, deterministic) + emit_scroll_data(p, output_scroll_data, used_tags, None, unique)
+             for p, output_scroll_data, filename, unique in scrolls]
+    comments = ['shared fonts data of ' + str(len(scrolls)) + ' scrolls, unique characters: ' + str(len(used_tags))]
+    output = emit_header(scroll_data, ', '.join(filenames), deterministic) +\
+             emit_comments(scroll_data, comments + fonts_layout_comments(scroll_data, layout)) +\
+             emit_fonts_data(scroll_data, glyphs, used_tags)
+
+    return {'texts': texts, 'output': output, 'used_tags': used_tags,
+            'output_scroll_data': [p[1] for p in scrolls]}
+
+
+def pack_file(filename, base_dir = None, deterministic = False, binary_name = None, stats = None):
+    """Loads JSON file with scroll data and packs it, see pack()."""
+    return pack(measure_phase(stats, 'load', load_json, filename), base_dir, filename, deterministic, binary_name,
+                stats)
+
+
+def pack_stream(scroll_data, output_file, base_dir = None, filename = '', deterministic = False, stats = None):
+    """Packs scroll like pack(), but writes rendered source code to output_file as scroll text is tokenized,
+    reading "scroll_file" in chunks, so memory usage does not depend on the length of scroll text.
+    Returns the number of bytes of scroll text data. Tokenization and emission of scroll text data are measured as
+    one phase in stats."""
+    scroll_data = resolve_library(scroll_data, base_dir)
+    if scroll_data['parameters'].get('compression', 'none') != 'none' or\
+            scroll_data['parameters'].get('segmented', False) == True or\
+            scroll_data['parameters'].get('streams', False) == True:
+        # packing, segmenting and column streams need the whole scroll text data
+        result = pack(scroll_data, base_dir, filename, deterministic, None, stats)
+        output_file.write(result['output'])
+        return scroll_text_length(result['output_scroll_data'])
+
+    measure_phase(stats, 'validate', validate_config, scroll_data)
+    state = new_tokenizer_state()
+    output_file.write(emit_header(scroll_data, filename, deterministic))
+    values = tokenize_scroll_text_chunks(scroll_data, iterate_scroll_text_chunks(scroll_data, base_dir), state)
+    # bytes of scroll text are not kept, so their usage is counted as they are emitted
+    counts = {}
+    if stats != None:
+        values = count_scroll_text_bytes(values, counts)
+    length = measure_phase(stats, 'tokenize_emit_text', emit_scroll_data_stream, scroll_data, values,
+                           state['used_tags'], output_file)
+    output_scroll_data, used_tags = finish_tokenizing(scroll_data, state)
+    glyphs = measure_phase(stats, 'load_fonts', load_glyphs, used_tags, base_dir,
+                           library_glyphs(scroll_data, used_tags), font_images(scroll_data))
+    scroll_data, layout = measure_phase(stats, 'layout', plan_fonts_layout, scroll_data, glyphs, used_tags,
+                                        output_scroll_data['segments'])
+    output_file.write(emit_comments(scroll_data, fonts_layout_comments(scroll_data, layout)))
+    output_file.write(measure_phase(stats, 'emit_fonts', emit_fonts_data, scroll_data, glyphs, used_tags,
+                                    output_scroll_data['segments']))
+    if stats != None:
+        fonts, cells = fonts_data_tables(scroll_data, glyphs, used_tags)
+        usage_stats(stats, output_scroll_data, used_tags, glyphs, length, fonts, cells, counts)
+    return length
+
+
+def pack_to_output(scroll_data, filename, output_filename, deterministic = False, stats = None):
+    # Packs scroll into output file (or standard output). Scroll text given in "scroll_file" is streamed.
+    if not 'scroll_file' in scroll_data:
+        write_output(pack(scroll_data, None, filename, deterministic, None, stats)['output'], output_filename)
+    elif output_filename == None:
+        pack_stream(scroll_data, sys.stdout, None, filename, deterministic, stats)
+        sys.stdout.flush()
+    else:
+        # output file is replaced only when whole scroll is packed successfully
+        try:
+            with open(output_filename + '.tmp', encoding = 'utf-8', mode = 'w') as output_file:
+                pack_stream(scroll_data, output_file, None, filename, deterministic, stats)
+            os.replace(output_filename + '.tmp', output_filename)
+        except OSError:
+            raise ScrollPackerError('File "' + output_filename + '" cannot be written!')
+        finally:
+            if os.path.exists(output_filename + '.tmp'):
+                os.remove(output_filename + '.tmp')
+
+
+def write_binary_files(result, directory):
+    # Writes binary files returned by pack() into given directory.
+    for p in result['binary']:
+        try:
+            with open(os.path.join(directory, p['name']), 'wb') as binary_file:
+                binary_file.write(p['data'])
+        except OSError:
+            raise ScrollPackerError('File "' + os.path.join(directory, p['name']) + '" cannot be written!')
+
+
+def build_cache_key(filename, base_dir = None, deterministic = False):
+    # Hash of version and source of the tool (see tool_signature()), options affecting output, JSON file and all
+    # font and scroll text files referenced in it.
+    # Returns None when JSON file cannot be read or parsed, so the error is reported by pack_file().
+    key = hashlib.sha256()
+    key.update((tool_signature() + '\0' + filename + '\0' + str(deterministic) + '\0').encode('utf-8'))
+    try:
+        with open(filename, 'rb') as json_file:
+            content = json_file.read()
+        scroll_data = json.loads(content.decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+    key.update(content)
+
+    files = []
+    if type(scroll_data) == dict and type(scroll_data.get('fonts')) == list:
+        files += [p['file'] for p in scroll_data['fonts'] if type(p) == dict and type(p.get('file')) == str]
+    if type(scroll_data) == dict and type(scroll_data.get('scroll_file')) in (str, list):
+        files += [p for p in get_scroll_files({'scroll_file': scroll_data['scroll_file']}) if type(p) == str]
+    if type(scroll_data) == dict and type(scroll_data.get('library')) == str:
+        # content of library is in the hash of its cache file
+        try:
+            files.append(scroll_data['library'])
+            files += list(load_library(scroll_data['library'], base_dir)['files'].keys())
+        except ScrollPackerError:
+            pass
+    for p in files:
+        key.update(('\0' + p + '\0').encode('utf-8'))
+        try:
+            with open(p if base_dir == None else os.path.join(base_dir, p), 'rb') as referenced_file:
+                key.update(hashlib.sha256(referenced_file.read()).digest())
+        except OSError:
+            key.update(b'\0missing')
+
+    return key.hexdigest()
+
+
+def pack_file_cached(filename, cache_dir, base_dir = None, deterministic = False, stats = None):
+    """Packs JSON file like pack_file(), but reuses the output from cache_dir when neither the JSON file, nor
+    referenced font files, nor version of the tool have changed. Returns a dict with rendered source code ('output'),
+    language of output ('language') and True in 'cached' when the output comes from cache (and then only this is
+    recorded in stats)."""
+    key = build_cache_key(filename, base_dir, deterministic)
+    if key != None:
+        try:
+            with open(os.path.join(cache_dir, key + '.json'), encoding = 'utf-8', mode = 'r') as cache_file:
+                entry = json.load(cache_file)
+            if stats != None:
+                stats['cached'] = True
+            return {'output': entry['output'], 'language': entry['language'], 'cached': True}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    scroll_data = measure_phase(stats, 'load', load_json, filename)
+    result = pack(scroll_data, base_dir, filename, deterministic, None, stats)
+    entry = {'output': result['output'], 'language': scroll_data['parameters']['language']}
+
+    if key != None:
+        # written under a temporary name first, so parallel jobs never see a partial entry
+        try:
+            os.makedirs(cache_dir, exist_ok = True)
+            temporary = os.path.join(cache_dir, key + '.' + str(os.getpid()) + '.tmp')
+            with open(temporary, encoding = 'utf-8', mode = 'w') as cache_file:
+                json.dump(entry, cache_file, ensure_ascii = False)
+            os.replace(temporary, os.path.join(cache_dir, key + '.json'))
+        except OSError:
+            raise ScrollPackerError('Cache directory "' + cache_dir + '" cannot be written!')
+
+    entry['cached'] = False
+    return entry
+
+
+def max_candidate_length(scroll_data):
+    # The longest identifier of font set or tag, i.e. how far beyond a position matching may look.
+    length = 1
+    for p in scroll_data['fonts']:
+        for r in ('set', 'set_or', 'set_default'):
+            if r in p and len(p[r]) > length:
+                length = len(p[r])
+    for p in scroll_data['lookups']:
+        for r in p['mapping']:
+            if len(r['tag']) > length:
+                length = len(r['tag'])
+    return length
+
+
+def new_watch_session(filename, base_dir = None, deterministic = False):
+    return {'filename': filename, 'base_dir': base_dir, 'deterministic': deterministic, 'scroll_data': None,
+            'settings': None, 'scroll': None, 'state': None, 'checkpoints': [], 'look_ahead': 1,
+            'glyphs': {}, 'glyphs_mtimes': {}}
+
+
+def get_mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+def get_watched_files(session):
+    # JSON file and all font files (and scroll text files) referenced in the last correctly loaded JSON file.
+    files = [session['filename']]
+    if session['scroll_data'] != None:
+        if get_library(session['scroll_data']) != None:
+            files.append(get_library(session['scroll_data'])['path'])
+        for p in session['scroll_data']['fonts']:
+            files.append(p['file'] if session['base_dir'] == None else os.path.join(session['base_dir'], p['file']))
+        if 'scroll_file' in session['scroll_data']:
+            files += get_scroll_files(session['scroll_data'], session['base_dir'])
+    return files
+
+
+def update_watch_session(session):
+    """Packs JSON file of watch session again, reusing everything that has not changed since the previous call:
+    parsed and validated fonts and lookups, loaded font files, and tokenized scroll text up to the first changed
+    entry of "scroll" (or file of "scroll_file"). Returns rendered source code and the index of entry from which
+    scroll text was tokenized again (None, if it was not tokenized at all)."""
+    scroll_data = load_json(session['filename'])
+    if type(scroll_data) != dict:
+        raise ConfigError('JSON file does not contain an object!')
+    scroll_data = resolve_library(scroll_data, session['base_dir'])
+    settings = {k: v for k, v in scroll_data.items() if k != 'scroll' and k != 'scroll_file'}
+
+    if session['state'] == None or settings != session['settings']:
+        # fonts, lookups or parameters have changed, so everything has to be validated and tokenized again
+        session['state'] = None
+        validate_config(scroll_data)
+        entries = load_scroll_entries(scroll_data, session['base_dir'])
+        input_scroll_text = parse_scroll_text(scroll_data, session['base_dir'], entries)
+        session['settings'] = settings
+        session['look_ahead'] = max_candidate_length(scroll_data)
+        session['state'] = new_tokenizer_state()
+        session['checkpoints'] = []
+        entry = 0
+    else:
+        entries = load_scroll_entries(scroll_data, session['base_dir'])
+        input_scroll_text = parse_scroll_text(scroll_data, session['base_dir'], entries)
+        entry = 0
+        while entry < len(entries) and entry < len(session['scroll']) and entries[entry] == session['scroll'][entry]:
+            entry += 1
+        if entry == len(entries) and entry == len(session['scroll']):
+            entry = None
+
+    session['scroll_data'] = scroll_data
+    state = session['state']
+    checkpoints = session['checkpoints']
+
+    if entry != None:
+        boundaries = []
+        position = 0
+        for p in entries:
+            boundaries.append(position)
+            position += len(p)
+        changed_position = boundaries[entry] if entry < len(boundaries) else position
+
+        # the latest checkpoint, whose matching could not look into changed entries of "scroll"
+        index = len(checkpoints) - 1
+        while index >= 0 and (index >= entry or
+                              checkpoints[index]['position'] + session['look_ahead'] > changed_position):
+            index -= 1
+        if index >= 0:
+            rewind_tokenizer_state(state, checkpoints[index])
+        else:
+            automatons = state['automatons']
+            state = new_tokenizer_state()
+            state['automatons'] = automatons
+            session['state'] = state
+        del checkpoints[index + 1:]
+
+        try:
+            tokenize_scroll_text(scroll_data, input_scroll_text, state, boundaries, checkpoints)
+        except ScrollPackerError:
+            session['state'] = None
+            raise
+        session['scroll'] = list(entries)
+
+    output_scroll_data, used_tags = finish_tokenizing(scroll_data, state)
+
+    for p in list(session['glyphs'].keys()):
+        mtime = get_mtime(p if session['base_dir'] == None else os.path.join(session['base_dir'], p))
+        if mtime != session['glyphs_mtimes'][p]:
+            del session['glyphs'][p]
+    for p in used_tags:
+        if not p['file'] in session['glyphs']:
+            session['glyphs_mtimes'][p['file']] = get_mtime(p['file'] if session['base_dir'] == None else
+                                                            os.path.join(session['base_dir'], p['file']))
+    glyphs = load_glyphs(used_tags, session['base_dir'], session['glyphs'], font_images(scroll_data))
+    layout_data, layout = plan_fonts_layout(scroll_data, glyphs, used_tags, output_scroll_data['segments'])
+
+    return emit_header(scroll_data, session['filename'], session['deterministic']) +\
+           emit_scroll_data(scroll_data, output_scroll_data, used_tags) +\
+           (emit_column_streams(layout_data, column_streams(layout_data, glyphs, output_scroll_data, used_tags),
+                                output_scroll_data, used_tags, scroll_text_length(output_scroll_data))
+            if scroll_data['parameters'].get('streams', False) == True else '') +\
+           emit_comments(scroll_data, fonts_layout_comments(scroll_data, layout)) +\
+           emit_fonts_data(layout_data, glyphs, used_tags, output_scroll_data['segments']), entry
+
+
+def watch(filename, output_filename, base_dir = None, deterministic = False, interval = 0.2):
+    """Packs JSON file again whenever it or any of font files referenced in it changes, until interrupted."""
+    session = new_watch_session(filename, base_dir, deterministic)
+    mtimes = None
+    while True:
+        watched = get_watched_files(session)
+        current = [get_mtime(p) for p in watched]
+        if current != mtimes:
+            mtimes = current
+            start_time = time.perf_counter()
+            try:
+                output, entry = update_watch_session(session)
+                write_output(output, output_filename, True)
+                print(time.strftime('%H:%M:%S') + ' "' + filename + '" packed in ' +
+                      format((time.perf_counter() - start_time) * 1000, '.1f') + ' ms' +
+                      (', scroll text tokenized from entry #' + str(entry) if entry != None else ''),
+                      file = sys.stderr)
+            except ScrollPackerError as err:
+                print(time.strftime('%H:%M:%S') + ' ' + format_error(err, filename), file = sys.stderr)
+            sys.stderr.flush()
+            if get_watched_files(session) != watched:
+                # font files referenced in JSON file have changed, they are watched from now on
+                mtimes = [current[0]] + [get_mtime(p) for p in get_watched_files(session)[1:]]
+        time.sleep(interval)
+
+
+def format_error(err, filename):
+    # Errors concerning content of JSON file are prefixed with its name, as in the output of eprint().
+    if isinstance(err, (ConfigError, ScrollTextError)) and len(filename) != 0:
+        return '"' + filename + '": ' + str(err)
+    return str(err)
+
+
+def load_batch_jobs(filenames):
+    # Each file is either a JSON file with scroll data, or a manifest with a list of "jobs", where each job has
+    # "json" (a JSON file with scroll data) and optional "output" (output file, by default the name of JSON file
+    # with extension changed according to language). A file which cannot be loaded, or does not contain an object,
+    # is a job of its own, so its error is reported by the job and other jobs are still packed.
+    jobs = []
+    for filename in filenames:
+        try:
+            scroll_data = load_json(filename)
+        except ScrollPackerError:
+            scroll_data = None
+        if type(scroll_data) != dict or not 'jobs' in scroll_data:
+            jobs.append({'json': filename, 'output': None, 'deterministic': False, 'cache': None, 'binary': False,
+                         'stats': False, 'library_cache': None})
+            continue
+
+        if type(scroll_data['jobs']) != list:
+            raise ConfigError('"jobs" is not a list!')
+
+        index = 0
+        for p in scroll_data['jobs']:
+            if type(p) != dict:
+                raise ConfigError('Entry at index #' + str(index) + ' in "jobs" is not an object!')
+
+            if not 'json' in p or type(p['json']) != str or len(p['json']) == 0:
+                raise ConfigError('No "json" name detected in "jobs" at index #' + str(index) + '!')
+
+            if 'output' in p and (type(p['output']) != str or len(p['output']) == 0):
+                raise ConfigError('Value of "output" in "jobs" at index #' + str(index) + ' is not a string!')
+
+            jobs.append({'json': p['json'], 'output': p['output'] if 'output' in p else None, 'deterministic': False,
+                         'cache': None, 'binary': False, 'stats': False, 'library_cache': None})
+            index += 1
+
+    return jobs
+
+
+def default_output_filename(json_filename, language):
+    # Output file is named after JSON file, with extension changed according to language.
+    return os.path.splitext(json_filename)[0] + ('.h' if language == 'C' else '.ASM')
+
+
+def binary_base_name(filename):
+    # Binary files are named after output file (without extension), and are placed next to it.
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+def pack_batch_job(job):
+    # Runs in a worker process, so it returns a summary instead of raising.
+    global library_cache_dir
+    library_cache_dir = job['library_cache']
+    start_time = time.perf_counter()
+    summary = {'json': job['json'], 'output': job['output'], 'error': None, 'status': 'OK',
+               'stats': new_stats(job['json']) if job['stats'] == True else None}
+    try:
+        if job['cache'] != None:
+            result = pack_file_cached(job['json'], job['cache'], None, job['deterministic'], summary['stats'])
+        else:
+            scroll_data = measure_phase(summary['stats'], 'load', load_json, job['json'])
+            if type(scroll_data) != dict:
+                raise ConfigError('JSON file does not contain an object!')
+            if summary['output'] == None:
+                # wrong "parameters" are reported by pack()
+                summary['output'] = default_output_filename(job['json'], scroll_data['parameters'].get('language')
+                                                            if type(scroll_data.get('parameters')) == dict else None)
+            if 'scroll_file' in scroll_data and not job['binary']:
+                pack_to_output(scroll_data, job['json'], summary['output'], job['deterministic'], summary['stats'])
+                summary['time'] = time.perf_counter() - start_time
+                return summary
+            result = pack(scroll_data, None, job['json'], job['deterministic'],
+                          binary_base_name(summary['output']) if job['binary'] else None, summary['stats'])
+            if job['binary']:
+                write_binary_files(result, os.path.dirname(summary['output']))
+            result['language'] = scroll_data['parameters']['language']
+            result['cached'] = False
+        if summary['output'] == None:
+            summary['output'] = default_output_filename(job['json'], result['language'])
+        if write_output(result['output'], summary['output'], job['cache'] != None) == False:
+            summary['status'] = 'SKIPPED'
+        elif result['cached'] == True:
+            summary['status'] = 'CACHED'
+    except ScrollPackerError as err:
+        summary['error'] = str(err)
+        if summary['stats'] != None:
+            summary['stats']['error'] = str(err)
+
+    summary['time'] = time.perf_counter() - start_time
+    return summary
+
+
+def pack_batch(jobs, workers = None):
+    """Packs many JSON files in parallel, each into its own output file. Returns a list of summaries of jobs."""
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers) as executor:
+        return list(executor.map(pack_batch_job, jobs))
+
+
+# Server answers pack requests given as JSON lines on standard input or on a Unix socket, keeping everything that
+# has not changed between requests: a watch session (parsed and validated fonts and lookups, loaded font files and
+# tokenized scroll text) for each JSON file packed into source code, and the last result for each JSON file packed
+# into binary files, reused while the hash of the JSON file and of all files referenced in it is the same.
+def new_serve_state(base_dir = None, deterministic = False):
+    return {'base_dir': base_dir, 'deterministic': deterministic, 'sessions': {}, 'binaries': {}}
+
+
+def check_serve_request(request, errors):
+    # A request is an object with "json" (a JSON file with scroll data), and optional "id" (returned in response as
+    # it is), "output" (output file, otherwise source code is returned in response), "binary" and "deterministic"
+    # (as the command line options).
+    check_value(request, 'json', '', str, errors)
+    check_value(request, 'output', '', str, errors, required = False)
+    check_value(request, 'binary', '', bool, errors, required = False)
+    check_value(request, 'deterministic', '', bool, errors, required = False)
+
+
+def parse_serve_request(line):
+    try:
+        request = json.loads(line)
+    except ValueError as err:
+        raise ConfigError('Error while parsing request because "' + (err.msg if isinstance(err, json.JSONDecodeError)
+                                                                     else str(err)) + '"!')
+    if type(request) != dict:
+        raise ConfigError('Request is not an object!')
+
+    validate_config(request, (check_serve_request,))
+    return request
+
+
+def serve_binary(state, filename, deterministic, binary_name):
+    # Packs JSON file into binary files, reusing the last result while nothing in its cache key has changed.
+    key = build_cache_key(filename, state['base_dir'], deterministic)
+    previous = state['binaries'].get((filename, deterministic, binary_name))
+    if key != None and previous != None and previous[0] == key:
+        return previous[1], True
+
+    result = pack_file(filename, state['base_dir'], deterministic, binary_name)
+    state['binaries'][(filename, deterministic, binary_name)] = (key, result)
+    return result, False
+
+
+def serve_request(state, line):
+    # Answers one request, errors are returned in response instead of raised.
+    start_time = time.perf_counter()
+    response = {'id': None, 'status': 'OK', 'error': None}
+    filename = ''
+    try:
+        request = parse_serve_request(line)
+        response['id'] = request.get('id')
+        filename = request['json']
+        deterministic = request.get('deterministic', state['deterministic'])
+        output_filename = request.get('output')
+
+        if request.get('binary', False) == True:
+            result, cached = serve_binary(state, filename, deterministic,
+                                          binary_base_name(output_filename if output_filename != None else filename))
+            if cached:
+                response['status'] = 'CACHED'
+            if output_filename != None:
+                write_binary_files(result, os.path.dirname(output_filename))
             else:
-                if scroll_data['parameters']['format'] == 'hex':
-                    print('0x' + format(int.from_bytes(files_handlers[p['set']].read(1), byteorder = 'little'), '02x') +
-                          ', ', end = '')
-                elif scroll_data['parameters']['format'] == 'dec':
-                    print(str(int.from_bytes(files_handlers[p['set']].read(1), byteorder = 'little')) + ', ', end = '')
+                response['binary'] = [{'name': p['name'], 'data': base64.b64encode(p['data']).decode('ascii')}
+                                      for p in result['binary']]
+            output = result['output']
+        else:
+            if not (filename, deterministic) in state['sessions']:
+                state['sessions'][(filename, deterministic)] = new_watch_session(filename, state['base_dir'],
+                                                                                 deterministic)
+            output = update_watch_session(state['sessions'][(filename, deterministic)])[0]
 
-    elif scroll_data['parameters']['language'] == 'Assembler':
-        print('\t.byte ', end = '')
-        for i in range(0, scroll_data['parameters']['width'] * 8):
-            files_handlers[p['set']].seek(p['offsets'][row * scroll_data['parameters']['width'] + i // 8] * 8 +
-                                          (i % 8), 0)
-            if i % 8 == 7:
-                if scroll_data['parameters']['format'] == 'hex':
-                    print('$' + format(int.from_bytes(files_handlers[p['set']].read(1), byteorder = 'little'), '02x'),
-                          end = '')
-                elif scroll_data['parameters']['format'] == 'dec':
-                    print(str(int.from_bytes(files_handlers[p['set']].read(1), byteorder = 'little')), end = '')
-                print('\t; "' + p['tag'] + '" ' + p['set'] + ' ' + str(i // 8) + '_' + str(row))
-                if i < scroll_data['parameters']['width'] * 8 - 1:
-                    print('\t.byte ', end = '')
+        if output_filename == None:
+            response['source'] = output
+        else:
+            response['output'] = output_filename
+            if write_output(output, output_filename, True) == False and response['status'] == 'OK':
+                response['status'] = 'SKIPPED'
+    except ScrollPackerError as err:
+        response['status'] = 'FAILED'
+        response['error'] = format_error(err, filename)
+
+    response['time'] = time.perf_counter() - start_time
+    return response
+
+
+def serve_lines(state, input_file, output_file):
+    # Answers requests read from input_file line by line, until its end. Each response is one line as well.
+    for line in input_file:
+        if len(line.strip()) == 0:
+            continue
+        response = serve_request(state, line)
+        output_file.write(json.dumps(response, ensure_ascii = False) + '\n')
+        output_file.flush()
+        print(time.strftime('%H:%M:%S') + ' ' + format(response['status'], '8s') +
+              (response['error'] if response['error'] != None else
+               format(response['time'] * 1000, '.1f') + ' ms' + (' -> ' + response['output']
+                                                                  if 'output' in response else '')),
+              file = sys.stderr)
+        sys.stderr.flush()
+
+
+def serve(socket_path = None, base_dir = None, deterministic = False):
+    """Answers pack requests, given as JSON lines on standard input until its end, or on Unix socket at socket_path
+    until interrupted (connections are answered one after another). Each request is an object with "json" (a JSON
+    file with scroll data) and optional "id", "output", "binary" and "deterministic"; each response is an object
+    with "id" of request, "status" ("OK", "CACHED", "SKIPPED" or "FAILED"), "error", "time" and either "output"
+    (output file written), or "source" (source code) and "binary" (list of binary files with "name" and base64
+    encoded "data", with "binary")."""
+    state = new_serve_state(base_dir, deterministic)
+    if socket_path == None:
+        serve_lines(state, sys.stdin, sys.stdout)
+        return
+
+    if os.path.exists(socket_path):
+        # socket left by a killed server is removed, but not a socket of a running one
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+        except OSError:
+            pass
+    try:
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+    except OSError:
+        raise ScrollPackerError('Socket "' + socket_path + '" cannot be created!')
+    try:
+        server.listen()
+        while True:
+            connection, address = server.accept()
+            with connection, connection.makefile(encoding = 'utf-8', mode = 'rw', newline = '\n') as stream:
+                try:
+                    serve_lines(state, stream, stream)
+                except OSError:
+                    # client has gone away, the next one is answered
+                    pass
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+
+def main(argv):
+    sys.stdout = io.TextIOWrapper(sys.stdout.detach(), encoding = 'utf-8')
+    sys.stderr = io.TextIOWrapper(sys.stderr.detach(), encoding = 'utf-8')
+
+    parser = argparse.ArgumentParser(prog = ntpath.basename(argv[0]),
+                                     description = '"Scroll Packer" v' + version + ' - packs scroll text and fonts.')
+    parser.add_argument('filenames', nargs = '*', metavar = 'filename.json')
+    parser.add_argument('-o', dest = 'output', metavar = 'output',
+                        help = 'output file (standard output by default)')
+    parser.add_argument('--batch', action = 'store_true',
+                        help = 'pack many JSON files or manifests with "jobs" in parallel, each into its own file')
+    parser.add_argument('-j', '--jobs', type = int, default = None, metavar = 'N',
+                        help = 'number of worker processes in batch mode (number of CPUs by default)')
+    parser.add_argument('--watch', action = 'store_true',
+                        help = 'pack again whenever JSON file or font files change, until interrupted')
+    parser.add_argument('--binary', action = 'store_true',
+                        help = 'write scroll text data and fonts data as raw binary files next to output, '
+                               'and only include them in output')
+    parser.add_argument('--deterministic', action = 'store_true',
+                        help = 'no date and time in header, so unchanged input gives identical output')
+    parser.add_argument('--cache', metavar = 'directory',
+                        help = 'reuse outputs stored in directory when JSON and font files are unchanged, '
+                               'and do not touch output files whose content would not change')
+    parser.add_argument('--library-cache', metavar = 'directory',
+                        help = 'directory of compiled libraries of fonts and lookups ("library" in JSON file), '
+                               'by default ".scrollpacker" next to each library')
+    parser.add_argument('--stats', nargs = '?', const = '-', metavar = 'file',
+                        help = 'write a JSON report of time and peak memory of each phase, usage of font sets, tags '
+                               'and font files, and sizes of data to file (standard error by default)')
+    parser.add_argument('--shared', metavar = 'fonts_output',
+                        help = 'pack JSON files or manifests with "jobs" with one fonts data shared by all of them, '
+                               'written to fonts_output, and scroll text data of each one written into its own file')
+    parser.add_argument('--preview', nargs = '?', const = '-', metavar = 'file.png',
+                        help = 'instead of packing, render scroll text with fonts into PNG image (or to terminal '
+                               'with block characters by default), to check characters quickly')
+    parser.add_argument('--preview-bits', type = int, choices = (1, 2), default = 1,
+                        help = 'bits of pixels of fonts in preview (1 by default, 2 for 4-color fonts)')
+    parser.add_argument('--preview-columns', type = int, default = None, metavar = 'N',
+                        help = 'characters in each line of preview (by default as many as fit in 320 pixels of '
+                               'PNG image, or in terminal)')
+    parser.add_argument('--serve', nargs = '?', const = '-', metavar = 'socket',
+                        help = 'keep running and answer pack requests given as JSON lines on Unix socket (or on '
+                               'standard input by default), reusing fonts, lookups and scroll text unchanged '
+                               'since previous requests')
+    args = parser.parse_args(argv[1:])
+
+    if args.serve != None:
+        if len(args.filenames) != 0 or args.output != None or args.batch or args.watch or args.binary or\
+                args.cache != None or args.stats != None or args.shared != None or args.preview != None:
+            parser.error('--serve cannot be used with JSON files, -o, --batch, --watch, --binary, --cache, --stats, '
+                         '--shared or --preview')
+        if args.serve != '-' and not hasattr(socket, 'AF_UNIX'):
+            parser.error('Unix sockets are not supported on this system, requests can be given on standard input')
+    elif len(args.filenames) == 0:
+        parser.error('the following arguments are required: filename.json')
+
+    if args.binary and (args.cache != None or args.watch):
+        parser.error('--binary cannot be used with --cache or --watch')
+
+    if args.stats != None and args.watch:
+        parser.error('--stats cannot be used with --watch')
+
+    if args.preview != None and (args.batch or args.watch or args.binary or args.cache != None or
+                                 args.stats != None):
+        parser.error('--preview cannot be used with --batch, --watch, --binary, --cache or --stats')
+
+    if args.preview_columns != None and args.preview_columns < 1:
+        parser.error('--preview-columns has to be at least 1')
+
+    if args.shared != None and (args.batch or args.watch or args.binary or args.cache != None or
+                                args.stats != None or args.preview != None or args.output != None):
+        parser.error('--shared cannot be used with -o, --batch, --watch, --binary, --cache, --stats or --preview')
+
+    global library_cache_dir
+    library_cache_dir = args.library_cache
+
+    if args.serve != None:
+        sys.stdin = io.TextIOWrapper(sys.stdin.detach(), encoding = 'utf-8')
+        try:
+            serve(args.serve if args.serve != '-' else None, None, args.deterministic)
+        except ScrollPackerError as err:
+            eprint(str(err))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.batch:
+        start_time = time.perf_counter()
+        try:
+            jobs = load_batch_jobs(args.filenames)
+        except ScrollPackerError as err:
+            eprint(str(err))
+            return
+        for p in jobs:
+            p['deterministic'] = args.deterministic
+            p['cache'] = args.cache
+            p['binary'] = args.binary
+            p['stats'] = args.stats != None
+            p['library_cache'] = args.library_cache
+
+        failures = 0
+        summaries = pack_batch(jobs, args.jobs)
+        for p in summaries:
+            if p['error'] == None:
+                print(format(p['time'], '7.3f') + ' s  ' + format(p['status'], '8s') + p['json'] + ' -> ' +
+                      p['output'])
             else:
-                if scroll_data['parameters']['format'] == 'hex':
-                    print('$' + format(int.from_bytes(files_handlers[p['set']].read(1), byteorder = 'little'), '02x') +
-                          ', ', end = '')
-                elif scroll_data['parameters']['format'] == 'dec':
-                    print(str(int.from_bytes(files_handlers[p['set']].read(1), byteorder = 'little')) + ', ', end = '')
-
-
-if len(sys.argv) != 2:
-    eprint('Usage: ' + ntpath.basename(sys.argv[0]) + ' filename.json')
-
-scroll_data = load_json(sys.argv[1])
-input_scroll_text = parse_scroll_text(scroll_data)
-parse_parameters(scroll_data)
-parse_fonts(scroll_data)
-parse_lookups(scroll_data)
-output_scroll_data, used_tags = find_sets_or_tags_in_scroll_text(scroll_data, input_scroll_text)
-print_header()
-print_scroll_data(scroll_data, output_scroll_data, used_tags)
-print_fonts_data(scroll_data, used_tags)
-sys.stdout.flush()
\ No newline at end of file
+                failures += 1
+                print(format(p['time'], '7.3f') + ' s  FAILED  ' + p['json'] + ': ' + p['error'])
+        print(str(len(jobs)) + ' file(s) packed, ' + str(failures) + ' failed, ' +
+              format(time.perf_counter() - start_time, '.3f') + ' s in total')
+        sys.stdout.flush()
+        if args.stats != None:
+            try:
+                write_stats({'version': version, 'jobs': [p['stats'] for p in summaries]}, args.stats)
+            except ScrollPackerError as err:
+                eprint(str(err))
+        if failures != 0:
+            exit(1)
+        return
+
+    if args.shared != None:
+        try:
+            jobs = load_batch_jobs(args.filenames)
+            scroll_datas = []
+            for p in jobs:
+                try:
+                    scroll_datas.append(load_json(p['json']))
+                except ConfigError as err:
+                    raise ConfigError('"' + p['json'] + '": ' + str(err), err.errors)
+            result = pack_shared(scroll_datas, None, [p['json'] for p in jobs], args.deterministic)
+            for p, scroll_data, text in zip(jobs, scroll_datas, result['texts']):
+                if p['output'] == None:
+                    p['output'] = default_output_filename(p['json'], scroll_data['parameters']['language'])
+                write_output(text, p['output'])
+                print(p['json'] + ' -> ' + p['output'])
+            write_output(result['output'], args.shared)
+            print(str(len(jobs)) + ' file(s) packed, shared fonts data of ' + str(len(result['used_tags'])) +
+                  ' unique characters -> ' + args.shared)
+            sys.stdout.flush()
+        except ScrollPackerError as err:
+            eprint(str(err))
+        return
+
+    if len(args.filenames) != 1:
+        parser.error('only one JSON file can be packed without --batch')
+
+    if args.watch:
+        try:
+            watch(args.filenames[0], args.output, None, args.deterministic)
+        except KeyboardInterrupt:
+            return
+
+    if args.preview != None:
+        try:
+            write_preview(preview(load_json(args.filenames[0]), None, args.preview_bits, args.preview_columns,
+                                  shutil.get_terminal_size().columns if args.preview == '-' else 320),
+                          args.preview_bits, args.preview)
+        except ScrollPackerError as err:
+            eprint(format_error(err, args.filenames[0]))
+        return
+
+    stats = new_stats(args.filenames[0]) if args.stats != None else None
+    try:
+        if args.cache != None:
+            result = pack_file_cached(args.filenames[0], args.cache, None, args.deterministic, stats)
+            write_output(result['output'], args.output, True)
+        elif args.binary:
+            result = pack_file(args.filenames[0], None, args.deterministic,
+                               binary_base_name(args.output if args.output != None else args.filenames[0]), stats)
+            # binary files are next to output, or next to JSON file when output is written to standard output
+            write_binary_files(result, os.path.dirname(args.output if args.output != None else args.filenames[0]))
+            write_output(result['output'], args.output)
+        else:
+            pack_to_output(measure_phase(stats, 'load', load_json, args.filenames[0]), args.filenames[0], args.output,
+                           args.deterministic, stats)
+        if stats != None:
+            write_stats(stats, args.stats)
+    except ScrollPackerError as err:
+        eprint(format_error(err, args.filenames[0]))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#
+# Benchmark of "Scroll Packer".
+# It generates synthetic configs (thousands of tags in lookups, many font sets, fonts with a height from 1 to 8,
+# scroll texts from 1 KB to 10 MB) and measures the time of each phase of packing separately: loading of JSON
+# file, validation, tokenization of scroll text, emission of scroll text data and emission of fonts data.
+# Results are stored as JSON, and can be compared with results of a previous run (a baseline), then each phase
+# slower than in the baseline by more than a tolerance is reported as a regression.
+# It also checks that output for example directories (jobs of makedata.json) has not changed.
+
+import argparse
+import json
+import ntpath
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import ScrollPacker
+from ScrollPacker import ScrollPackerError
+
+phases = ('load', 'validate', 'tokenize', 'emit_text', 'emit_fonts')
+
+# name, number of tags in lookups, number of font sets, width, height, length of scroll text, segmented
+cases = (
+    ('1x1_tags1000_fonts4_1KB', 1000, 4, 1, 1, 1 << 10, False),
+    ('1x1_tags1000_fonts4_100KB', 1000, 4, 1, 1, 100 << 10, False),
+    ('1x1_tags5000_fonts16_1MB', 5000, 16, 1, 1, 1 << 20, False),
+    ('2x2_tags2000_fonts8_100KB', 2000, 8, 2, 2, 100 << 10, False),
+    ('2x4_tags2000_fonts8_100KB', 2000, 8, 2, 4, 100 << 10, False),
+    ('1x8_tags2000_fonts8_100KB', 2000, 8, 1, 8, 100 << 10, False),
+    ('8x8_tags1000_fonts4_100KB', 1000, 4, 8, 8, 100 << 10, False),
+    ('1x1_tags5000_fonts16_100KB_segmented', 5000, 16, 1, 1, 100 << 10, True),
+    ('1x1_tags5000_fonts16_1MB_segmented', 5000, 16, 1, 1, 1 << 20, True),
+    ('1x1_tags5000_fonts16_10MB', 5000, 16, 1, 1, 10 << 20, False),
+)
+
+# the longest cases are run only with --full
+quick_cases = 8
+
+
+def generate_font_file(filename, rng, characters):
+    with open(filename, 'wb') as font_file:
+        font_file.write(bytes(rng.getrandbits(8) for p in range(0, characters * 8)))
+
+
+def generate_config(directory, rng, tags, fonts, width, height, length, segmented):
+    # Writes font files and JSON file with scroll data into directory, and returns the name of JSON file.
+    # Scroll text switches font sets every few hundred characters, and uses only so many tags at once that unique
+    # characters fit in 256 values of bytes.
+    characters = 256
+    for p in range(0, fonts):
+        generate_font_file(os.path.join(directory, 'font' + str(p) + '.fnt'), rng, characters)
+
+    lookups = []
+    names = [chr(0x4e00 + p) for p in range(0, tags)]
+    per_lookup = (tags + fonts - 1) // fonts
+    for p in range(0, fonts):
+        mapping = []
+        for r in names[p * per_lookup:(p + 1) * per_lookup]:
+            mapping.append({'tag': r, 'offsets': [rng.randrange(characters) for s in range(0, width * height)]})
+        lookups.append({'lookup': 'lookup' + str(p), 'mapping': mapping})
+
+    font_sets = [{'set': '{font' + str(p) + '}', 'file': 'font' + str(p) + '.fnt', 'lookup': 'lookup' + str(p)}
+                 for p in range(0, fonts)]
+
+    active_sets = min(fonts, 4)
+    pool = min(per_lookup, 240 // active_sets)
+    # segmented scroll text moves to other tags a few times, so banks of fonts are needed
+    pools = min(per_lookup // pool, 4) if segmented else 1
+    entries = []
+    entry = []
+    size = 0
+    while size < length:
+        font = rng.randrange(active_sets)
+        first = size * pools // length * pool
+        words = font_sets[font]['set'] + ''.join(rng.choice(lookups[font]['mapping'][first:first + pool])['tag']
+                                                 for p in range(0, rng.randint(100, 400)))
+        entry.append(words)
+        size += len(words.encode('utf-8'))
+        if len(entry) == 16:
+            entries.append(''.join(entry))
+            entry = []
+    if len(entry) != 0:
+        entries.append(''.join(entry))
+
+    parameters = {'width': width, 'height': height, 'begin': 0, 'language': 'Assembler', 'format': 'hex',
+                  'consolidation': True}
+    if segmented:
+        parameters['segmented'] = True
+
+    filename = os.path.join(directory, 'scroll.json')
+    with open(filename, encoding = 'utf-8', mode = 'w') as json_file:
+        json.dump({'scroll': entries, 'parameters': parameters, 'fonts': font_sets, 'lookups': lookups}, json_file,
+                  ensure_ascii = False)
+
+    return filename
+
+
+def run_phases(filename, base_dir):
+    # Packs JSON file phase by phase, and returns times of phases and the length of output.
+    times = {}
+
+    start_time = time.perf_counter()
+    scroll_data = ScrollPacker.load_json(filename)
+    times['load'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    scroll_data = ScrollPacker.resolve_library(scroll_data, base_dir)
+    input_scroll_text = ScrollPacker.validate(scroll_data, base_dir)
+    times['validate'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    output_scroll_data, used_tags = ScrollPacker.find_sets_or_tags_in_scroll_text(scroll_data, input_scroll_text)
+    times['tokenize'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    text = ScrollPacker.emit_scroll_data(scroll_data, output_scroll_data, used_tags)
+    times['emit_text'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    glyphs = ScrollPacker.load_glyphs(used_tags, base_dir)
+    fonts = ScrollPacker.emit_fonts_data(scroll_data, glyphs, used_tags, output_scroll_data['segments'])
+    times['emit_fonts'] = time.perf_counter() - start_time
+
+    return times, len(text) + len(fonts)
+
+
+def run_benchmark(selected_cases, repeat, seed):
+    results = []
+    for name, tags, fonts, width, height, length, segmented in selected_cases:
+        with tempfile.TemporaryDirectory() as directory:
+            filename = generate_config(directory, random.Random(seed), tags, fonts, width, height, length,
+                                       segmented)
+            best = None
+            for p in range(0, repeat):
+                times, output_length = run_phases(filename, directory)
+                best = times if best == None else {r: min(best[r], times[r]) for r in phases}
+
+        results.append({'name': name, 'tags': tags, 'fonts': fonts, 'width': width, 'height': height,
+                        'length': length, 'segmented': segmented, 'output_length': output_length, 'times': best})
+        print(format(name, '40s') + ' '.join(r + ' ' + format(best[r], '.3f') for r in phases) + ' s')
+        sys.stdout.flush()
+
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance, threshold):
+    # Returns descriptions of phases slower than in baseline by more than tolerance (a fraction) and threshold
+    # (in seconds, so noise of short phases is ignored).
+    regressions = []
+    baseline_cases = {p['name']: p for p in baseline['cases']}
+    for p in results:
+        if not p['name'] in baseline_cases:
+            continue
+        for r in phases:
+            old = baseline_cases[p['name']]['times'][r]
+            new = p['times'][r]
+            if new > old * (1 + tolerance) and new - old > threshold:
+                regressions.append(p['name'] + ': ' + r + ' ' + format(old, '.3f') + ' s -> ' + format(new, '.3f') +
+                                   ' s (' + format((new / old - 1) * 100 if old > 0 else 0, '+.0f') + '%)')
+    return regressions
+
+
+def check_samples(manifest):
+    # Packs jobs of manifest and compares output (without the first line with date and time of packing, and
+    # ignoring line endings) with existing output files. Returns descriptions of differences.
+    differences = []
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    for job in ScrollPacker.load_batch_jobs([manifest]):
+        # paths in example directories are written for Windows
+        json_filename = os.path.join(base_dir, *job['json'].split('\\'))
+        try:
+            scroll_data = ScrollPacker.load_json(json_filename)
+            if os.sep != '\\' and type(scroll_data) == dict and type(scroll_data.get('fonts')) == list:
+                for p in scroll_data['fonts']:
+                    if type(p) == dict and type(p.get('file')) == str:
+                        p['file'] = p['file'].replace('\\', os.sep)
+            output = ScrollPacker.pack(scroll_data, base_dir, job['json'], True)['output']
+        except ScrollPackerError as err:
+            differences.append(job['json'] + ': ' + str(err))
+            continue
+
+        # output file is named like in batch mode of the packer, when it is not given
+        output_name = job['output'] if job['output'] != None else\
+                      ScrollPacker.default_output_filename(job['json'], scroll_data['parameters']['language'])
+        try:
+            with open(os.path.join(base_dir, *output_name.split('\\')), encoding = 'utf-8', mode = 'r') as output_file:
+                expected = output_file.read()
+        except OSError:
+            differences.append(job['json'] + ': output file "' + output_name + '" cannot be read')
+            continue
+        if output.split('\n', 1)[1] != expected.split('\n', 1)[1]:
+            differences.append(job['json'] + ': output differs from "' + output_name + '"')
+
+    return differences
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog = ntpath.basename(argv[0]),
+                                     description = 'Benchmark of "Scroll Packer" v' + ScrollPacker.version + '.')
+    parser.add_argument('-o', dest = 'output', metavar = 'results.json',
+                        help = 'store results in JSON file')
+    parser.add_argument('--baseline', metavar = 'baseline.json',
+                        help = 'compare results with results of a previous run, and fail on regressions')
+    parser.add_argument('--tolerance', type = float, default = 0.25, metavar = 'fraction',
+                        help = 'allowed slowdown of a phase compared with baseline (0.25 by default)')
+    parser.add_argument('--threshold', type = float, default = 0.01, metavar = 'seconds',
+                        help = 'slowdowns of a phase shorter than this are ignored (0.01 by default)')
+    parser.add_argument('--repeat', type = int, default = 3, metavar = 'N',
+                        help = 'run each case N times and take the best times (3 by default)')
+    parser.add_argument('--seed', type = int, default = 1, help = 'seed of generators of synthetic configs')
+    parser.add_argument('--full', action = 'store_true', help = 'run cases with 10 MB of scroll text as well')
+    parser.add_argument('--cases', metavar = 'substring',
+                        help = 'run only cases whose names contain substring')
+    parser.add_argument('--samples', default = 'makedata.json', metavar = 'manifest.json',
+                        help = 'check that output of jobs of manifest is unchanged (makedata.json by default)')
+    parser.add_argument('--no-samples', action = 'store_true', help = 'do not check output of example jobs')
+    args = parser.parse_args(argv[1:])
+
+    failed = False
+    if not args.no_samples:
+        differences = check_samples(args.samples)
+        for p in differences:
+            print('SAMPLE DIFFERS  ' + p)
+        print('samples: ' + ('FAILED' if len(differences) != 0 else 'OK'))
+        failed = len(differences) != 0
+
+    selected_cases = [p for p in (cases if args.full else cases[:quick_cases])
+                      if args.cases == None or args.cases in p[0]]
+    results = run_benchmark(selected_cases, args.repeat, args.seed)
+
+    if args.output != None:
+        with open(args.output, encoding = 'utf-8', mode = 'w') as results_file:
+            json.dump({'version': ScrollPacker.version, 'python': platform.python_version(),
+                       'platform': platform.platform(), 'seed': args.seed, 'repeat': args.repeat,
+                       'cases': results}, results_file, indent = 4)
+            results_file.write('\n')
+
+    if args.baseline != None:
+        with open(args.baseline, encoding = 'utf-8', mode = 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_with_baseline(results, baseline, args.tolerance, args.threshold)
+        for p in regressions:
+            print('REGRESSION  ' + p)
+        print('baseline: ' + ('FAILED, ' + str(len(regressions)) + ' regression(s)' if len(regressions) != 0 else
+                              'OK'))
+        failed = failed or len(regressions) != 0
+
+    sys.stdout.flush()
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
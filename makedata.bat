@@ -1,11 +1,4 @@
-python ScrollPacker.py 1x1ScrollData1\1x1ScrollData1.json > 1x1ScrollData1\1X1DTA1.ASM
-python ScrollPacker.py 1x1ScrollData2\1x1ScrollData2.json > 1x1ScrollData2\1X1DTA2.ASM
-python ScrollPacker.py 1x1ScrollData3\1x1ScrollData3.json > 1x1ScrollData3\1X1DTA3.ASM
-python ScrollPacker.py 1x1ScrollData4\1x1ScrollData4.json > 1x1ScrollData4\1X1DTA4.ASM
-python ScrollPacker.py 2x2ScrollData1\2x2ScrollData1.json > 2x2ScrollData1\2X2DTA1.ASM
-python ScrollPacker.py 2x2ScrollData2\2x2ScrollData2.json > 2x2ScrollData2\2X2DTA2.ASM
-python ScrollPacker.py 2x2ScrollData3\2x2ScrollData3.json > 2x2ScrollData3\2X2DTA3.ASM
-python ScrollPacker.py 2x3ScrollData1\2x3ScrollData1.json > 2x3ScrollData1\2X3DTA1.ASM
+python ScrollPacker.py --batch makedata.json
 
 C:\jac\wudsn\Tools\ASM\MADS\mads.exe 1x1ScrollData1\1x1SCRL1.ASM -o:1x1ScrollData1\1X1SCRL1.XEX -p -t:1x1ScrollData1\1X1SCRL1.lab -l:1x1ScrollData1\1X1SCRL1.lst
 C:\jac\wudsn\Tools\ASM\MADS\mads.exe 1x1ScrollData2\1x1SCRL2.ASM -o:1x1ScrollData2\1X1SCRL2.XEX -p -t:1x1ScrollData2\1X1SCRL2.lab -l:1x1ScrollData2\1X1SCRL2.lst
@@ -0,0 +1,633 @@
+#!/usr/bin/env python
+#
+# Tests of "Scroll Packer", run by: python -m pytest
+# They pack the example directories, so they are run from the directory of ScrollPacker.py.
+
+import base64
+import copy
+import io
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import ScrollPacker
+import benchmark
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(autouse = True)
+def in_base_dir(monkeypatch, tmp_path):
+    monkeypatch.chdir(base_dir)
+    # compiled libraries and converted PNG fonts are never cached next to the examples
+    monkeypatch.setattr(ScrollPacker, 'library_cache_dir', str(tmp_path / 'cache'))
+
+
+def load_example(name):
+    # JSON file of example directory, with paths of font files (written for Windows) for this system.
+    scroll_data = ScrollPacker.load_json(os.path.join(name, name + '.json'))
+    for p in scroll_data['fonts']:
+        p['file'] = p['file'].replace('\\', os.sep)
+    return scroll_data
+
+
+def write_example(directory, name, **parameters):
+    # Example with given parameters changed, written into directory (with absolute paths of font files).
+    scroll_data = load_example(name)
+    scroll_data['parameters'].update(parameters)
+    for p in scroll_data['fonts']:
+        p['file'] = os.path.join(base_dir, p['file'])
+    filename = str(directory / (name + '.json'))
+    with open(filename, encoding = 'utf-8', mode = 'w') as json_file:
+        json.dump(scroll_data, json_file, ensure_ascii = False)
+    return filename
+
+
+
+def scroll_file_example(directory, name, **parameters):
+    # Example with its scroll text moved to "scroll_file" in directory, and given parameters changed.
+    scroll_data = load_example(name)
+    scroll_data['parameters'].update(parameters)
+    with open(str(directory / 'scroll.txt'), encoding = 'utf-8', mode = 'w', newline = '') as scroll_file:
+        scroll_file.write(''.join(scroll_data.pop('scroll')))
+    scroll_data['scroll_file'] = str(directory / 'scroll.txt')
+    return scroll_data
+
+def glyph(result, byte, offset):
+    # The 8 bytes of cell at given offset of character, read from its font file.
+    p = result['used_tags'][byte]
+    with open(p['file'], 'rb') as font_file:
+        return font_file.read()[p['offsets'][offset] * 8:p['offsets'][offset] * 8 + 8]
+
+
+def depack(compression):
+    # Unpacks scroll text data like the depacker emitted by emit_depacker().
+    data = compression['data']
+    output = bytearray()
+    position = 0
+    while data[position] != 0:
+        header = data[position]
+        if header < 0x80:
+            output += data[position + 1:position + 1 + header]
+            position += 1 + header
+        elif compression['codec'] == 'rle':
+            output += bytes([data[position + 1]]) * (header - 0x80)
+            position += 2
+        else:
+            for p in range(0, header - 0x80):
+                output.append(output[-data[position + 1] - 1])
+            position += 2
+    return bytes(output)
+
+
+@pytest.mark.parametrize('begin', [0, 5])
+def test_page_aligned_tables(begin):
+    scroll_data = load_example('1x1ScrollData1')
+    scroll_data['parameters'].update(page_aligned = True, begin = begin)
+    result = ScrollPacker.pack(scroll_data, None, 'x.json', True)
+    data = result['fonts'][0]
+    for table in ScrollPacker.page_aligned_tables(scroll_data, result['used_tags']):
+        start = table['page'] * 256 + table['offset']
+        # a table never crosses a page, so "lda table,x" takes no extra cycle
+        assert start // 256 == (start + len(result['used_tags']) - 1) // 256
+        for byte in range(0, len(result['used_tags'])):
+            assert data[start + byte] == glyph(result, byte, 0)[table['line']]
+
+
+@pytest.mark.parametrize('begin', [0, 5])
+@pytest.mark.parametrize('scroll', [None, ['{system}']])
+def test_page_aligned_labels_in_own_lines(begin, scroll):
+    scroll_data = load_example('1x1ScrollData1')
+    scroll_data['parameters'].update(page_aligned = True, begin = begin)
+    if scroll != None:
+        scroll_data['scroll'] = scroll
+    output = ScrollPacker.pack(scroll_data, None, 'x.json', True)['output']
+    labels = re.findall(r'^(fonts\d+_\d+_\d+|fontsen)\b(.*)$', output, re.MULTILINE)
+    assert len(labels) == 9
+    for label, rest in labels:
+        assert rest.startswith('\t.byte') or rest.startswith(' = * - ') or rest == ''
+    if scroll != None:
+        assert 'no characters in scroll text' in output
+
+
+@pytest.mark.parametrize('binary_name', [None, 'x'])
+def test_page_aligned_empty_scroll_text(binary_name):
+    scroll_data = load_example('1x1ScrollData1')
+    scroll_data['scroll'] = ['{system}']
+    scroll_data['parameters']['page_aligned'] = True
+    assert ScrollPacker.pack(scroll_data, None, 'x.json', True, binary_name)['fonts'] == [b'']
+
+
+def test_batch_reports_each_failure(tmp_path):
+    good = write_example(tmp_path, '1x1ScrollData1')
+    wrong = []
+    for p, content in enumerate(['{wrong', '3', '[1, 2]', '{"parameters": 5, "scroll": ["x"]}']):
+        wrong.append(str(tmp_path / ('wrong' + str(p) + '.json')))
+        with open(wrong[-1], encoding = 'utf-8', mode = 'w') as json_file:
+            json_file.write(content)
+    manifest = str(tmp_path / 'manifest.json')
+    with open(manifest, encoding = 'utf-8', mode = 'w') as json_file:
+        json.dump({'jobs': [{'json': good, 'output': str(tmp_path / 'good.asm')}, {'json': wrong[0]}]}, json_file)
+
+    jobs = ScrollPacker.load_batch_jobs(wrong + [good, manifest])
+    for p in jobs:
+        p['deterministic'] = True
+    summaries = ScrollPacker.pack_batch(jobs, 2)
+    assert [p['error'] != None for p in summaries] == [True, True, True, True, False, False, True]
+    with open(str(tmp_path / 'good.asm'), encoding = 'utf-8', mode = 'r') as output_file:
+        assert output_file.read() == ScrollPacker.pack_file(good, None, True)['output']
+
+
+def write_library(directory, scroll_data):
+    # Moves all font sets but the first one and all lookups of scroll data into a library in directory, with copies
+    # of font files.
+    fonts = []
+    for p in scroll_data['fonts'][1:]:
+        with open(p['file'], 'rb') as font_file, open(str(directory / os.path.basename(p['file'])), 'wb') as copy_file:
+            copy_file.write(font_file.read())
+        fonts.append(dict(p, file = str(directory / os.path.basename(p['file']))))
+    with open(str(directory / 'library.json'), encoding = 'utf-8', mode = 'w') as library_file:
+        json.dump({'fonts': fonts, 'lookups': scroll_data['lookups']}, library_file, ensure_ascii = False)
+    scroll_data['fonts'] = scroll_data['fonts'][:1]
+    del scroll_data['lookups']
+    scroll_data['library'] = str(directory / 'library.json')
+
+
+def test_library_equals_own_fonts_and_lookups(tmp_path, monkeypatch):
+    scroll_data = load_example('1x1ScrollData1')
+    expected = ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)['output']
+    write_library(tmp_path, scroll_data)
+    original = copy.deepcopy(scroll_data)
+    assert ScrollPacker.pack(scroll_data, None, 'x.json', True)['output'] == expected
+    assert scroll_data == original
+    assert len(os.listdir(str(tmp_path / 'cache'))) == 1
+
+    # library is read from its cache file, and compiled again when its font file changes
+    monkeypatch.setattr(ScrollPacker, 'libraries', {})
+    assert ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)['output'] == expected
+    font = str(tmp_path / 'simpleFonts1x1.fnt')
+    with open(font, 'r+b') as font_file:
+        font_file.write(bytes(range(0, 64)))
+    result = ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)
+    assert result['output'] != expected
+    used = [p for p in range(0, len(result['used_tags'])) if result['used_tags'][p]['file'] == font]
+    assert len(used) != 0
+    assert all(result['fonts'][0][p * 8:p * 8 + 8] == glyph(result, p, 0) for p in used)
+
+
+def test_watch_session_equals_pack(tmp_path):
+    scroll_data = load_example('2x2ScrollData1')
+    filename = str(tmp_path / 'scroll.json')
+    session = ScrollPacker.new_watch_session(filename, None, True)
+    changed = 0
+    for step in range(0, 4):
+        with open(filename, encoding = 'utf-8', mode = 'w') as json_file:
+            json.dump(scroll_data, json_file, ensure_ascii = False)
+        output, entry = ScrollPacker.update_watch_session(session)
+        assert output == ScrollPacker.pack_file(filename, None, True)['output']
+        assert entry == changed
+        # scroll text changes from a later entry, or from the first one
+        changed = (2 - step) % len(scroll_data['scroll'])
+        scroll_data['scroll'][changed] += ' '
+
+
+def test_cache(tmp_path, monkeypatch):
+    filename = write_example(tmp_path, '2x2ScrollData1')
+    cache_dir = str(tmp_path / 'outputs')
+    expected = ScrollPacker.pack_file(filename, None, True)['output']
+    assert ScrollPacker.pack_file(filename, None, True)['output'] == expected
+    assert ScrollPacker.pack_file_cached(filename, cache_dir, None, True) ==\
+           {'output': expected, 'language': 'Assembler', 'cached': False}
+    assert ScrollPacker.pack_file_cached(filename, cache_dir, None, True)['cached'] == True
+
+    # any change of source of the tool makes cached outputs obsolete
+    monkeypatch.setattr(ScrollPacker, 'source_hash', '0' * 64)
+    assert ScrollPacker.pack_file_cached(filename, cache_dir, None, True)['cached'] == False
+    assert ScrollPacker.pack_file_cached(filename, cache_dir, None, True)['cached'] == True
+    with open(filename, encoding = 'utf-8', mode = 'a') as json_file:
+        json_file.write('\n')
+    assert ScrollPacker.pack_file_cached(filename, cache_dir, None, True)['cached'] == False
+
+
+@pytest.mark.parametrize('parameters', [{}, {'dedup': True}, {'language': 'C'}])
+def test_binary_files_next_to_json_file(tmp_path, parameters):
+    filename = write_example(tmp_path, '2x2ScrollData1', **parameters)
+    process = subprocess.run([sys.executable, os.path.join(base_dir, 'ScrollPacker.py'), '--binary', '--deterministic',
+                              os.path.relpath(filename)], stdout = subprocess.PIPE, check = True)
+    expected = ScrollPacker.pack_file(filename, None, True)
+    result = ScrollPacker.pack_file(os.path.relpath(filename), None, True, '2x2ScrollData1')
+    assert process.stdout.decode('utf-8').replace('\r\n', '\n') == result['output']
+    data = {}
+    for p in result['binary']:
+        assert p['name'] in result['output']
+        with open(str(tmp_path / p['name']), 'rb') as binary_file:
+            data[p['name']] = binary_file.read()
+        assert data[p['name']] == p['data']
+    assert data['2x2ScrollData1_text.bin'] == expected['text']
+    assert [data['2x2ScrollData1_fonts' + str(p) + '.bin'] for p in range(0, len(expected['fonts']))] ==\
+           expected['fonts']
+
+
+def test_examples_unchanged():
+    assert benchmark.check_samples('makedata.json') == []
+
+
+def test_sample_job_without_output(tmp_path, monkeypatch):
+    filename = write_example(tmp_path, '1x1ScrollData1')
+    with open(str(tmp_path / 'manifest.json'), encoding = 'utf-8', mode = 'w') as json_file:
+        json.dump({'jobs': [{'json': os.path.basename(filename)}]}, json_file)
+    assert benchmark.check_samples(str(tmp_path / 'manifest.json')) ==\
+           ['1x1ScrollData1.json: output file "1x1ScrollData1.ASM" cannot be read']
+
+    # output file is named like in batch mode of the packer
+    monkeypatch.chdir(tmp_path)
+    ScrollPacker.pack_batch(ScrollPacker.load_batch_jobs([str(tmp_path / 'manifest.json')]), 1)
+    assert benchmark.check_samples(str(tmp_path / 'manifest.json')) == []
+
+
+@pytest.mark.parametrize('consolidation', [True, False])
+def test_dedup_cells_rebuild_fonts_data(consolidation):
+    scroll_data = load_example('2x2ScrollData1')
+    scroll_data['parameters'].update(dedup = True, consolidation = consolidation)
+    result = ScrollPacker.pack(scroll_data, None, 'x.json', True)
+    width = scroll_data['parameters']['width']
+    height = scroll_data['parameters']['height']
+    if consolidation:
+        offsets = [[row * width + column for byte in range(0, len(result['used_tags'])) for row in range(0, height)
+                    for column in range(0, width)]]
+    else:
+        offsets = [[row * width + column for byte in range(0, len(result['used_tags'])) for column in range(0, width)]
+                   for row in range(0, height)]
+    assert len(result['fonts']) == len(result['cells']) == len(offsets)
+    for data, indexes, table in zip(result['fonts'], result['cells'], offsets):
+        cells = [data[p:p + 8] for p in range(0, len(data), 8)]
+        # each cell is kept once, and indexes of all cells of all characters give their glyphs back
+        assert len(set(cells)) == len(cells) < len(table)
+        assert len(indexes) == len(table)
+        for p in range(0, len(table)):
+            assert cells[indexes[p]] == glyph(result, p // (len(table) // len(result['used_tags'])), table[p])
+
+
+@pytest.mark.parametrize('name', ['1x1ScrollData1', '2x2ScrollData1'])
+@pytest.mark.parametrize('parameters', [{}, {'streams': True}, {'compression': 'lz'}, {'language': 'C'}])
+@pytest.mark.parametrize('chunk_size', [3, 65536])
+def test_stream_equals_pack(tmp_path, monkeypatch, name, parameters, chunk_size):
+    scroll_data = load_example(name)
+    scroll_data['parameters'].update(parameters)
+    expected = ScrollPacker.pack(scroll_data, None, 'x.json', True)['output']
+    # tags and escapes of scroll text are split between chunks too
+    monkeypatch.setattr(ScrollPacker.iterate_scroll_text_chunks, '__defaults__', (None, chunk_size))
+    scroll_data = scroll_file_example(tmp_path, name, **parameters)
+    assert ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)['output'] == expected
+    output = io.StringIO()
+    ScrollPacker.pack_stream(scroll_data, output, None, 'x.json', True)
+    assert output.getvalue() == expected
+
+
+def test_validation_reports_all_errors():
+    scroll_data = load_example('1x1ScrollData1')
+    ScrollPacker.validate_config(scroll_data)
+    scroll_data['parameters']['width'] = 'x'
+    with pytest.raises(ScrollPacker.ConfigError) as error:
+        ScrollPacker.validate_config(scroll_data)
+    assert error.value.errors == [('parameters.width', 'Value of "width" is not an integer!')]
+    assert str(error.value) == 'parameters.width: Value of "width" is not an integer!'
+
+    scroll_data['parameters']['begin'] = -3
+    scroll_data['lookups'][0] = {}
+    with pytest.raises(ScrollPacker.ConfigError) as error:
+        ScrollPacker.pack(scroll_data, None, 'x.json', True)
+    paths = [p[0] for p in error.value.errors]
+    assert paths[:4] == ['parameters.width', 'parameters.begin', 'lookups[0]', 'lookups[0]']
+    assert all(p.endswith('.lookup') for p in paths[4:]) and len(paths) > 4
+    assert str(error.value).startswith(str(len(paths)) + ' errors found:\n')
+
+
+@pytest.mark.parametrize('compression, window', [('rle', None), ('lz', 16), ('lz', 64), ('lz', 256), ('auto', None)])
+def test_compression_round_trip(compression, window):
+    scroll_data = load_example('2x2ScrollData1')
+    scroll_data['parameters']['compression'] = compression
+    if window != None:
+        scroll_data['parameters']['window'] = window
+    result = ScrollPacker.pack(scroll_data, None, 'x.json', True)
+    text = ScrollPacker.scroll_text_bytes(scroll_data, result['output_scroll_data'], result['used_tags'])
+    if result['compression']['codec'] == 'none':
+        assert result['text'] == text
+    else:
+        assert result['text'] == result['compression']['data']
+        assert depack(result['compression']) == text
+
+
+def test_depacker_resets_ring_buffer():
+    scroll_data = load_example('1x1ScrollData1')
+    scroll_data['parameters'].update(compression = 'lz', window = 16)
+    output = ScrollPacker.pack(scroll_data, None, 'x.json', True)['output']
+    textinit = output.split('\ntextinit')[1].split('\trts')[0]
+    assert '\tsta textpos' in textinit
+
+
+@pytest.mark.parametrize('compression', ['rle', 'lz', 'auto'])
+def test_compression_of_empty_scroll_text(compression):
+    scroll_data = load_example('1x1ScrollData1')
+    scroll_data['scroll'] = ['{system}']
+    scroll_data['parameters']['compression'] = compression
+    assert '(n/a)' in ScrollPacker.pack(scroll_data, None, 'x.json', True)['output']
+
+
+@pytest.mark.parametrize('bank_size, bank_marker', [(12, 255), (40, 0)])
+def test_segmented_banks_decode_to_scroll_text(bank_size, bank_marker):
+    scroll_data = load_example('1x1ScrollData1')
+    scroll_data['parameters'].update(begin = 1, zero = True, segmented = True, bank_size = bank_size,
+                                     bank_marker = bank_marker)
+    result = ScrollPacker.pack(scroll_data, None, 'x.json', True)
+    segments = result['output_scroll_data']['segments']
+    assert len(segments) > 1 and len(result['fonts']) == len(segments)
+    assert all(len(p['tags']) <= bank_size for p in segments)
+
+    # markers switch banks, and code of each character addresses its glyph in fonts data of the current bank
+    text = result['text']
+    assert text[-1] == 0
+    characters = []
+    bank = None
+    position = 0
+    while position < len(text) - 1:
+        if text[position] == bank_marker:
+            bank = text[position + 1]
+            position += 2
+            continue
+        code = text[position] - 1
+        characters.append(segments[bank]['tags'][code])
+        assert result['fonts'][bank][code * 8:code * 8 + 8] == glyph(result, characters[-1], 0)
+        position += 1
+    assert characters == list(result['output_scroll_data']['bytes'])
+    del scroll_data['parameters']['segmented']
+    scroll_data['parameters']['begin'] = 0
+    unsegmented = ScrollPacker.pack(scroll_data, None, 'x.json', True)
+    assert [unsegmented['used_tags'][p]['tag'] for p in unsegmented['text'][:-1]] ==\
+           [result['used_tags'][p]['tag'] for p in characters]
+
+
+@pytest.mark.parametrize('parameters', [{}, {'dedup': True}, {'segmented': True, 'bank_size': 40}])
+def test_stats(parameters):
+    scroll_data = load_example('1x1ScrollData1')
+    scroll_data['parameters'].update(parameters)
+    stats = ScrollPacker.new_stats('x.json')
+    result = ScrollPacker.pack(scroll_data, None, 'x.json', True, None, stats)
+    assert [p['phase'] for p in stats['phases']] == ['library', 'validate', 'tokenize', 'load_fonts', 'layout',
+                                                     'fonts_data', 'text_data', 'emit_text', 'emit_fonts']
+    assert all(p['time'] >= 0 and p['peak_memory'] >= 0 for p in stats['phases'])
+    assert stats['unique_tags'] == len(result['used_tags']) == sum(p['unique_tags'] for p in stats['sets'])
+    assert sum(p['bytes'] for p in stats['sets']) == len(result['output_scroll_data']['bytes'])
+    assert stats['font_files'] == {'reads': len(stats['sets']), 'bytes': sum(os.path.getsize(p['file'])
+                                                                             for p in stats['sets'])}
+    counts = [p['count'] for p in stats['top_tags']]
+    assert counts == sorted(counts, reverse = True) and len(counts) == 20
+    assert counts[0] == max(list(result['output_scroll_data']['bytes']).count(p)
+                            for p in range(0, len(result['used_tags'])))
+    assert stats['text_bytes'] == len(result['text'])
+    cells = result['cells'] if result['cells'] != None else []
+    assert stats['fonts_bytes'] == sum(len(p) for p in result['fonts'] + [ScrollPacker.cells_bytes(r) for r in cells])
+    assert stats['banks'] == (len(result['segments']) if result['segments'] != None else None)
+
+
+def test_stream_stats_equal_pack_stats(tmp_path):
+    scroll_data = scroll_file_example(tmp_path, '1x1ScrollData1')
+    expected = ScrollPacker.new_stats()
+    ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True, None, expected)
+    stats = ScrollPacker.new_stats()
+    ScrollPacker.pack_stream(scroll_data, io.StringIO(), None, 'x.json', True, stats)
+    for p in ('font_files', 'unique_tags', 'sets', 'top_tags', 'text_bytes', 'fonts_bytes'):
+        assert stats[p] == expected[p]
+
+
+@pytest.mark.parametrize('parameters, chosen', [
+    ({'fonts_align': 256, 'begin': 3}, True),
+    ({'fonts_memory': [['$7000', '$7400'], ['$8000', '$8400']]}, False),
+    ({'dedup': True}, True),
+    ({'fonts_memory': [['$7000', '$7400'], ['$8000', '$8400']], 'dedup': True}, False)])
+def test_consolidation_auto(parameters, chosen):
+    scroll_data = load_example('2x2ScrollData1')
+    scroll_data['parameters'].update(consolidation = 'auto', **parameters)
+    if 'fonts_memory' in parameters:
+        del scroll_data['parameters']['fonts_org']
+    result = ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)
+    layout = result['layout']
+    assert layout['chosen']['consolidation'] == chosen
+    assert len(layout['layouts']) == 2
+
+    # sizes of planned tables are the sizes of fonts data packed with chosen consolidation
+    scroll_data['parameters']['consolidation'] = chosen
+    expected = ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)
+    assert result['fonts'] == expected['fonts'] and result['cells'] == expected['cells']
+    cells = result['cells'] if result['cells'] != None else [b''] * len(result['fonts'])
+    assert [p['size'] for p in layout['chosen']['blocks']] ==\
+           [len(p) + len(ScrollPacker.cells_bytes(r)) for p, r in zip(result['fonts'], cells)]
+    if not 'fonts_memory' in parameters:
+        assert layout['chosen']['bytes'] == min(p['bytes'] for p in layout['layouts'])
+        return
+
+    # each table is placed in a region of "fonts_memory" where it fits, and fonts data begins there
+    regions = [[int(p[1:], 16) for p in r] for r in parameters['fonts_memory']]
+    end = 0
+    for address, p in zip(layout['chosen']['addresses'], layout['chosen']['blocks']):
+        assert address >= end
+        assert any(r[0] <= address and address + p['size'] <= r[1] for r in regions)
+        assert '\torg $' + format(address, '04x') + '\n' in result['output']
+        end = address + p['size']
+
+
+def test_fonts_memory_too_small():
+    scroll_data = load_example('2x2ScrollData1')
+    scroll_data['parameters'].update(consolidation = 'auto', fonts_memory = [['$7000', '$7200']])
+    del scroll_data['parameters']['fonts_org']
+    with pytest.raises(ScrollPacker.ScrollTextError, match = 'does not fit'):
+        ScrollPacker.pack(scroll_data, None, 'x.json', True)
+
+
+@pytest.mark.parametrize('consolidation', [True, False])
+@pytest.mark.parametrize('parameters', [{}, {'dedup': True}, {'begin': 1, 'zero': True}])
+def test_column_streams_address_glyphs(consolidation, parameters):
+    scroll_data = load_example('2x2ScrollData1')
+    scroll_data['parameters'].update(streams = True, consolidation = consolidation, **parameters)
+    result = ScrollPacker.pack(scroll_data, None, 'x.json', True)
+    width = scroll_data['parameters']['width']
+    height = scroll_data['parameters']['height']
+    begin = scroll_data['parameters']['begin']
+    characters = result['output_scroll_data']['bytes']
+    assert len(result['streams']) == height
+    for row, stream in enumerate(result['streams']):
+        if parameters.get('zero', False):
+            assert stream[-1] == 0
+            stream = stream[:-1]
+        assert len(stream) == len(characters) * width
+        # each code of stream addresses the cell of its column and row in fonts data (its unique cell with "dedup")
+        table = result['fonts'][0 if consolidation else row]
+        for position, code in enumerate(stream):
+            cell = code - begin
+            assert table[cell * 8:cell * 8 + 8] ==\
+                   glyph(result, characters[position // width], row * width + position % width)
+
+
+@pytest.mark.parametrize('name, image', [
+    ('simpleFonts1x1.fnt', {'cell_width': 32, 'cell_height': 32}),
+    ('wireFonts2x2Normal.fn2', {'cell_width': 32, 'cell_height': 32, 'interleave': 2}),
+    ('colorFonts2x3SpecialCharacters.fnt', {'cell_width': 32, 'cell_height': 32, 'bits': 2,
+                                            'palette': {'#808080': 0, '#ffff00': 1, '#008000': 2, '#0000ff': 3}})])
+@pytest.mark.parametrize('vectorized', [True, False])
+def test_png_font_equals_font_file(monkeypatch, name, image, vectorized):
+    if not vectorized:
+        monkeypatch.setattr(ScrollPacker, 'numpy', None)
+    png = os.path.join('Fonts', os.path.splitext(name)[0] + '.png')
+    with open(png, 'rb') as png_file, open(os.path.join('Fonts', name), 'rb') as font_file:
+        assert ScrollPacker.convert_font_image(png_file.read(), png, image) == font_file.read()
+
+
+def test_png_fonts_packed_and_cached(tmp_path, monkeypatch):
+    scroll_data = load_example('1x1ScrollData1')
+    expected = ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)
+    for p in scroll_data['fonts']:
+        if os.path.basename(p['file']) != 'systemFonts1x1.fnt':
+            p['file'] = os.path.splitext(p['file'])[0] + '.png'
+            p['image'] = {'cell_width': 32, 'cell_height': 32}
+    result = ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)
+    assert result['fonts'] == expected['fonts'] and result['text'] == expected['text']
+    assert len(os.listdir(str(tmp_path / 'cache'))) == 3
+
+    # converted fonts are read from cache files
+    monkeypatch.setattr(ScrollPacker, 'font_images_cache', {})
+    monkeypatch.setattr(ScrollPacker, 'convert_font_image', None)
+    assert ScrollPacker.pack(scroll_data, None, 'x.json', True)['fonts'] == expected['fonts']
+
+
+@pytest.mark.parametrize('vectorized', [True, False])
+def test_preview_pixels_equal_glyphs(monkeypatch, vectorized):
+    if not vectorized:
+        monkeypatch.setattr(ScrollPacker, 'numpy', None)
+    scroll_data = load_example('1x1ScrollData2')
+    result = ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)
+    pixels = ScrollPacker.preview(scroll_data, None, 1, 16)
+    rows = pixels.tolist() if vectorized else pixels
+    characters = result['output_scroll_data']['bytes']
+    assert len(rows) == (len(characters) + 15) // 16 * 8 and all(len(p) == 16 * 8 for p in rows)
+    # characters with bit 7 of "or" set are inverse
+    assert any(p & 0x80 != 0 for p in result['output_scroll_data']['or'])
+    for position, byte in enumerate(characters):
+        inverse = 1 if result['output_scroll_data']['or'][position] & 0x80 != 0 else 0
+        cell = glyph(result, byte, 0)
+        for y in range(0, 8):
+            assert rows[position // 16 * 8 + y][position % 16 * 8:position % 16 * 8 + 8] ==\
+                   [(cell[y] >> (7 - x) & 1) ^ inverse for x in range(0, 8)]
+
+
+def test_preview_of_2_bits_fonts_written_as_png(tmp_path, monkeypatch):
+    filename = write_example(tmp_path, '2x3ScrollData1')
+    scroll_data = ScrollPacker.load_json(filename)
+    pixels = ScrollPacker.preview(copy.deepcopy(scroll_data), None, 2).tolist()
+    monkeypatch.setattr(ScrollPacker, 'numpy', None)
+    assert ScrollPacker.preview(scroll_data, None, 2) == pixels
+    assert len(set(r for p in pixels for r in p)) > 2 and len(pixels[0]) == 320
+
+    subprocess.run([sys.executable, os.path.join(base_dir, 'ScrollPacker.py'), '--preview', str(tmp_path / 'x.png'),
+                    '--preview-bits', '2', filename], check = True)
+    with open(str(tmp_path / 'x.png'), 'rb') as png_file:
+        png = ScrollPacker.decode_png(png_file.read(), 'x.png')
+    assert png['palette'] == list(ScrollPacker.preview_palettes[2])
+    assert [list(p) for p in png['rows']] == pixels
+
+
+def test_shared_scrolls_equal_own_scrolls():
+    scroll_datas = [load_example('2x2ScrollData1'), load_example('2x2ScrollData2')]
+    scroll_datas[0]['parameters']['consolidation'] = scroll_datas[1]['parameters']['consolidation']
+    result = ScrollPacker.pack_shared(copy.deepcopy(scroll_datas), None, ['1.json', '2.json'], True)
+    own = [ScrollPacker.pack(p, None, 'x.json', True) for p in scroll_datas]
+    # characters used by both scrolls are in shared fonts data once
+    assert max(len(p['used_tags']) for p in own) < len(result['used_tags']) < sum(len(p['used_tags']) for p in own)
+    for expected, output_scroll_data in zip(own, result['output_scroll_data']):
+        characters = output_scroll_data['bytes']
+        assert len(characters) == len(expected['output_scroll_data']['bytes'])
+        assert [glyph(result, p, 0) + glyph(result, p, 3) for p in characters] ==\
+               [glyph(expected, p, 0) + glyph(expected, p, 3) for p in expected['output_scroll_data']['bytes']]
+
+
+def test_shared_unique_characters():
+    scroll_datas = [load_example('2x2ScrollData1'), load_example('2x2ScrollData2')]
+    scroll_datas[0]['parameters']['consolidation'] = scroll_datas[1]['parameters']['consolidation']
+    result = ScrollPacker.pack_shared(scroll_datas, None, ['1.json', '2.json'], True)
+    for scroll_data, text in zip(scroll_datas, result['texts']):
+        unique = len(ScrollPacker.pack(copy.deepcopy(scroll_data), None, 'x.json', True)['used_tags'])
+        assert 'unique characters: ' + str(unique) + ', shared fonts characters: ' +\
+               str(len(result['used_tags'])) in text
+
+
+def serve_requests(state, requests):
+    # Responses of server to requests given as JSON lines (or as lines of text, when they are strings).
+    output = io.StringIO()
+    ScrollPacker.serve_lines(state, io.StringIO(''.join((p if type(p) == str else json.dumps(p)) + '\n'
+                                                        for p in requests)), output)
+    return [json.loads(p) for p in output.getvalue().splitlines()]
+
+
+def test_serve_requests(tmp_path):
+    filename = write_example(tmp_path, '2x2ScrollData1')
+    expected = ScrollPacker.pack_file(filename, None, True)
+    binary = ScrollPacker.pack_file(filename, None, True, '2x2ScrollData1')['binary']
+    output = str(tmp_path / 'x.asm')
+    state = ScrollPacker.new_serve_state(None, True)
+    responses = serve_requests(state, [{'id': 1, 'json': filename}, {'id': 2, 'json': filename, 'binary': True},
+                                       {'id': 'x', 'json': filename, 'binary': True},
+                                       {'json': filename, 'output': output}, {'json': filename, 'output': output},
+                                       {'id': 3, 'json': 'missing.json'}, {'id': 4, 'json': filename, 'binary': 'yes'},
+                                       'wrong', '[]'])
+    assert [(p['id'], p['status']) for p in responses] ==\
+           [(1, 'OK'), (2, 'OK'), ('x', 'CACHED'), (None, 'OK'), (None, 'SKIPPED'), (3, 'FAILED'), (None, 'FAILED'),
+            (None, 'FAILED'), (None, 'FAILED')]
+    assert responses[0]['source'] == expected['output'] and responses[0]['error'] == None
+    for p in responses[1:3]:
+        assert [(r['name'], base64.b64decode(r['data'])) for r in p['binary']] ==\
+               [(r['name'], r['data']) for r in binary]
+    assert responses[3]['output'] == output and not 'source' in responses[3]
+    with open(output, encoding = 'utf-8', mode = 'r') as output_file:
+        assert output_file.read() == expected['output']
+    assert 'missing.json' in responses[5]['error']
+    assert all(p['error'] != None for p in responses[5:])
+
+    # a changed JSON file is packed again
+    scroll_data = ScrollPacker.load_json(filename)
+    scroll_data['scroll'][0] += ' '
+    with open(filename, encoding = 'utf-8', mode = 'w') as json_file:
+        json.dump(scroll_data, json_file, ensure_ascii = False)
+    responses = serve_requests(state, [{'json': filename}, {'json': filename, 'binary': True}])
+    assert [p['status'] for p in responses] == ['OK', 'OK']
+    assert responses[0]['source'] == ScrollPacker.pack_file(filename, None, True)['output'] != expected['output']
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason = 'Unix sockets are not supported')
+def test_serve_socket(tmp_path):
+    filename = write_example(tmp_path, '1x1ScrollData1')
+    socket_path = str(tmp_path / 'packer.sock')
+    server = subprocess.Popen([sys.executable, os.path.join(base_dir, 'ScrollPacker.py'), '--serve', socket_path,
+                               '--deterministic'], stderr = subprocess.DEVNULL)
+    try:
+        for attempt in range(0, 100):
+            if os.path.exists(socket_path) or server.poll() != None:
+                break
+            time.sleep(0.1)
+        # connections are answered one after another
+        for request in range(0, 2):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socket_path)
+                with client.makefile(encoding = 'utf-8', mode = 'rw', newline = '\n') as stream:
+                    stream.write(json.dumps({'id': request, 'json': filename}) + '\n')
+                    stream.flush()
+                    response = json.loads(stream.readline())
+            assert response['id'] == request and response['status'] == 'OK'
+            assert response['source'] == ScrollPacker.pack_file(filename, None, True)['output']
+    finally:
+        server.terminate()
+        server.wait()